@@ -0,0 +1,204 @@
+import argparse
+import errno
+import fcntl
+import os
+import shutil
+from itertools import islice
+
+
+# files the simulation only ever reads: hardlinked into every run. Every other file (.last, which the
+# simulation overwrites, and files of unknown type) is cloned (or copied) so every run has its own
+READ_ONLY = {".run", ".ic"}
+
+# files the simulation writes afresh for every run (a restart overwrites them): left out unless
+# --copy_outputs is passed
+OUTPUTS = {".en", ".sd", ".sq", ".gr", ".vis", ".mass", ".out"}
+
+# ioctl request for cloning a file (reflink) on filesystems with copy-on-write, e.g. btrfs and xfs
+FICLONE = 0x40049409
+
+
+def clone_or_copy(src, dst):
+    """
+    Reflink `src` to `dst` where the filesystem supports it, copy it otherwise
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "cloned"
+        except OSError:
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+            return "copied"
+
+
+def link_or_copy(src, dst):
+    """
+    Hardlink `src` to `dst`, copying it when hardlinks are not possible (e.g. across filesystems)
+    """
+    try:
+        os.link(src, dst)
+        return "linked"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copyfile(src, dst)
+        return "copied"
+
+
+def up_to_date(src, dst):
+    """
+    Whether `dst` already holds the read-only input `src`: the same inode (hardlink), or a copy
+    at least as new
+    """
+    if not os.path.exists(dst):
+        return False
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    if os.path.samestat(src_stat, dst_stat):
+        return True
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns >= src_stat.st_mtime_ns
+
+
+def write_if_changed(path, text):
+    """
+    Write `text` to `path` unless the file already holds exactly that text
+    """
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return "kept"
+    except FileNotFoundError:
+        pass
+    with open(path, "w") as f:
+        f.write(text)
+    return "written"
+
+
+def edit_config(text, passes, blocks):
+    """
+    The edits of run_ensemble.sh, in memory: drop empty lines, set 'PASS <passes> <blocks>'
+    and add the RESTART directive if it is missing
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    lines = [f"PASS {passes} {blocks}" if line.split()[0] == "PASS" else line for line in lines]
+    if "RESTART" not in lines:
+        lines.append("RESTART")
+    return "\n".join(lines) + "\n"
+
+
+def read_seed_bank(seed_bank, last):
+    """
+    Lines 1 to `last` of the packed seed bank, read once for all the runs: line n is the seed of run n
+    """
+    with open(seed_bank) as f:
+        bank = list(islice(f, last))
+    if len(bank) < last:
+        raise ValueError(f"The seed bank {seed_bank} has no seed number {last}")
+    return bank
+
+
+def read_seed(run, bank, seed_dir):
+    """
+    Seed of a run: line `run` of the seed bank lines from read_seed_bank, or the file seed<run>.iseed
+    """
+    if bank is not None:
+        return "\n".join(bank[run - 1].split()) + "\n"
+
+    with open(os.path.join(seed_dir, f"seed{run}.iseed")) as f:
+        return f.read()
+
+
+def fan_out(source, runs, passes, blocks, seed_bank, seed_dir, copy_outputs=False, verbose=False):
+    """
+    Create (or bring up to date) the run directories <source>/ensemble/run_<n>
+
+    source - directory of the simulation to branch off
+    runs - run numbers to create
+    passes, blocks - passes per block and number of blocks of every run
+    seed_bank - packed seed bank written by generate_seeds.py --bank (or None)
+    seed_dir - directory with the files seed<n>.iseed, used without a seed bank
+    copy_outputs - also copy the output files of the source simulation into the runs
+
+    return:
+    actions - number of files per action taken ('linked', 'cloned', 'copied', 'written', 'kept', ...)
+    """
+    source = os.path.normpath(source)
+    name = os.path.basename(source)
+    ensemble_dir = os.path.join(source, "ensemble")
+
+    # top-level files of the source, following symlinks as `find -L -maxdepth 1 -type f` does
+    inputs = []
+    config_text = None
+    for entry in os.scandir(source):
+        if not entry.is_file():
+            continue
+        extension = os.path.splitext(entry.name)[1]
+        if extension == ".iseed":
+            continue
+        if extension == ".sy":
+            with open(entry.path) as f:
+                config_text = f.read()
+            config_name = entry.name
+            continue
+        if extension in OUTPUTS and not copy_outputs:
+            continue
+        inputs.append((entry.name, os.path.realpath(entry.path), extension))
+
+    if config_text is None:
+        raise ValueError(f"No .sy file found in {source}")
+    config_text = edit_config(config_text, passes, blocks)
+
+    bank = read_seed_bank(seed_bank, max(runs)) if seed_bank and runs else None
+
+    actions = {}
+    for run in runs:
+        run_dir = os.path.join(ensemble_dir, f"run_{run}")
+        os.makedirs(run_dir, exist_ok=True)
+
+        for filename, path, extension in inputs:
+            dst = os.path.join(run_dir, filename)
+            if extension not in READ_ONLY:
+                # once a run has started these are its own: never overwrite them
+                action = "kept" if os.path.exists(dst) else clone_or_copy(path, dst)
+            elif up_to_date(path, dst):
+                action = "kept"
+            else:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                action = link_or_copy(path, dst)
+            actions[action] = actions.get(action, 0) + 1
+
+        # the simulation saves the state of its generator into the seed file, so an existing one is kept
+        seed_file = os.path.join(run_dir, f"{name}.iseed")
+        action = "kept" if os.path.exists(seed_file) else write_if_changed(seed_file, read_seed(run, bank, seed_dir))
+        actions[action] = actions.get(action, 0) + 1
+
+        action = write_if_changed(os.path.join(run_dir, config_name), config_text)
+        actions[action] = actions.get(action, 0) + 1
+
+        if verbose:
+            print(f"prepared {run_dir}")
+
+    return actions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", help="directory of the simulation to branch the ensemble off")
+    parser.add_argument("--first", type=int, help="first run number", default=1)
+    parser.add_argument("--last", type=int, help="last run number")
+    parser.add_argument("--blocks", type=int, help="number of blocks of every run")
+    parser.add_argument("--passes", type=int, help="number of passes per block of every run")
+    parser.add_argument("--seed_bank", help="packed seed bank (generate_seeds.py --bank): line n is the seed of run n")
+    parser.add_argument("--seed_dir", help="directory with the seed files seed<n>.iseed, used without a seed bank")
+    parser.add_argument("--copy_outputs", action="store_true", help="also copy the output files (.en, .sd, ...) of the source", default=False)
+    parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
+    args = parser.parse_args()
+
+    if not args.seed_bank and not args.seed_dir:
+        raise ValueError("Please pass either --seed_bank or --seed_dir")
+
+    actions = fan_out(args.source, range(args.first, args.last + 1), args.passes, args.blocks,
+                      args.seed_bank, args.seed_dir, args.copy_outputs, args.verbose)
+
+    print(f"Ensemble runs {args.first}-{args.last} of {args.source}: "
+          + ", ".join(f"{count} {action}" for action, count in sorted(actions.items())))
@@ -1,37 +1,73 @@
 import argparse
+import os
 import numpy as np
 
 
-def create_seed(seed_num):
+# constants of the state of the Marsaglia-Zaman generator, identical in every seed file
+C = 362436/16777216
+CD = 7654321/16777216
+CM = 16777213/16777216
 
-    np.set_printoptions(precision=12)
 
-    data = np.zeros(100)
-    u = np.random.rand(97)
-    c = 362436/16777216
-    cd = 7654321/16777216
-    cm = 16777213/16777216
-    sampled = np.random.choice(range(1,98), size=2, replace=False)
-    i = sampled[0]
-    j = sampled[1]
+def create_seeds(num, seed=None):
+    """
+    Draw the states of `num` random number generators at once
 
-    data[:97] = u
-    data[97] = c
-    data[98] = cd
-    data[99] = cm
+    num - number of seeds
+    seed - entropy of the root SeedSequence: the same value gives the same seeds, and seed k does
+           not depend on `num`, so a bigger batch extends a smaller one
 
-    return i, j, data
+    return:
+    i, j - the two distinct lags (in 1..97) of every seed
+    data - the 100 floating point entries of every seed: 97 uniform variates, then c, cd and cm
+    entropy - entropy of the root SeedSequence, to reproduce the seeds
+    """
+    root = np.random.SeedSequence(seed)
+    rng = np.random.default_rng(root.spawn(1)[0])
+
+    # one row of variates per seed: 97 for the table, 2 for the lags
+    variates = rng.random((num, 99))
+
+    data = np.empty((num, 100))
+    data[:, :97] = variates[:, :97]
+    data[:, 97] = C
+    data[:, 98] = CD
+    data[:, 99] = CM
+
+    # two distinct lags drawn uniformly: j skips over the value taken by i
+    i = 1 + np.floor(variates[:, 97] * 97).astype(int)
+    j = 1 + np.floor(variates[:, 98] * 96).astype(int)
+    j[j >= i] += 1
+
+    if len(np.unique(variates[:, :97], axis=0)) != num:
+        raise ValueError("Duplicate seeds were drawn, please generate them again")
+
+    return i, j, data, root.entropy
+
+
+def format_seed(i, j, data):
+    return ("%2.12e\n" * len(data)) % tuple(data) + f"{i}\n{j}\n"
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--outdir", help="name of output directory with seed files")
     parser.add_argument("--num", type=int, help="number of random seeds to generate")
+    parser.add_argument("--seed", type=int, help="entropy for reproducing a set of seeds (default: fresh entropy)", default=None)
+    parser.add_argument("--bank", help="also write all the seeds into this file, one seed per line (line k is seed k)")
     args = parser.parse_args()
 
-    for ind in range(args.num):
-        i, j, seed_data = create_seed(ind+1)
-        np.savetxt(args.outdir + f"/seed{ind+1}.iseed", seed_data.T, fmt="%2.12e")
-        with open(args.outdir + f"/seed{ind+1}.iseed", "a") as file:
-            file.write(f"{i}\n")
-            file.write(f"{j}\n")
+    i, j, seed_data, entropy = create_seeds(args.num, args.seed)
+    print(f"Generated {args.num} seeds with entropy {entropy}")
+
+    seeds = [format_seed(i[ind], j[ind], seed_data[ind]) for ind in range(args.num)]
+
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+        for ind, text in enumerate(seeds):
+            with open(args.outdir + f"/seed{ind+1}.iseed", "w") as file:
+                file.write(text)
+
+    if args.bank:
+        with open(args.bank, "w") as file:
+            file.write("".join(text.replace("\n", " ").rstrip() + "\n" for text in seeds))
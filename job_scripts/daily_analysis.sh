@@ -71,6 +71,17 @@ echo "# parameter  sf_fraction  error" > "$EXTRAPOLATED"
 ENERGIES="$DIR/energy_dependence"
 echo "# parameter kinetic kinetic_err potential potential_err total total_err" > "$ENERGIES"
 
+# every fit, block average and extrapolation is also recorded in an SQLite results database, e.g.
+# python results_db.py --db "$RESULTS_DB" --observable sf_time --parameter C --latest > table.tsv
+RESULTS_DB="$DIR/results.sqlite"
+
+# lists of the bootstrap samples saved for every ensemble: the final extrapolation fits these sample
+# by sample (see extrapolate_samples.py), so its error includes everything propagated from the ensembles
+SF_SAMPLES_LIST="$DIR/sf_samples_list"
+echo "# parameter  samples_file" > "$SF_SAMPLES_LIST"
+EN_SAMPLES_LIST="$DIR/energy_samples_list"
+echo "# parameter  samples_file" > "$EN_SAMPLES_LIST"
+
 # -------------------------- #
 #    BEGIN FILE COMBINING    #
 # -------------------------- #
@@ -85,6 +96,14 @@ do
     # count the number of runs in the directory
     NUM_RUNS=$(find "$dir_path" -maxdepth 1 -type d -name "run_*" | wc -l)
 
+    # quick scan of the run outputs (headers and tails only): crashed, truncated or half-written runs
+    # are written to a quarantine list, which the combiners below leave out
+    QUARANTINE="$dir_path/quarantine"
+    python $USER/scratch/scripts/postprocessing/health_check.py --dirname "$dir_path" \
+                                                                --output "$QUARANTINE" \
+                                                                --cores "$SLURM_CPUS_PER_TASK" \
+                                                                --verbose
+
     # ------------------------------- #
     #    BEGIN SUPERFLUID FRACTION    #
     # ------------------------------- #
@@ -132,7 +151,8 @@ do
     echo "using $NUM_BLOCKS blocks with $BLOCK_SIZE runs per block"
     python $USER/scratch/scripts/postprocessing/combine_files_all_runs.py --blocksize "$BLOCK_SIZE" \
                                                                           --dirname "$dir_path" \
-                                                                          --extension ".sd"
+                                                                          --extension ".sd" \
+                                                                          --quarantine "$QUARANTINE"
 
     # plot the averaged S(t)
     echo "plotting the averaged superfluid fraction > sf_fractions_combined.png"
@@ -148,6 +168,8 @@ do
                                                                            --bootstrap_iterations=100000 \
                                                                            --cores="$SLURM_CPUS_PER_TASK" \
                                                                            --save \
+                                                                           --samples_file="$dir_path/sf_bootstrap_samples.npz" \
+                                                                           --db="$RESULTS_DB" \
                                                                            --method=bootstrap)
 
     # Python script outputs the path of the original file as the first field, so we have to extract the value
@@ -157,6 +179,16 @@ do
 
     echo "$MODIFIED_OUTPUT" >> "$EXTRAPOLATED"
 
+    # independent variate of the final extrapolation: projection time for 'beta_*' directories,
+    # time step (beta / slices) for 'slices_*' directories
+    if [[ "$dir" == slices_* ]]; then
+        BETA=$(awk '$1 == "BETA" {print $2}' "$dir_path"/run_1/*.sy)
+        X_VALUE=$(python -c "print($BETA / $VALUE)")
+    else
+        X_VALUE="$VALUE"
+    fi
+    echo "$X_VALUE $dir_path/sf_bootstrap_samples.npz" >> "$SF_SAMPLES_LIST"
+
     # --------------------------- #
     #   END SUPERFLUID FRACTION   #
     # --------------------------- #
@@ -172,7 +204,7 @@ do
     printf "\n"
 
     # average energies over different runs within ensemble -- outputs a 'energies_combined' file
-    python $USER/scratch/scripts/postprocessing/combine_files_all_runs.py --dirname "$dir_path" --extension ".en"
+    python $USER/scratch/scripts/postprocessing/combine_files_all_runs.py --dirname "$dir_path" --extension ".en" --quarantine "$QUARANTINE"
 
     # plot the energies therein
     AVGED_ENERGIES="$dir_path/energies_combined"
@@ -188,12 +220,15 @@ do
     OUTPUT=$(python $USER/scratch/scripts/postprocessing/block_average.py --filename "$dir_path/energies_combined" \
                                                                           --throwaway 0 \
                                                                           --block_size 20 \
-                                                                          --indices '1,2,3')
+                                                                          --indices '1,2,3' \
+                                                                          --samples_file "$dir_path/energy_samples.npz" \
+                                                                          --db "$RESULTS_DB")
 
     VALUE=$(echo "$dir" | cut -d '_' -f 2)
     MODIFIED_OUTPUT=$(echo "$OUTPUT" | awk -v new_val="$VALUE" '{$1 = new_val}1')
 
     echo "$MODIFIED_OUTPUT" >> "$ENERGIES"
+    echo "$X_VALUE $dir_path/energy_samples.npz" >> "$EN_SAMPLES_LIST"
     
     # --------------------- #
     #   END ENERGETICS      #
@@ -210,7 +245,7 @@ do
     printf "\n"
 
     # try to calculate a weighted average of structure factor
-    python $USER/scratch/scripts/postprocessing/combine_files_all_runs.py --dirname "$dir_path" --extension ".sq"
+    python $USER/scratch/scripts/postprocessing/combine_files_all_runs.py --dirname "$dir_path" --extension ".sq" --quarantine "$QUARANTINE"
 
     # plot the structure factor therein
     AVGED_SQ="$dir_path/sq_combined"
@@ -228,6 +263,39 @@ done
 #   END FILE COMBINING   #
 # ---------------------- #
 
+# ----------------------------- #
+#   BEGIN FINAL EXTRAPOLATION   #
+# ----------------------------- #
+
+# extrapolate to zero time step or infinite projection time, one fit per joint bootstrap sample
+if find "$DIR" -maxdepth 1 -type d -name "slices_*" | grep -q .; then
+    SF_MODEL="en_time_step"
+    EN_MODEL="en_time_step"
+else
+    SF_MODEL="sf_proj_time"
+    EN_MODEL="en_proj_time"
+fi
+
+echo "extrapolating superfluid fraction samples with $SF_MODEL > extrapolated_sf_propagated"
+python $USER/scratch/scripts/postprocessing/extrapolate_samples.py --list "$SF_SAMPLES_LIST" \
+                                                                   --filetype "$SF_MODEL" \
+                                                                   --db "$RESULTS_DB" \
+                                                                   > "$DIR/extrapolated_sf_propagated" \
+    || echo "could not extrapolate the superfluid fraction samples"
+
+# the last column of the energy samples is the total energy
+echo "extrapolating total energy samples with $EN_MODEL > extrapolated_energy_propagated"
+python $USER/scratch/scripts/postprocessing/extrapolate_samples.py --list "$EN_SAMPLES_LIST" \
+                                                                   --filetype "$EN_MODEL" \
+                                                                   --column -1 \
+                                                                   --db "$RESULTS_DB" \
+                                                                   > "$DIR/extrapolated_energy_propagated" \
+    || echo "could not extrapolate the total energy samples"
+
+# --------------------------- #
+#   END FINAL EXTRAPOLATION   #
+# --------------------------- #
+
 # ---------------------- #
 #   BEGIN VISUALIZATION  #
 # ---------------------- #
@@ -258,7 +326,8 @@ gnuplot -e "directory='$DIR'" $USER/scratch/scripts/postprocessing/plot_sq_curve
 echo "creating plots for each and every run"
 if [ -n "$SLURM_JOB_ID" ]; then
     echo "Script was submitted as SLURM job, plotting all files"
-    find "$DIR" -type d -name "run_*" -exec "$USER/scratch/scripts/job_scripts/plot_files.sh" {} \;
+    # all runs at once over a process pool, only redrawing images older than their source file
+    python $USER/scratch/scripts/postprocessing/render_plots.py --dirname "$DIR" --cores "${SLURM_CPUS_PER_TASK:-1}"
 fi
 
 # plot the total energy dependence versus variations in parameter
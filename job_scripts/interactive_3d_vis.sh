@@ -21,7 +21,12 @@ file=$(basename "$filepath")
 
 echo "Attempting 3d visualization of $current/$file"
 
-gnuplot --persist -e "splot '"$current/$file"' w points t 'helium'; \
+# plot a bounded, evenly decimated subset of the beads: gnuplot grinds on the full file for big systems
+decimated="${file%.*}_decimated.dat"
+python "$user/scratch/scripts/postprocessing/vis_density.py" --filenames "$current/$file" --max_points 20000 \
+    || { echo "Decimation failed, plotting the full file" ; decimated="$file"; }
+
+gnuplot --persist -e "splot '"$current/$decimated"' w points t 'helium'; \
                       replot '"$current/initial.c.ic"' lt 7 lc 'black' t 'carbon'; \
                       set xlabel 'X' font ',13'; \
                       set ylabel 'Y' font ',13'; \
@@ -71,29 +71,39 @@ echo -e "Starting an ensemble run for $NAME with random seed no. $SEED_NUMBER\n"
 ENSEMBLE_DIR="$SOURCEPATH/ensemble"
 mkdir -p "$ENSEMBLE_DIR"
 
-# now, we need to copy over the files at $CHOICE_DIR, making a parent directory along with subdirectories
-# to hold results from individual workers in the job array
+# build all the run directories of the array in one pass: read-only inputs (.run, .ic) are hardlinked,
+# the .last file and any other file is reflinked (or copied), the .sy (PASS/RESTART edits applied) and
+# .iseed files are written fresh, and the outputs of the source (.en, .vis, ...), which every run
+# writes anew, are left out. The first array task does the work while holding the lock, the others
+# find their directory already in place
 NEW="$ENSEMBLE_DIR/run_$SLURM_ARRAY_TASK_ID"
-mkdir -p "$NEW"
-# don't copy subdirectories such as /images
-find -L "$SOURCEPATH" -maxdepth 1 -type f -not -path '*.iseed' -exec cp {} "$NEW" \;
-
-# now, we have to replace the random seed file
-cp "$USER/scratch/random_seeds/seeds_from_2d_helium_2/seed$SEED_NUMBER.iseed" "$NEW"
-# changing the name of the random seed file to be the same as the parent directory is necessary
-mv "$NEW/seed$SEED_NUMBER.iseed" "$NEW/$NAME.iseed"
-
-CONFIG_FILE="$NEW/$NAME.sy"
-# first, remove any empty lines in the config file
-sed -i '/^\s*$/d' "$CONFIG_FILE"
-# change the number of blocks and passes
-sed -i "s/$(grep "PASS" "$CONFIG_FILE")/PASS $PASSES_PER_BLOCK $NUMBER_OF_BLOCKS/" "$CONFIG_FILE"
-# then add the RESTART directive if not already present
-grep -qxF 'RESTART' "$CONFIG_FILE" || echo 'RESTART' >> "$CONFIG_FILE"
+
+# take the seeds from the packed seed bank (generate_seeds.py --bank) if there is one
+SEED_BANK="$USER/scratch/random_seeds/seed_bank.txt"
+if [ -f "$SEED_BANK" ]; then
+    SEED_SOURCE=(--seed_bank "$SEED_BANK")
+else
+    SEED_SOURCE=(--seed_dir "$USER/scratch/random_seeds/seeds_from_2d_helium_2")
+fi
+
+flock "$ENSEMBLE_DIR/.fan_out.lock" \
+    python "$USER/scratch/scripts/auxiliary_scripts/fan_out_ensemble.py" --source "$SOURCEPATH" \
+        --first "${SLURM_ARRAY_TASK_MIN:-$SEED_NUMBER}" --last "${SLURM_ARRAY_TASK_MAX:-$SEED_NUMBER}" \
+        --blocks "$NUMBER_OF_BLOCKS" --passes "$PASSES_PER_BLOCK" "${SEED_SOURCE[@]}" \
+    || { echo "Could not prepare $NEW" ; exit 1; }
+
+# monitor_convergence.py writes a stop marker once the ensemble errors reach their targets
+if [ -f "$ENSEMBLE_DIR/STOP" ]; then
+    echo "The ensemble has converged ($ENSEMBLE_DIR/STOP exists), not starting run $SEED_NUMBER"
+    exit 0
+fi
 
 # start the simulation
 cd "$NEW" || exit 1
 DIR=$(pwd)
+
+# record the job ID, so that the monitor can list the jobs of a converged ensemble for scancel
+echo "${SLURM_ARRAY_JOB_ID:-${SLURM_JOB_ID:-}}${SLURM_ARRAY_JOB_ID:+_$SLURM_ARRAY_TASK_ID}" > "$DIR/job_id"
 echo "$NAME" | vpi > "$DIR/$NAME.out"
 
 STATUS=$?
@@ -34,9 +34,14 @@ check_argument "$SKIP" || usage
 
 SCRIPT_FILE="$USER/scratch/scripts/postprocessing/bootstrap_fit.py"
 
+# the SBATCH directives above can be sized with the cost model instead of guessed, e.g.
+# python cost_model.py calibrate   (once, on a compute node)
+# python cost_model.py plan --job bootstrap --filetype sf_time --bootstrap_iterations 1000000 --points 100
+
 # echo "Running bootstrap analysis as part of SLURM job"
 
-# do bootstrap analysis
+# do bootstrap analysis: finished work units are checkpointed, so resubmitting the job after it
+# hit its time limit only does the units that are missing
 python "$SCRIPT_FILE" \
      --filename="$SUPERFLUID_FILE" \
      --cores="$SLURM_CPUS_PER_TASK" \
@@ -46,6 +51,8 @@ python "$SCRIPT_FILE" \
      --save \
      --skip="$SKIP" \
      --bootstrap_iterations=1000000 \
+     --retries=2 \
+     --checkpoint_dir="$(dirname "$SUPERFLUID_FILE")/bootstrap_checkpoint" \
      --verbose \
      --filetype="sf_time"\
      --method="bootstrap"
\ No newline at end of file
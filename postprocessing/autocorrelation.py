@@ -0,0 +1,164 @@
+import argparse
+import os
+
+import numpy as np
+
+import instrumentation
+from extrapolate_samples import load_samples
+from loaders import load_columns
+
+
+"""
+Autocorrelation of Monte Carlo series: normalized autocorrelation functions computed with FFTs,
+integrated autocorrelation times with Sokal's automatic windowing and effective sample sizes,
+vectorized over columns. The CLI reads .en block series, raw.param Metropolis chains and .npy/.npz
+bootstrap samples, and prints for every column the mean, the error corrected for the
+autocorrelation, the autocorrelation time and the effective sample size
+"""
+
+
+"""
+Normalized autocorrelation function of every column, in O(N log N)
+"""
+def autocorrelation(x):
+    """
+    x - series along the first axis, any number of columns along the remaining axes
+
+    return:
+    rho - autocorrelation at lags 0, ..., N-1 with rho[0] = 1, same shape as x
+    """
+    x = np.asarray(x, dtype=float)
+    n = x.shape[0]
+    centred = x - np.mean(x, axis=0)
+
+    # zero-pad to at least twice the length so the FFT gives the linear, not circular, correlation
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    transform = np.fft.rfft(centred, n=size, axis=0)
+    acf = np.fft.irfft(transform * np.conj(transform), n=size, axis=0)[:n]
+
+    # constant columns are uncorrelated by convention
+    variance = acf[0]
+    constant = variance == 0
+    rho = acf / np.where(constant, 1, variance)
+    rho[1:, constant] = 0
+    rho[0] = 1
+
+    return rho
+
+
+"""
+Integrated autocorrelation time of every column
+"""
+def integrated_time(x, c=5):
+    """
+    x - series along the first axis, any number of columns along the remaining axes
+    c - window constant: the sum over lags is cut off at the smallest M with M >= c * tau(M)
+
+    return:
+    tau - integrated autocorrelation time (1 for uncorrelated data), one per column
+    """
+    rho = autocorrelation(x)
+    taus = 2 * np.cumsum(rho, axis=0) - 1
+
+    lags = np.arange(len(taus)).reshape((-1,) + (1,) * (taus.ndim - 1))
+    inside = lags >= c * taus
+    # if no window satisfies the condition the series is too short, use the whole series
+    window = np.where(np.any(inside, axis=0), np.argmax(inside, axis=0), len(taus) - 1)
+
+    return np.take_along_axis(taus, window[np.newaxis], axis=0)[0]
+
+
+"""
+Effective number of independent samples of every column
+"""
+def effective_sample_size(x, c=5):
+    """
+    x - series along the first axis, any number of columns along the remaining axes
+    c - window constant passed on to integrated_time
+
+    return:
+    ess - N / tau, one per column
+    """
+    return np.shape(x)[0] / integrated_time(x, c)
+
+
+"""
+Read the series stored in an output file: .npy/.npz sample arrays, raw.param chains of
+metropolis_fitting.py (whose summary footer is skipped) or any whitespace-delimited file
+"""
+def read_series(filename, indices=None):
+    """
+    filename - path to the file
+    indices - columns to read (default: all columns)
+
+    return:
+    series - 2d array (rows x columns)
+    """
+    if filename.endswith((".npy", ".npz")):
+        instrumentation.count_file(filename)
+        series = load_samples(filename)
+        series = series.reshape(len(series), -1)
+        return series if indices is None else series[:, indices]
+
+    if os.path.basename(filename).endswith(".param"):
+        instrumentation.count_file(filename)
+        with open(filename) as f:
+            rows = [line for line in f if line.strip() and not line.startswith(("#", "-"))]
+        return np.loadtxt(rows, usecols=indices, ndmin=2)
+
+    return load_columns(filename, usecols=indices)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filenames", nargs="+", help=".en, raw.param or .npy files to analyze")
+    parser.add_argument("--indices", help="columns to analyze: pass as string '1,2,3' etc. (default: all)", type=str, default="")
+    parser.add_argument("--throwaway", help="number of initial rows to throw away", type=int, default=0)
+    parser.add_argument("--window", help="constant c of the automatic window M >= c * tau", type=float, default=5)
+    parser.add_argument("--acf_file", help="save the autocorrelation functions (lag, then one column per file and column) to this file")
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
+    args = parser.parse_args()
+
+    indices = [int(i) for i in args.indices.split(",")] if args.indices else None
+
+    with instrumentation.span("load"):
+        series = [read_series(filename, indices)[args.throwaway:] for filename in args.filenames]
+
+    # files of equal length are stacked side by side and analyzed in a single call, every file in full
+    groups = {}
+    for k, s in enumerate(series):
+        groups.setdefault(len(s), []).append(k)
+
+    results = {}
+    acfs = {}
+    with instrumentation.span("autocorrelation"):
+        for length, members in groups.items():
+            stacked = np.column_stack([series[k] for k in members])
+            tau = integrated_time(stacked, args.window)
+            rho = autocorrelation(stacked) if args.acf_file else None
+            columns = np.cumsum([0] + [series[k].shape[1] for k in members])
+            for n, k in enumerate(members):
+                results[k] = series[k], tau[columns[n]:columns[n + 1]]
+                if args.acf_file:
+                    acfs[k] = rho[:, columns[n]:columns[n + 1]]
+
+    if args.acf_file:
+        # the autocorrelation functions of all files side by side, up to the lags of the shortest
+        rows = min(len(s) for s in series)
+        labels = [f"{filename}:{column}" for k, filename in enumerate(args.filenames)
+                  for column in (indices or range(series[k].shape[1]))]
+        np.savetxt(args.acf_file, np.column_stack([np.arange(rows)] + [acfs[k][:rows] for k in range(len(series))]),
+                   fmt="%.6g", header="lag " + " ".join(labels))
+
+    print("# filename column mean error tau ess")
+    for k, filename in enumerate(args.filenames):
+        data, tau = results[k]
+        ess = len(data) / tau
+        # standard error of the mean, inflated by the autocorrelation time
+        errors = np.std(data, axis=0, ddof=1) * np.sqrt(tau / len(data))
+        for c, column in enumerate(indices or range(data.shape[1])):
+            print(f"{filename} {column} {np.mean(data[:, c]):.6g} {errors[c]:.3g} {tau[c]:.3f} {ess[c]:.1f}")
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
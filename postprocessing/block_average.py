@@ -1,5 +1,11 @@
 import numpy as np
 import argparse
+import time
+
+import instrumentation
+from ensemble_index import ensemble_seed
+from loaders import load_columns
+from results_db import make_records, write_records
 
 
 def compute_average(arr, block_size):
@@ -17,8 +23,25 @@ def compute_average(arr, block_size):
     return avg, error
 
 
-# assumes that the data is two-dimensional
-def average_all(X, block_size, throwaway, indices):
+# resample the block averages with replacement to get samples of the mean of each column
+def bootstrap_means(X, block_size, throwaway, indices, num_samples, seed):
+    X = X[throwaway:]
+
+    cutoff = X.shape[0] % block_size
+    X = X[cutoff:, indices]
+
+    num_blocks = X.shape[0] // block_size
+    block_avged = np.mean(X.reshape(num_blocks, block_size, X.shape[1]), axis=1)
+
+    # number of times each block is drawn in every resample
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(num_blocks, np.full(num_blocks, 1 / num_blocks), size=num_samples)
+
+    return counts @ block_avged / num_blocks
+
+
+# block averages and their errors of the selected columns, assumes that the data is two-dimensional
+def average_columns(X, block_size, throwaway, indices):
     X = X[throwaway:]
 
     cutoff = X.shape[0] % block_size
@@ -29,16 +52,30 @@ def average_all(X, block_size, throwaway, indices):
     for col in range(X.shape[1]):
         column = X[:, col]
         avg, err = compute_average(column, block_size)
-        avgs.append('{:.4f}'.format(avg))
-        errs.append('{:.5f}'.format(err))
+        avgs.append(avg)
+        errs.append(err)
+
+    return avgs, errs
+
+
+def average_all(X, block_size, throwaway, indices):
+    avgs, errs = average_columns(X, block_size, throwaway, indices)
     
     output = ""
     for i, a in enumerate(avgs):
-        output += f"{a} {errs[i]} "
+        output += f"{a:.4f} {errs[i]:.5f} "
     
     return output
 
 
+# names of the columns from the header line of a file (e.g. '# block kinetic potential total')
+def column_names(filename, indices):
+    with open(filename) as f:
+        first_line = f.readline()
+    header = first_line.lstrip("#").split() if first_line.startswith("#") else []
+    return [header[i] if -len(header) <= i < len(header) else f"column_{i}" for i in indices]
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
@@ -47,12 +84,40 @@ if __name__ == "__main__":
     parser.add_argument("--block_size", help="number of datapoints per bin for block average", type=int)
     parser.add_argument("--indices", help="indices for accessing the array: pass as string '1,2,3' etc.", type=str)
     parser.add_argument("--include_filename", help="whether to include the filename in the output", action="store_true", default=False)
+    parser.add_argument("--samples_file", help="save bootstrap samples of the block-averaged means to this compressed .npz file")
+    parser.add_argument("--samples", help="number of bootstrap samples to save", type=int, default=10000)
+    parser.add_argument("--seed", type=int, help="seed of the bootstrap samples (default: derived from the path of --filename)", default=None)
+    parser.add_argument("--db", help="also add the averages to this results database (see results_db.py)")
+    parser.add_argument("--observable", help="observable the averages are recorded as in the results database", default="energy")
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
     args = parser.parse_args()
 
-    data = np.loadtxt(args.filename)
+    start_time = time.perf_counter()
+
+    with instrumentation.span("load"):
+        data = load_columns(args.filename)
+
+    with instrumentation.span("block average"):
+        indices = [int(x) for x in args.indices.split(',')]
+        output = average_all(data, args.block_size, args.throwaway, indices)
 
-    output = average_all(data, args.block_size, args.throwaway, [int(x) for x in args.indices.split(',')])
+        if args.samples_file:
+            # every ensemble gets its own stream, so that the samples of different ensembles are independent
+            seed = ensemble_seed(args.filename) if args.seed is None else args.seed
+            np.savez_compressed(args.samples_file, seed=np.array(seed),
+                                samples=bootstrap_means(data, args.block_size, args.throwaway, indices, args.samples, seed))
     if args.include_filename:
         print(f"{args.filename} {output}")
     else:
-        print(f"{output}")
\ No newline at end of file
+        print(f"{output}")
+
+    if args.db:
+        with instrumentation.span("database"):
+            avgs, errs = average_columns(data, args.block_size, args.throwaway, indices)
+            records = make_records(args.filename, args.observable, "blocking", column_names(args.filename, indices),
+                                   avgs, errs, time.perf_counter() - start_time,
+                                   options={"block_size": args.block_size, "throwaway": args.throwaway})
+            write_records(args.db, records)
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
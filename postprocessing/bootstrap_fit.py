@@ -1,11 +1,18 @@
 import argparse
+import hashlib
 import os
 import sys
 import time
 import numpy as np
 import matplotlib.pyplot as plt
 import multiprocessing as mp
+import instrumentation
+import shared_data
+from ensemble_index import ensemble_seed
+from loaders import load_columns
+from results_db import make_records, write_records
 from fits import *
+from streaming_stats import StreamingSummary, centred_edges, pack_summaries, summarize_chunks, unpack_summaries
 from math import ceil
 from scipy.optimize import curve_fit
 from scipy import stats
@@ -59,27 +66,220 @@ def select_interval(x, y, domain, throwaway_first, throwaway_last, p_interval):
 
 
 """
-Function for fitting a batch of bootstrap iterations
+Coarse-grain adjacent points into at most `max_points` bins, as an alternative to skipping points:
+error-weighted means of each bin are fitted, so no data is thrown away
 """
-def process_batch(fitting_func, iterations, seed, x, y, yerr, guess, fitting_bounds):
-    rng = np.random.default_rng(seed)
-    generated_params = np.zeros((iterations, 3))
-    for i in range(iterations):
-        resampled_y = rng.normal(size=y.size, loc=y, scale=yerr)
-        popt, _ = curve_fit(fitting_func, x, resampled_y, p0=guess,
-                            bounds=fitting_bounds)
-        generated_params[i, :] = popt
+def coarse_grain(x, y, yerr, max_points):
+    """
+    x - array of values for independent variate
+    y - array of values for dependent variate
+    yerr - errors for dependent variate, treated as independent between points
+    max_points - maximum number of bins
+
+    return:
+    x, y, yerr - error-weighted means of the bins and their propagated errors
+    """
+    num_bins = min(len(x), max_points) if max_points else len(x)
+
+    # bins of (nearly) equal numbers of adjacent points
+    edges = (np.arange(num_bins) * len(x)) // num_bins
+
+    weights = 1 / yerr ** 2
+    sums = np.add.reduceat(np.column_stack([weights, weights * x, weights * y]), edges, axis=0)
+
+    return sums[:, 1] / sums[:, 0], sums[:, 2] / sums[:, 0], 1 / np.sqrt(sums[:, 0])
+
+
+# bootstrap iterations are done in work units of this size, each with its own random stream
+UNIT_ITERATIONS = 1000
+
+# default entropy of the SeedSequence the random streams of the work units are derived from
+BOOTSTRAP_SEED = 666
+
+# relative spread of the perturbed guesses a failed fit is retried from
+RETRY_SPREAD = 0.1
+
+
+"""
+Work units of a bootstrap run: unit u does iterations [u * UNIT_ITERATIONS, (u + 1) * UNIT_ITERATIONS)
+with the random stream `unit_rng(seed, u)`, so the samples do not depend on how the units are
+split between cores, or between the shards of a run
+"""
+def work_units(total_iterations, shard=(1, 1)):
+    """
+    total_iterations - total number of bootstrap iterations of the whole run
+    shard - (k, N): the k-th of N shards (1 <= k <= N) gets the k-th of N contiguous ranges of units
+
+    return:
+    units - list of (unit, iterations) of the shard
+    """
+    k, num_shards = shard
+    num_units = ceil(total_iterations / UNIT_ITERATIONS)
+    first = (k - 1) * num_units // num_shards
+    last = k * num_units // num_shards
+    return [(u, min(UNIT_ITERATIONS, total_iterations - u * UNIT_ITERATIONS)) for u in range(first, last)]
+
+
+def unit_rng(seed, unit):
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(unit,)))
+
+
+# perturbed guesses come from a stream of their own, so retries do not shift the resamples
+def retry_rng(seed, unit):
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(unit, 1)))
+
+
+"""
+Merge the summaries of the work units, always in the order of the units: the floating point
+result is then the same whichever cores or shards computed them
+"""
+def merge_units(unit_summaries, edges):
+    summary = StreamingSummary(edges)
+    for unit_summary in unit_summaries:
+        summary.merge(unit_summary)
+    return summary
+
+
+"""
+Fit a single resample, retrying a fit that fails to converge from perturbed guesses
+"""
+def fit_resample(fitting_func, x, resampled_y, guess, fitting_bounds, retries, rng):
+    """
+    resampled_y - resampled values of the dependent variate
+    guess - initial params of the first attempt
+    retries - number of further attempts, from guesses perturbed by RETRY_SPREAD
+    rng - random number generator of the perturbations
+
+    return:
+    popt - fitted parameters, or None if every attempt failed
+    """
+    p0 = guess
+    for attempt in range(retries + 1):
+        instrumentation.count("fits_attempted")
+        try:
+            popt, _, info, _, _ = curve_fit(fitting_func, x, resampled_y, p0=p0,
+                                            bounds=fitting_bounds, full_output=True)
+        except (RuntimeError, ValueError):
+            # no convergence within the evaluation budget, or a non-finite model at the guess
+            instrumentation.count("fits_failed")
+            p0 = np.clip(guess * (1 + RETRY_SPREAD * rng.standard_normal(len(guess))), *fitting_bounds)
+            continue
+        instrumentation.count("model_evaluations", info["nfev"])
+        if attempt:
+            instrumentation.count("fits_recovered")
+        return popt
+    return None
+
+
+"""
+Fingerprint of everything the fits of a work unit depend on, stored with its checkpoint
+"""
+def bootstrap_fingerprint(fitting_func, x, y, yerr, guess, fitting_bounds, edges, seed, retries):
+    digest = hashlib.sha256()
+    for array in [x, y, yerr, guess, np.asarray(fitting_bounds, dtype=float), edges]:
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    digest.update(f"{fitting_func.__name__} {seed} {retries} {UNIT_ITERATIONS}".encode())
+    return digest.hexdigest()
+
+
+def unit_checkpoint(directory, unit):
+    return os.path.join(directory, f"unit_{unit}.npz")
+
+
+"""
+Checkpoint a finished work unit, atomically so that a job killed while writing leaves no partial file
+"""
+def save_unit(directory, fingerprint, unit, iterations, summary, samples):
+    path = unit_checkpoint(directory, unit)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, fingerprint=np.array(fingerprint), iterations=np.array(iterations),
+                 samples=samples if samples is not None else np.empty((0, len(summary.mean))),
+                 has_samples=np.array(samples is not None), **pack_summaries([summary]))
+    os.replace(path + ".tmp", path)
+
+
+"""
+Load the checkpointed work units of a run: units from another run (other data, options or number
+of iterations), or without the samples that are needed, are done again
+"""
+def load_checkpoints(directory, fingerprint, units, keep_samples=False):
+    """
+    directory - checkpoint directory of the run
+    fingerprint - fingerprint of the run
+    units - list of (unit, iterations) of the run
+    keep_samples - whether the fitted parameters of every iteration are needed
+
+    return:
+    done - {unit: (summary, samples or None)} of the units found
+    """
+    done = {}
+    for unit, iterations in units:
+        path = unit_checkpoint(directory, unit)
+        if not os.path.exists(path):
+            continue
+        instrumentation.count_file(path)
+        with np.load(path) as checkpoint:
+            if (str(checkpoint["fingerprint"]) != fingerprint or int(checkpoint["iterations"]) != iterations
+                    or (keep_samples and not checkpoint["has_samples"])):
+                continue
+            done[unit] = (unpack_summaries(checkpoint)[0], checkpoint["samples"] if keep_samples else None)
+    return done
+
+
+"""
+Function for fitting a batch of bootstrap work units
+"""
+def process_batch(fitting_func, units, seed, x, y, yerr, guess, fitting_bounds, edges, keep_samples=False,
+                  retries=0, checkpoint="", fingerprint=""):
+    # workers hand their counters back to the parent, so start every batch from zero
+    instrumentation.reset()
+
+    # every unit is summarized on its own, so that units can be merged in order by the parent;
+    # fits that fail are left out of their unit, whose summary then counts fewer samples
+    summaries = []
+    kept = []
+    for unit, iterations in units:
+        rng = unit_rng(seed, unit)
+        perturbations = retry_rng(seed, unit)
+        fitted = np.zeros((iterations, len(guess)))
+        converged = np.ones(iterations, dtype=bool)
+        for i in range(iterations):
+            resampled_y = rng.normal(size=y.size, loc=y, scale=yerr)
+            popt = fit_resample(fitting_func, x, resampled_y, guess, fitting_bounds, retries, perturbations)
+            if popt is None:
+                converged[i] = False
+            else:
+                fitted[i, :] = popt
+        fitted = fitted[converged]
+
+        summary = StreamingSummary(edges)
+        summary.add(fitted)
+        summaries.append(summary)
+        kept.append(fitted if keep_samples else None)
+        if checkpoint:
+            save_unit(checkpoint, fingerprint, unit, iterations, summary, kept[-1])
     
     if verbose:
-        print(f"Batch of {iterations} bootstrap iterations finished")
+        print(f"Batch of {len(units)} bootstrap work units finished")
 
-    return generated_params
+    return summaries, kept, instrumentation.snapshot()
+
+
+"""
+process_batch of a pool worker attached to the shared dataset: only the units and the options of
+the batch are sent to the worker, the data come from shared memory
+"""
+def process_shared_batch(fitting_func, units, seed, fitting_bounds, keep_samples, retries, checkpoint, fingerprint):
+    data = shared_data.arrays()
+    return process_batch(fitting_func, units, seed, data["x"], data["y"], data["yerr"], data["guess"],
+                         fitting_bounds, data["edges"], keep_samples, retries, checkpoint, fingerprint)
 
 
 """
 Fit using the bootstrap method (with multiprocessing)
 """
-def fit_with_bootstrap(fitting_func, x, y, yerr, start, end, skip, guess, total_iterations, cores, fitting_bounds):
+def fit_with_bootstrap(fitting_func, x, y, yerr, start, end, skip, guess, total_iterations, cores, fitting_bounds,
+                       edges, keep_samples=False, shard=(1, 1), seed=BOOTSTRAP_SEED, retries=0, checkpoint=""):
     """
     x - array of values for independent variate 
     y - array of values for dependent variate
@@ -90,7 +290,19 @@ def fit_with_bootstrap(fitting_func, x, y, yerr, start, end, skip, guess, total_
     guess - initial params to use for fitting
     total_iterations - total number of bootstrap iterations to perform
     cores - number of cores to use for multiprocessing
-    filetype - type of file we are fitting to
+    fitting_bounds - bounds of the fitting parameters
+    edges - histogram bin edges of every parameter, shape (parameters, bins + 1)
+    keep_samples - also return the fitted parameters of every iteration
+    shard - (k, N): only do the work units of the k-th of N shards of the run
+    seed - entropy of the SeedSequence of the random streams
+    retries - number of times a fit that fails is retried from a perturbed guess
+    checkpoint - directory every finished work unit is saved to, and the units of an interrupted
+                 run are picked up from (default: no checkpoints)
+
+    return:
+    unit_summaries - StreamingSummary of the fitted parameters of every work unit, in unit order
+                     (failed fits are left out, so a unit can count fewer samples than iterations)
+    samples - fitted parameters of every iteration (of the shard) if `keep_samples`, otherwise None
     """
 
     if verbose:
@@ -101,34 +313,61 @@ def fit_with_bootstrap(fitting_func, x, y, yerr, start, end, skip, guess, total_
     if verbose:
         print(f"using {cores} cores")
 
-    # use multiprocessing
-    pool = mp.Pool(processes=cores)
-
-    iterations_per_batch = total_iterations // cores
-
-    # a single batch consists of a set of iterations, batches are executed in parallel
-    # last batch will have a bit more iterations if not dividing evenly
-    last_batch = iterations_per_batch + (total_iterations % iterations_per_batch)
-    divisions = [iterations_per_batch for i in range(cores-1)] + [last_batch]
-
-    # generate a random seed for each batch
-    seeding_rng = np.random.default_rng(666)
-    seeds = seeding_rng.choice(len(divisions), size=cores, replace=False)
-
-    # perform bootstrap fitting, multiprocessing with `cores` number of parallel processes
-    results = [pool.apply_async(process_batch,
-                                args=(fitting_func, batch, seeds[i], x[start:end:skip],
-                                      y[start:end:skip], yerr[start:end:skip],
-                                      guess, fitting_bounds, ))
-               for i, batch in enumerate(divisions)]
-    
-    generated = np.concatenate([p.get() for p in results], axis=0)
+    units = work_units(total_iterations, shard)
+    x, y, yerr = x[start:end:skip], y[start:end:skip], yerr[start:end:skip]
+
+    # units finished by an earlier (interrupted) run of the same fit are not done again
+    done = {}
+    fingerprint = ""
+    if checkpoint:
+        os.makedirs(checkpoint, exist_ok=True)
+        fingerprint = bootstrap_fingerprint(fitting_func, x, y, yerr, guess, fitting_bounds, edges, seed, retries)
+        with instrumentation.span("load checkpoints"):
+            done = load_checkpoints(checkpoint, fingerprint, units, keep_samples)
+        if verbose:
+            print(f"Found {len(done)} of {len(units)} work units in {checkpoint}")
+    todo = [unit for unit in units if unit[0] not in done]
+
+    # a single batch consists of a contiguous range of work units, batches are executed in parallel
+    num_batches = max(1, min(cores, len(todo)))
+    batches = [todo[i * len(todo) // num_batches:(i + 1) * len(todo) // num_batches] for i in range(num_batches)]
+
+    if todo:
+        # the dataset is placed in shared memory once, and every worker attaches to it when it starts
+        block, layout = shared_data.create({"x": x, "y": y, "yerr": yerr, "guess": guess, "edges": edges})
+
+        try:
+            # use multiprocessing
+            with instrumentation.span("pool startup"):
+                pool = mp.Pool(processes=cores, initializer=shared_data.attach_worker, initargs=(block.name, layout))
+
+            # perform bootstrap fitting, multiprocessing with `cores` number of parallel processes
+            with instrumentation.span("bootstrap"):
+                results = [pool.apply_async(process_shared_batch,
+                                            args=(fitting_func, batch, seed, fitting_bounds, keep_samples,
+                                                  retries, checkpoint, fingerprint, ))
+                           for batch in batches]
+
+                # workers send back the summaries of their units: memory does not grow with iterations
+                for batch, p in zip(batches, results):
+                    batch_summaries, batch_samples, counters = p.get()
+                    done.update({unit: (summary, params) for (unit, _), summary, params
+                                 in zip(batch, batch_summaries, batch_samples)})
+                    instrumentation.merge(counters)
+
+            pool.close()
+            pool.join()
+        finally:
+            shared_data.release(block)
+
+    unit_summaries = [done[unit][0] for unit, _ in units]
+    samples = np.concatenate([done[unit][1] for unit, _ in units]) if keep_samples and units else None
 
     if verbose:
         end_time = time.perf_counter()
-        print(f"Bootstrap fitting with {total_iterations} total iterations took {end_time - start_time} seconds")
+        print(f"Bootstrap fitting with {sum(n for _, n in units)} iterations took {end_time - start_time} seconds")
 
-    return generated
+    return unit_summaries, samples
 
 
 """
@@ -147,6 +386,125 @@ def fit_with_covariance(fitting_func, x, y, yerr, start, end, skip, fitting_boun
     return params, param_err
 
 
+"""
+Weighted linear least squares in closed form, for models linear in all of their parameters
+"""
+def linear_fit(basis, y, yerr):
+    """
+    basis - design matrix of the model at the data points, shape (points, parameters)
+    y - array of values for dependent variate
+    yerr - errors for dependent variate
+
+    return:
+    params - best fit parameters
+    param_err - errors of the parameters
+    """
+    pinv = np.linalg.pinv(basis / yerr[:, np.newaxis])
+    params = pinv @ (y / yerr)
+    # (B^T W B)^-1 = pinv @ pinv^T
+    param_err = np.sqrt(np.sum(pinv ** 2, axis=1))
+    instrumentation.count("fits_attempted")
+
+    return params, param_err
+
+
+"""
+Bootstrap of a linear model: every resample is fitted by a product with the pseudo-inverse
+"""
+def linear_bootstrap(basis, y, yerr, total_iterations, edges, keep_samples=False, shard=(1, 1), seed=BOOTSTRAP_SEED,
+                     chunk_elements=2 ** 22):
+    """
+    basis - design matrix of the model at the data points, shape (points, parameters)
+    y - array of values for dependent variate
+    yerr - errors for dependent variate
+    total_iterations - total number of bootstrap iterations to perform
+    edges - histogram bin edges of every parameter, shape (parameters, bins + 1)
+    keep_samples - also return the fitted parameters of every iteration
+    shard - (k, N): only do the work units of the k-th of N shards of the run
+    seed - entropy of the SeedSequence of the random streams
+    chunk_elements - resampled data points held in memory at a time (at least one work unit)
+
+    return:
+    unit_summaries - StreamingSummary of the fitted parameters of every work unit, in unit order
+    samples - fitted parameters of every iteration (of the shard) if `keep_samples`, otherwise None
+    """
+    pinv = np.linalg.pinv(basis / yerr[:, np.newaxis])
+    centre = pinv @ (y / yerr)
+
+    # the units are done in chunks of bounded size: every unit draws its resamples from its own
+    # stream, then all of the chunk are fitted by one product and summarized together
+    units = work_units(total_iterations, shard)
+    units_per_chunk = max(1, chunk_elements // (UNIT_ITERATIONS * len(y)))
+    unit_summaries = []
+    kept = []
+    for first in range(0, len(units), units_per_chunk):
+        chunk = units[first:first + units_per_chunk]
+        sizes = [iterations for _, iterations in chunk]
+        noise = np.empty((sum(sizes), len(y)))
+        start = 0
+        for unit, iterations in chunk:
+            unit_rng(seed, unit).standard_normal(out=noise[start:start + iterations])
+            start += iterations
+
+        # a resample y + yerr * z has weighted data y / yerr + z, so its fit is centre + pinv @ z
+        samples = noise @ pinv.T
+        samples += centre
+        unit_summaries += summarize_chunks(samples, sizes, edges)
+        if keep_samples:
+            kept.append(samples)
+
+    instrumentation.count("fits_attempted", sum(n for _, n in units))
+
+    return unit_summaries, (np.concatenate(kept) if keep_samples and kept else None)
+
+
+"""
+Save the work units of a shard of a bootstrap run
+"""
+def save_shard(filename, unit_summaries, samples, shard, total_iterations, seed):
+    np.savez_compressed(filename, shard=np.array(shard), total_iterations=np.array(total_iterations),
+                        seed=np.array(seed), unit_iterations=np.array(UNIT_ITERATIONS),
+                        units=np.array([u for u, _ in work_units(total_iterations, shard)]),
+                        samples=samples if samples is not None else np.empty((0, len(unit_summaries[0].mean))),
+                        has_samples=np.array(samples is not None), **pack_summaries(unit_summaries))
+
+
+"""
+Load the shards of a bootstrap run and check that together they make up the whole run
+"""
+def load_shards(file_list, total_iterations, seed, edges, keep_samples=False):
+    """
+    file_list - shard files written with --shard
+    total_iterations, seed, edges - options of the run, which every shard must have been done with
+
+    return:
+    unit_summaries - summaries of all the work units of the run, in unit order
+    samples - fitted parameters of every iteration in unit order if `keep_samples`, otherwise None
+    """
+    shards = []
+    for filename in file_list:
+        instrumentation.count_file(filename)
+        with np.load(filename) as shard:
+            if (int(shard["total_iterations"]) != total_iterations or int(shard["seed"]) != seed
+                    or int(shard["unit_iterations"]) != UNIT_ITERATIONS):
+                raise ValueError(f"The shard {filename} belongs to a run with other iterations or seed")
+            if not np.array_equal(shard["edges"], edges):
+                raise ValueError(f"The shard {filename} was fitted on other data or with other fitting options")
+            if keep_samples and not shard["has_samples"]:
+                raise ValueError(f"The shard {filename} has no samples, please run it with --samples_file")
+            shards.append((shard["units"], unpack_summaries(shard), shard["samples"] if keep_samples else None))
+
+    shards.sort(key=lambda shard: shard[0][0] if len(shard[0]) else -1)
+    units = np.concatenate([shard[0] for shard in shards])
+    if not np.array_equal(units, np.arange(ceil(total_iterations / UNIT_ITERATIONS))):
+        raise ValueError("The shards do not cover every work unit of the run exactly once")
+
+    unit_summaries = [summary for shard in shards for summary in shard[1]]
+    samples = np.concatenate([shard[2] for shard in shards]) if keep_samples else None
+
+    return unit_summaries, samples
+
+
 """
 Fit the superfluid fraction curve using the fitting form
 """
@@ -176,42 +534,105 @@ def perform_fit(data, savepath, args, filetype):
         print(f"Using x-range {x[start]} < x < {x[end]}, "\
               f"fitting only every {skip}-th point, yielding {len(x[start:end:skip])} points total")
 
+    # bin the whole interval instead of skipping points: from here on the bins are the data
+    if args.reduction == "coarse":
+        x, y, yerr = coarse_grain(x[start:end], y[start:end], yerr[start:end], args.max_points)
+        start, end, skip = 0, len(x), 1
+
+        if verbose:
+            print(f"Coarse-grained the interval into {len(x)} error-weighted bins instead")
+
     if savepath:
         params_file = open(savepath + "/fit_params.txt", "w")
         params_file.write("#    Parameter   Value   Error:\n")
 
-    guess, covariance = fit_with_covariance(fitting_func, x, y, yerr, start, end, skip, fitting_bounds)
+    # models linear in all their parameters (and without bounds) are solved in closed form
+    linear = is_linear(filetype) and fitting_bounds == NO_BOUNDS
+    if linear:
+        basis = ALLOWED_FILETYPES[filetype]["basis"](x[start:end:skip])
+
+    with instrumentation.span("covariance fit"):
+        if linear:
+            guess, guess_err = linear_fit(basis, y[start:end:skip], yerr[start:end:skip])
+        else:
+            guess, guess_err = fit_with_covariance(fitting_func, x, y, yerr, start, end, skip, fitting_bounds)
 
     if verbose:
-        errors = np.sqrt(np.diag(covariance))
         print("Parameters found using covariance method:")
         for i, name in enumerate(param_names):
-            print(f"Parameter {name}:   {guess[i]}, {errors[i, i]}")
+            print(f"Parameter {name}:   {guess[i]}, {guess_err[i]}")
 
     if args.method == "covariance":
 
         fitting_params = guess
-        fitting_param_errors = np.sqrt(np.diag(covariance)).diagonal()
+        fitting_param_errors = guess_err
 
     elif args.method == "bootstrap":
         
         if verbose:
             print("Bootstrap estimation starting")
 
-        generated_params = fit_with_bootstrap(fitting_func, x, y, yerr, start, end, skip,
-                                              guess, args.bootstrap_iterations, args.cores, fitting_bounds)
+        # fixed histogram bins around the covariance estimate, shared by all workers so they merge
+        edges = centred_edges(guess, guess_err)
+        keep_samples = bool(args.samples_file)
+
+        if args.merge:
+            with instrumentation.span("merge"):
+                unit_summaries, samples = load_shards(args.merge, args.bootstrap_iterations, args.seed,
+                                                      edges, keep_samples)
+        elif linear:
+            with instrumentation.span("bootstrap"):
+                unit_summaries, samples = linear_bootstrap(basis, y[start:end:skip], yerr[start:end:skip],
+                                                           args.bootstrap_iterations, edges, keep_samples,
+                                                           args.shard, args.seed)
+        else:
+            unit_summaries, samples = fit_with_bootstrap(fitting_func, x, y, yerr, start, end, skip,
+                                                         guess, args.bootstrap_iterations, args.cores, fitting_bounds,
+                                                         edges, keep_samples, args.shard, args.seed,
+                                                         args.retries, args.checkpoint_dir)
+
+        summary = merge_units(unit_summaries, edges)
+
+        # fits that failed (after their retries) are left out of the bootstrap distribution
+        iterations = sum(n for _, n in work_units(args.bootstrap_iterations, args.shard))
+        failed = iterations - summary.count
+        if not summary.count:
+            raise RuntimeError(f"All {iterations} bootstrap fits failed, please try --retries or other fitting options")
+        if failed or verbose:
+            # the plain output line is parsed by the job scripts, so the report goes to stderr there
+            print(f"{failed} of {iterations} bootstrap fits failed ({100 * failed / iterations:.3f}%)",
+                  file=sys.stdout if verbose else sys.stderr)
+
+        # a shard only saves its work units, the fit is finished by a run with --merge
+        if args.shard != (1, 1):
+            with instrumentation.span("save"):
+                save_shard(args.shard_file, unit_summaries, samples, args.shard, args.bootstrap_iterations, args.seed)
+            # the only output of a shard, as a comment line: its partial mean and error are no result
+            print(f"# saved {len(unit_summaries)} work units of shard {args.shard[0]}/{args.shard[1]} to {args.shard_file}")
+            return summary.mean, summary.std
         
-        fitting_params = np.mean(generated_params, axis=0)
-        fitting_param_errors = np.std(generated_params, axis=0) 
+        fitting_params = summary.mean
+        fitting_param_errors = summary.std
+        if savepath:
+            params_file.write(f"# bootstrap fits failed: {failed} of {iterations}\n")
+
+        # keep the joint samples so later fits (e.g. extrapolate_samples.py) can propagate them
+        if args.samples_file:
+            with instrumentation.span("save"):
+                np.savez_compressed(args.samples_file, samples=samples, seed=np.array(args.seed))
 
         if verbose:
             print("Bootstrap estimation complete")
+            lower, median, upper = summary.quantile([0.16, 0.5, 0.84])
+            for i, name in enumerate(param_names):
+                print(f"Parameter {name}: median {median[i]}, 68% interval [{lower[i]}, {upper[i]}], "
+                      f"{sum(summary.outside(i))} samples outside the histogram")
             print("Now creating histograms for fitting parameter distributions")
 
         for i, name in enumerate(param_names):
 
             # distribution of values found for parameter
-            distribution = generated_params[:, i]
+            edges_i, density = summary.histogram(i)
 
             # abbreviated names
             p = fitting_params[i]
@@ -220,21 +641,23 @@ def perform_fit(data, savepath, args, filetype):
             # create histograms for fitting parameter_distributions
             if savepath:
                 
-                if args.save_histogram:
-                    np.save(savepath + f"/{name}_hist.npy", distribution)
-
-                # plot histograms for each of the parameters in fit
-                xdata = np.arange(np.min(distribution), np.max(distribution),
-                                  np.abs(np.min(distribution) - np.max(distribution)) / 1000)
-                plt.hist(distribution, bins=50, edgecolor="black", density=True)
-                plt.plot(xdata, stats.norm.pdf(xdata, p, err),
-                                color="red", lw=2.5, label="Normal dist.")
-                plt.title(f"Histogram for parameter {name} in fit")
-                plt.xlabel(f"{name}")
-                plt.ylabel("Frequency")
-                plt.legend()
-                plt.savefig(savepath + f"/{name}_hist.png")
-                plt.clf()
+                with instrumentation.span("histograms"):
+                    if args.save_histogram:
+                        np.save(savepath + f"/{name}_hist.npy", np.column_stack([edges_i[:-1], edges_i[1:], density]))
+
+                    # plot histograms for each of the parameters in fit, over the occupied bins
+                    occupied = np.flatnonzero(density)
+                    first, last = (occupied[0], occupied[-1] + 1) if occupied.size else (0, len(density))
+                    xdata = np.linspace(edges_i[first], edges_i[last], 1000)
+                    plt.stairs(density[first:last], edges_i[first:last + 1], fill=True, edgecolor="black")
+                    plt.plot(xdata, stats.norm.pdf(xdata, p, err),
+                                    color="red", lw=2.5, label="Normal dist.")
+                    plt.title(f"Histogram for parameter {name} in fit")
+                    plt.xlabel(f"{name}")
+                    plt.ylabel("Frequency")
+                    plt.legend()
+                    plt.savefig(savepath + f"/{name}_hist.png")
+                    plt.clf()
 
     if verbose:
         print(f"Parameter estimation for fit: {fit_eqn}")
@@ -246,23 +669,24 @@ def perform_fit(data, savepath, args, filetype):
 
     if savepath:
 
-        # write fitted parameters and errors to file
-        second_label = ""
-        for i, name in enumerate(param_names):
-            params_file.write(f"{name}  {fitting_params[i]}  {fitting_param_errors[i]}\n")
-            second_label += f"{name}={fitting_params[i]:.3f},"
-        params_file.close()
-
-        # plot superfluid curve (with errorbars) along with fitting curve
-        plt.plot(x[start:end:skip], best_fit[start:end:skip], label=second_label, zorder=2)
-        plt.errorbar(x[start:end:skip], y[start:end:skip], yerr=yerr[start:end:skip],
-                     fmt='o', markersize=3, capsize=2, label="data", zorder=1)
-        plt.title(f"Fit: {fit_eqn}")
-        plt.xlabel(x_label)
-        plt.ylabel(y_label)
-        plt.legend()
-        plt.savefig(savepath + f"/fit_to_{filetype}.png")
-        plt.clf()
+        with instrumentation.span("plot"):
+            # write fitted parameters and errors to file
+            second_label = ""
+            for i, name in enumerate(param_names):
+                params_file.write(f"{name}  {fitting_params[i]}  {fitting_param_errors[i]}\n")
+                second_label += f"{name}={fitting_params[i]:.3f},"
+            params_file.close()
+
+            # plot superfluid curve (with errorbars) along with fitting curve
+            plt.plot(x[start:end:skip], best_fit[start:end:skip], label=second_label, zorder=2)
+            plt.errorbar(x[start:end:skip], y[start:end:skip], yerr=yerr[start:end:skip],
+                         fmt='o', markersize=3, capsize=2, label="data", zorder=1)
+            plt.title(f"Fit: {fit_eqn}")
+            plt.xlabel(x_label)
+            plt.ylabel(y_label)
+            plt.legend()
+            plt.savefig(savepath + f"/fit_to_{filetype}.png")
+            plt.clf()
 
     return fitting_params, fitting_param_errors
 
@@ -289,8 +713,26 @@ if __name__ == "__main__":
     parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
     parser.add_argument("--save", action="store_true", help="Whether or not the save plot/fit param. results to files", default=False)
     parser.add_argument("--skip", help="only fit every n points in dataset", default=1, type=int)
+    parser.add_argument("--reduction", help=f"how to reduce the number of points to max_points: {ALLOWED_REDUCTIONS}",
+                                       default="skip")
     parser.add_argument("--save_histogram", action="store_true",
                                             help="Whether or not to save histogram file of extrapolated superfluid y", default=False)
+    parser.add_argument("--samples_file", help="Save the bootstrap parameter samples to this compressed .npz file \
+                                                (kept in memory, so this limits the number of iterations)", default="")
+    parser.add_argument("--seed", type=int, help="entropy of the random streams of the bootstrap iterations \
+                                                (default: derived from the path of --filename)", default=None)
+    parser.add_argument("--shard", help="only do shard k of N of the bootstrap iterations, given as 'k/N', \
+                                         and save its work units to --shard_file", default="1/1")
+    parser.add_argument("--shard_file", help="file the work units of a shard are saved to \
+                                              (default: next to --filename, named after the shard)", default="")
+    parser.add_argument("--merge", nargs="+", help="finish a sharded bootstrap run from these shard files \
+                                                    (same data and options as the shards)", default=[])
+    parser.add_argument("--retries", type=int, help="number of times a bootstrap fit that fails to converge is retried \
+                                                    from a perturbed guess (fits that still fail are left out)", default=0)
+    parser.add_argument("--checkpoint_dir", help="save every finished bootstrap work unit to this directory, and only do \
+                                                  the units missing from it (e.g. after a job hit its time limit)", default="")
+    parser.add_argument("--db", help="also add the fitted parameters to this results database (see results_db.py)")
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
     args = parser.parse_args()
 
     # set verbosity to a global variable, passing this as an argument for all of the functions
@@ -306,21 +748,46 @@ if __name__ == "__main__":
     
     if args.method not in ALLOWED_METHODS:
         raise ValueError(f"Please choose one of: {ALLOWED_METHODS}")
+
+    if args.reduction not in ALLOWED_REDUCTIONS:
+        raise ValueError(f"Please choose one of: {ALLOWED_REDUCTIONS}")
     
     if args.domain:
         domain = [float(pt) for pt in args.domain.split(",")]
         args.domain = domain
 
+    # every ensemble gets its own streams, so that the samples of different ensembles are independent
+    if args.seed is None:
+        args.seed = ensemble_seed(args.filename)
+
+    args.shard = tuple(int(n) for n in args.shard.split("/"))
+    if len(args.shard) != 2 or not 1 <= args.shard[0] <= args.shard[1]:
+        raise ValueError("Please give the shard as 'k/N' with 1 <= k <= N")
+    sharded = args.shard != (1, 1)
+
+    if (sharded or args.merge) and args.method != "bootstrap":
+        raise ValueError("Sharding and merging are only possible with --method bootstrap")
+
+    if sharded and args.merge:
+        raise ValueError("Please pass either --shard or --merge")
+
+    if args.shard[1] > ceil(args.bootstrap_iterations / UNIT_ITERATIONS):
+        raise ValueError(f"Please use at most one shard per {UNIT_ITERATIONS} bootstrap iterations")
+
+    if sharded and not args.shard_file:
+        k, num_shards = args.shard
+        args.shard_file = os.path.join(os.path.dirname(args.filename), f"bootstrap_shard_{k}_of_{num_shards}.npz")
+
     if verbose:
         print("-----------------------------------------------------------------------")
         print(f"Analyzing file @ {args.filename}")
         print("-----------------------------------------------------------------------")
 
-    with open(args.filename) as f:
-        lines = (line for line in f if not line.startswith('#'))
-        data = np.loadtxt(lines)
+    with instrumentation.span("load"):
+        data = load_columns(args.filename, usecols=(0, 1, 2))
 
-    if args.save:
+    # shards only save their work units
+    if args.save and not sharded:
         save = os.path.dirname(args.filename) + "/images/bootstrap"
         os.makedirs(save, exist_ok=True)
     else:
@@ -328,16 +795,28 @@ if __name__ == "__main__":
 
     params, errors = perform_fit(data, save, args, filetype=args.filetype)
 
-    # don't print anything except for to a file
-    if not verbose:
+    # don't print anything except for to a file (shards have printed where their work units went)
+    if not verbose and not sharded:
         print(f"{args.filename} {params[-1]} {errors[-1]}")
 
     end_time = time.perf_counter()
 
     elapsed_time = end_time - start_time
 
+    # shards only hold part of the iterations: the merge run records the result
+    if args.db and not sharded:
+        with instrumentation.span("database"):
+            options = {key: getattr(args, key) for key in ["domain", "throwaway_first", "throwaway_last", "p_interval",
+                                                           "max_points", "skip", "reduction", "bootstrap_iterations", "seed", "retries"]}
+            write_records(args.db, make_records(args.filename, args.filetype, args.method,
+                                                ALLOWED_FILETYPES[args.filetype]["param names"], params, errors,
+                                                elapsed_time, options))
+
     if verbose:
         print(f"Elapsed time: {elapsed_time:.6f} seconds")
         print("-----------------------------------------------------------------------")
 
+    if args.profile:
+        instrumentation.write_report(args.profile)
+
     
\ No newline at end of file
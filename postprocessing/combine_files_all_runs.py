@@ -4,7 +4,11 @@ import numpy as np
 import argparse
 import datetime
 import os
-import glob
+
+import instrumentation
+from ensemble_index import load_index, files_with_extension, run_config, run_numbers, load_quarantine
+from loaders import load_columns
+from scipy.signal import find_peaks
 
 # from scipy.stats import iqr
 
@@ -16,29 +20,19 @@ errorbars on computed physical quantities
 
 
 """
-Get a list of files with a particular extension
+Runs left out of the combined results: those in the --quarantine list written by health_check.py
 """
-def find_files_with_extension(directory, pattern):
-    search_pattern = os.path.join(directory, pattern)
-    file_list = glob.glob(search_pattern, recursive=True)
-    return file_list
+def quarantined_runs():
+    if not args.quarantine:
+        return set()
+    return load_quarantine(args.quarantine)
 
 
 """
-Get line containing a particular string
+Report an ensemble with nothing left to combine, so that the combiners return without writing output
 """
-def get_line_containing_string(file_path, target_string):
-    try:
-        with open(file_path, 'r') as file:
-            for line in file:
-                if target_string in line:
-                    return line.strip()  # Return the line without leading/trailing whitespace
-    except FileNotFoundError:
-        print(f"File '{file_path}' not found.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-    return None  # Return None if the string is not found or an error occurs
+def nothing_to_combine(dirname, extension):
+    print(f"No {extension} files left to combine in {dirname}: every run is missing them or is quarantined")
 
 
 """
@@ -51,13 +45,15 @@ def combine_sf(dirname, extension, blocksize):
         print("----------------------------------------------")
         print(f"Combining superfluid files inside {dirname}:")
         print("----------------------------------------------")
-    file_list = find_files_with_extension(dirname, pattern=f'**/*{extension}')
+    index = load_index(dirname)
+    file_list = files_with_extension(dirname, index, extension, quarantined_runs())
     # print(file_list)
     betas_found = False
     for filename in file_list:
         if args.verbose:
             print(f"processing: {filename}")
-        data = np.loadtxt(filename)
+        with instrumentation.span("load"):
+            data = load_columns(filename, usecols=(0, 1, 2))
         if data.any():
             if not betas_found:
                 betas = data[:, 0]
@@ -70,6 +66,10 @@ def combine_sf(dirname, extension, blocksize):
     if args.verbose:
         print("Done processing superfluid files, now estimating the standard error in sample mean")
 
+    if not fractions:
+        nothing_to_combine(dirname, extension)
+        return
+
     # stack arrays into the form: row -- time, column -- run
     fraction_array = np.column_stack(fractions)
     error_array = np.column_stack(errors)
@@ -107,43 +107,44 @@ def combine_sf(dirname, extension, blocksize):
 
     if args.plot:
 
-        if args.verbose:
-            print("--plot option detected, starting to plot histograms")
-
-        # histograms to see block averaging in action
-        slice_index = int(300 * num_points / 640)
-        raw_slice = fraction_array[slice_index, :]
-        blocked_slice = block_avg[slice_index, :]
-
-        # raw points
-        plt.scatter(np.arange(len(raw_slice)), raw_slice)
-        plt.axhline(np.mean(raw_slice), label=f"mean: {np.mean(raw_slice)}")
-        plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, raw")
-        plt.savefig("/home/syu7/scratch/tests/raw_points.png")
-        plt.clf() 
-
-        # raw histogram
-        _, edges, _ = plt.hist(raw_slice, bins='fd')
-        plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, raw")
-        plt.savefig("/home/syu7/scratch/tests/raw_hist.png")
-        plt.clf()
-
-        # blocked points
-        plt.scatter(np.arange(len(blocked_slice)), blocked_slice)
-        plt.axhline(np.mean(blocked_slice), label=f"mean: {np.mean(blocked_slice)}")
-        plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, {num_blocks} blocks")
-        plt.legend()
-        plt.savefig("/home/syu7/scratch/tests/blocked_points.png")
-        plt.clf()
-
-        # blocked histogram
-        plt.hist(blocked_slice, bins='fd')
-        plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, {num_blocks} blocks")
-        plt.savefig("/home/syu7/scratch/tests/blocked_hist.png")
-        plt.clf()
-
-        if args.verbose:
-            print("Done plotting histograms")
+        with instrumentation.span("plot"):
+            if args.verbose:
+                print("--plot option detected, starting to plot histograms")
+
+            # histograms to see block averaging in action
+            slice_index = int(300 * num_points / 640)
+            raw_slice = fraction_array[slice_index, :]
+            blocked_slice = block_avg[slice_index, :]
+
+            # raw points
+            plt.scatter(np.arange(len(raw_slice)), raw_slice)
+            plt.axhline(np.mean(raw_slice), label=f"mean: {np.mean(raw_slice)}")
+            plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, raw")
+            plt.savefig("/home/syu7/scratch/tests/raw_points.png")
+            plt.clf() 
+
+            # raw histogram
+            _, edges, _ = plt.hist(raw_slice, bins='fd')
+            plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, raw")
+            plt.savefig("/home/syu7/scratch/tests/raw_hist.png")
+            plt.clf()
+
+            # blocked points
+            plt.scatter(np.arange(len(blocked_slice)), blocked_slice)
+            plt.axhline(np.mean(blocked_slice), label=f"mean: {np.mean(blocked_slice)}")
+            plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, {num_blocks} blocks")
+            plt.legend()
+            plt.savefig("/home/syu7/scratch/tests/blocked_points.png")
+            plt.clf()
+
+            # blocked histogram
+            plt.hist(blocked_slice, bins='fd')
+            plt.title(f"beta={betas[-1]}, t={betas[slice_index]}, {num_blocks} blocks")
+            plt.savefig("/home/syu7/scratch/tests/blocked_hist.png")
+            plt.clf()
+
+            if args.verbose:
+                print("Done plotting histograms")
 
     # errors_array = np.column_stack(errors)
     # avg = np.average(fraction_array, axis=1)
@@ -153,114 +154,359 @@ def combine_sf(dirname, extension, blocksize):
 
     # save the summed superfluid fractions into a combined file
     save_file = os.path.join(dirname, 'sf_fractions_combined')
-    np.savetxt(save_file, final, fmt='%.4e', delimiter='\t', header="block  fraction  error")
+    with instrumentation.span("save"):
+        np.savetxt(save_file, final, fmt='%.4e', delimiter='\t',
+                   header=f"error: standard deviation of {block_avg.shape[1]} blocks of {blocksize} runs\n"
+                          "block  fraction  error")
 
     if args.plot:
 
-        if args.verbose:
-            print("--plot option detected, starting to plot combined superfluid fractions file")
+        with instrumentation.span("plot"):
+            if args.verbose:
+                print("--plot option detected, starting to plot combined superfluid fractions file")
+
+            max_points = 100
+            if num_points > max_points:
+                spacing = num_points // max_points
+            else:
+                spacing = 1
+            plt.errorbar(betas[::spacing], avg[::spacing], yerr=avg_err[::spacing],
+                         fmt='o', markersize=3, capsize=2, label="data", zorder=1)
+            plt.xlabel("Projection time, beta")
+            plt.ylabel("Superfluid fraction")
+            plt.title(f"beta={betas[-1]}, {num_blocks} blocks, date: {datetime.date.today()}")
+            os.makedirs(os.path.join(dirname, "images"), exist_ok=True)
+            plt.savefig(os.path.join(dirname, "images", "sf_fractions_combined.png"))
+
+            if args.verbose:
+                print("Done plotting combined superfluid fractions file")
+
+
+"""
+Map the rows of a structure factor file onto the output points: the wavevectors sorted by q
+(rows with equal q keep their order in the file), or the bins of width `radial_width` in |q|
+"""
+def wavevector_index(q, radial_width=0.0):
+    """
+    q - wavevector column of a .sq file, in file order
+    radial_width - width of the |q| bins, 0 keeps every wavevector
+
+    return:
+    target - output point of every row of the file
+    points - q of every output point (the mean |q| of the wavevectors in a bin)
+    """
+    if radial_width > 0:
+        target = np.floor(q / radial_width).astype(int)
+        occupancy = np.bincount(target)
+        points = np.bincount(target, weights=q) / np.maximum(occupancy, 1)
+        points[occupancy == 0] = np.nan
+        return target, points
+
+    order = np.argsort(q, kind="stable")
+    target = np.empty(len(q), dtype=int)
+    target[order] = np.arange(len(q))
+    return target, q[order]
 
-        max_points = 100
-        if num_points > max_points:
-            spacing = num_points // max_points
-        else:
-            spacing = 1
-        plt.errorbar(betas[::spacing], avg[::spacing], yerr=avg_err[::spacing],
-                     fmt='o', markersize=3, capsize=2, label="data", zorder=1)
-        plt.xlabel("Projection time, beta")
-        plt.ylabel("Superfluid fraction")
-        plt.title(f"beta={betas[-1]}, {num_blocks} blocks, date: {datetime.date.today()}")
-        os.makedirs(os.path.join(dirname, "images"), exist_ok=True)
-        plt.savefig(os.path.join(dirname, "images", "sf_fractions_combined.png"))
 
+"""
+Weighted average of the structure factor over the files of all runs, in a single streaming pass:
+the wavevector index is built from the first file and reused for every file written in the same
+order, and only weighted sums over the runs are kept in memory. Every width in `radial_widths`
+gets its own average from the same pass
+"""
+def average_sq(file_list, radial_widths=(0.0,)):
+    """
+    file_list - .sq files (columns q, S(q), weight) of the runs
+    radial_widths - widths of the |q| bins of radial averages, 0 keeps every wavevector
+
+    return:
+    averages - (points, sq_avg, sq_err) for every width: q of the output points, weighted average
+               of S(q) over the runs and its error, estimated from the scatter between the runs
+    """
+    reference_q = None
+    for filename in file_list:
         if args.verbose:
-            print("Done plotting combined superfluid fractions file")
+            print(f"processing: {filename}")
+        with instrumentation.span("load"):
+            data = load_columns(filename, usecols=(0, 1, 2))
+        q, sq, w = data[:, 0], data[:, 1], data[:, 2]
+
+        if reference_q is None:
+            reference_q = q
+            reference_targets, all_points = zip(*[wavevector_index(q, width) for width in radial_widths])
+            # weighted sums of every width: weight, weight * S, weight * S^2 and number of runs
+            sums = [np.zeros((4, len(points))) for points in all_points]
+
+        if np.array_equal(q, reference_q):
+            targets = reference_targets
+        else:
+            # rows written in a different order (or onto other wavevectors) need their own index
+            instrumentation.count("sq_index_rebuilds")
+            targets = []
+            for width, points in zip(radial_widths, all_points):
+                target, file_points = wavevector_index(q, width)
+                if file_points.shape != points.shape or not np.allclose(file_points, points, rtol=1e-12, atol=0, equal_nan=True):
+                    raise ValueError(f"The wavevectors of {filename} differ from those of {file_list[0]}")
+                targets.append(target)
+
+        for target, points, (sum_w, sum_ws, sum_ws2, num_runs) in zip(targets, all_points, sums):
+            # weight and weighted mean of this run at every output point
+            run_w = np.bincount(target, weights=w, minlength=len(points))
+            run_sq = np.bincount(target, weights=w * sq, minlength=len(points)) / np.where(run_w > 0, run_w, 1)
+
+            sum_w += run_w
+            sum_ws += run_w * run_sq
+            sum_ws2 += run_w * run_sq ** 2
+            num_runs += run_w > 0
+
+    averages = []
+    for points, (sum_w, sum_ws, sum_ws2, num_runs) in zip(all_points, sums):
+        occupied = sum_w > 0
+        sum_w, sum_ws, sum_ws2, num_runs = sum_w[occupied], sum_ws[occupied], sum_ws2[occupied], num_runs[occupied]
+
+        sq_avg = sum_ws / sum_w
+        # weighted scatter of the runs around the average, reduced to the error of the average
+        scatter = np.maximum(sum_ws2 - sum_ws * sq_avg, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sq_err = np.sqrt(scatter / ((num_runs - 1) * sum_w))
+        averages.append((points[occupied], sq_avg, sq_err))
+
+    return averages
 
 
 """
-Compute a weighted average of the structure factor
+Compute a weighted average of the structure factor, written to sq_combined, and with a
+`radial_width` also its radial average, written to sq_radial, from the same pass over the files
 """
-def combine_sq(dirname, extension, block):
-    structure_factors = []
-    weights = []
+def combine_sq(dirname, extension, block, radial_width=0.0):
     if args.verbose:
         print("----------------------------------------------")
         print(f"Combining structure factor files inside {dirname}:")
         print("----------------------------------------------")
-    file_list = find_files_with_extension(dirname, f'**/*{extension}')
-    for filename in file_list:
-        if args.verbose:
-            print(f"processing: {filename}")
-        data = np.loadtxt(filename)
-        # need to sort each file, since .sq files are not necessarily in order
-        sorted_indices = np.argsort(data[:, 0])
-        wavevectors = data[:, 0][sorted_indices]
-        sq = data[:, 1][sorted_indices]
-        w = data[:, 2][sorted_indices]
-        # now add them to container to be combined before averaging
-        structure_factors.append(sq)
-        weights.append(w)
+    index = load_index(dirname)
+    file_list = files_with_extension(dirname, index, extension, quarantined_runs())
+    if not file_list:
+        nothing_to_combine(dirname, extension)
+        return
+
+    outputs = [("sq_combined", "q  S(q)  error", 0.0)]
+    if radial_width > 0:
+        outputs.append(("sq_radial", "|q|  S(|q|)  error", radial_width))
+    averages = average_sq(file_list, [width for _, _, width in outputs])
 
     if args.verbose:
-        print("Done processing structure factor files, now block averaging")
+        print("Done averaging structure factors")
+
+    convention = f"error: standard error of the weighted mean over {len(file_list)} runs\n"
+    for (name, columns, _), (wavevectors, sq_avg, sq_err) in zip(outputs, averages):
+        # save the averaged structure factor into a combined file
+        with instrumentation.span("save"):
+            np.savetxt(os.path.join(dirname, name), np.column_stack([wavevectors, sq_avg, sq_err]),
+                       fmt='%.4e', delimiter='\t', header=convention + columns)
+
+        if args.plot:
+
+            with instrumentation.span("plot"):
+                if args.verbose:
+                    print(f"--plot option detected, starting to plot {name} file")
+
+                num_points = sq_avg.shape[0]
+                max_points = 100
+                if num_points > max_points:
+                    spacing = num_points // max_points
+                else:
+                    spacing = 1
+                # every output gets a figure of its own
+                plt.clf()
+                plt.errorbar(wavevectors[::spacing], sq_avg[::spacing], yerr=sq_err[::spacing], fmt='d')
+                plt.xlabel("wavevector, q")
+                plt.ylabel("structure factor")
+                os.makedirs(os.path.join(dirname, "images"), exist_ok=True)
+                plt.savefig(os.path.join(dirname, "images", f"{name}.png"))
 
-    # stack arrays into the form: row -- wavevector/weight, column -- run
-    sq_array = np.column_stack(structure_factors)
-    weights_array = np.column_stack(weights)
 
-    # perform the weighted average
-    sq_avg = np.sum(weights_array * sq_array, axis=1) / np.sum(weights_array, axis=1)
+"""
+Peaks of a set of g(r) curves, vectorized over the curves: the peaks are located once on the
+average curve, then a parabola is fitted by least squares to the top of each peak (where the
+average is within a quarter of the peak's prominence of its maximum) on every curve at once
+"""
+def find_peaks_gr(r, curves, mean_curve, num_peaks):
+    """
+    r - distances
+    curves - g(r) curves (e.g. block averages or bootstrap resamples), shape (curves, points)
+    mean_curve - average g(r), used to locate the peaks
+    num_peaks - number of most prominent peaks to follow
+
+    return:
+    positions, heights - of every peak (in order of distance) on every curve, shape (curves, peaks)
+    """
+    peaks, properties = find_peaks(mean_curve, prominence=0, width=0, rel_height=0.25)
+    chosen = np.sort(np.argsort(properties["prominences"])[::-1][:num_peaks])
+
+    positions = np.empty((len(curves), len(chosen)))
+    heights = np.empty((len(curves), len(chosen)))
+    for k, p in enumerate(chosen):
+        # at least five points, so that the parabola is fitted rather than interpolated
+        first = min(int(np.floor(properties["left_ips"][p])), peaks[p] - 2)
+        last = max(int(np.ceil(properties["right_ips"][p])), peaks[p] + 2) + 1
+        first, last = max(first, 0), min(last, len(r))
+
+        # the fit is linear in the coefficients, so one pseudo-inverse serves every curve
+        centre = r[peaks[p]]
+        x = r[first:last] - centre
+        a, b, c = np.linalg.pinv(np.column_stack([x ** 2, x, np.ones_like(x)])) @ curves[:, first:last].T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shift = np.where(a < 0, -b / (2 * a), 0)
+        positions[:, k] = centre + shift
+        heights[:, k] = c + b * shift / 2
+
+    return positions, heights
 
-    # compute the (unbiased) weighted standard deviation
-    sq_var = np.sum(weights_array * (sq_array - sq_avg[:, np.new_axis]) ** 2) \
-             / (np.sum(weights_array, axis=1) - 1)
-    sq_std = np.sqrt(sq_var)
 
-    num_points = sq_avg.shape[0]
+"""
+Average the pair distribution function g(r) over all runs, with errors from blocks of runs or
+from a Poisson bootstrap over runs. The runs are streamed: only the running sums of the blocks
+or of the resamples are kept, never all the curves
+"""
+def combine_gr(dirname, extension, blocksize, method="blocking", resamples=1000, num_peaks=2, seed=0):
+    """
+    dirname - ensemble directory containing the runs
+    blocksize - number of runs per block (blocking method)
+    method - 'blocking' or 'bootstrap'
+    resamples - number of bootstrap resamples (bootstrap method)
+    num_peaks - number of peaks of g(r) whose position and height are estimated
+    seed - seed of the bootstrap weights
+    """
+    if args.verbose:
+        print("----------------------------------------------")
+        print(f"Combining pair distribution files inside {dirname}:")
+        print("----------------------------------------------")
+    index = load_index(dirname)
+    file_list = files_with_extension(dirname, index, extension, quarantined_runs())
+    if not file_list:
+        nothing_to_combine(dirname, extension)
+        return
+
+    rng = np.random.default_rng(seed)
+    r = None
+    num_runs = 0
+    for filename in file_list:
+        if args.verbose:
+            print(f"processing: {filename}")
+        with instrumentation.span("load"):
+            data = load_columns(filename, usecols=(0, 1))
+        if not data.any():
+            continue
 
-    final = np.column_stack([wavevectors, sq_avg])
+        if r is None:
+            # every run histograms onto the same grid of distances, set up by the first run
+            r = data[:, 0]
+            total = np.zeros(len(r))
+            block_sums = []
+            weight_sums = np.zeros(resamples)
+            resample_sums = np.zeros((resamples, len(r)))
+        elif not np.array_equal(data[:, 0], r):
+            raise ValueError(f"The distances of {filename} differ from those of the first run, cannot combine")
+
+        gr = data[:, 1]
+        total += gr
+        if method == "bootstrap":
+            # Poisson bootstrap: every resample draws each run a Poisson(1) number of times
+            weights = rng.poisson(1, size=resamples)
+            weight_sums += weights
+            resample_sums += weights[:, np.newaxis] * gr
+        else:
+            if num_runs % blocksize == 0:
+                block_sums.append(np.zeros(len(r)))
+            block_sums[-1] += gr
+        num_runs += 1
+
+    if r is None:
+        raise ValueError(f"No {extension} files with data found in {dirname}")
+    # the errors need the scatter of at least two blocks (or runs to resample)
+    if method == "bootstrap" and num_runs < 2:
+        raise ValueError(f"Found {num_runs} {extension} file with data in {dirname}, the bootstrap needs at least 2")
+    if method != "bootstrap" and len(block_sums) < 2:
+        raise ValueError(f"The {num_runs} {extension} files with data in {dirname} make {len(block_sums)} block of "
+                         f"{blocksize} runs, at least 2 blocks are needed: please choose a smaller blocksize")
+
+    gr_avg = total / num_runs
+    if method == "bootstrap":
+        # resamples which drew no run at all are left out
+        drawn = weight_sums > 0
+        curves = resample_sums[drawn] / weight_sums[drawn, np.newaxis]
+        gr_err = np.std(curves, axis=0)
+        peak_curves = curves
+    else:
+        # as in combine_sf, the excess runs form a last, smaller block
+        sizes = np.array([blocksize] * (num_runs // blocksize) + ([num_runs % blocksize] if num_runs % blocksize else []))
+        block_sums = np.array(block_sums)
+        curves = block_sums / sizes[:, np.newaxis]
+        gr_err = np.std(curves, axis=0, ddof=1) / np.sqrt(len(curves))
+        # peaks are not linear in g(r), so their errors come from a jackknife over the blocks:
+        # the averages leaving out one block each are as smooth as the full average
+        peak_curves = (total - block_sums) / (num_runs - sizes[:, np.newaxis])
+
+    with instrumentation.span("peaks"):
+        positions, heights = find_peaks_gr(r, peak_curves, gr_avg, num_peaks)
+        mean_positions, mean_heights = find_peaks_gr(r, gr_avg[np.newaxis, :], gr_avg, num_peaks)
+        if method == "bootstrap":
+            position_err, height_err = np.std(positions, axis=0), np.std(heights, axis=0)
+        else:
+            jackknife = lambda values: np.sqrt((len(values) - 1) * np.mean((values - np.mean(values, axis=0)) ** 2, axis=0))
+            position_err, height_err = jackknife(positions), jackknife(heights)
 
-    # save the averaged structure factor into a combined file
-    save_file = os.path.join(args.dirname, 'sq_combined')
-    np.savetxt(save_file, final, fmt='%.4e', delimiter='\t', header="q  S(q)")
+    with instrumentation.span("save"):
+        if method == "bootstrap":
+            convention = f"error: standard error of the mean, from {len(curves)} Poisson bootstrap resamples of {num_runs} runs\n"
+        else:
+            convention = f"error: standard error of the mean over {len(curves)} blocks of {blocksize} runs\n"
+        np.savetxt(os.path.join(dirname, 'gr_combined'), np.column_stack([r, gr_avg, gr_err]),
+                   fmt='%.6e', delimiter='\t', header=convention + "r  g(r)  error")
+        peaks = np.column_stack([np.arange(1, positions.shape[1] + 1), mean_positions[0], position_err,
+                                 mean_heights[0], height_err])
+        np.savetxt(os.path.join(dirname, 'gr_peaks'), peaks, fmt=['%d', '%.6e', '%.6e', '%.6e', '%.6e'],
+                   delimiter='\t', header="peak  position  error  height  error")
 
     if args.verbose:
-        print("Done block averaging structure factors")
+        print(f"Averaged g(r) over {num_runs} runs, errors from {len(curves)} {'resamples' if method == 'bootstrap' else 'blocks'}")
+        for k, position, position_err, height, height_err in peaks:
+            print(f"peak {int(k)}: r = {position:.4f} +- {position_err:.4f}, g = {height:.4f} +- {height_err:.4f}")
 
     if args.plot:
-        
-        if args.verbose:
-            print("--plot option detected, starting to plot combined structure factors file")
 
-        max_points = 100
-        if num_points > max_points:
-            spacing = num_points // max_points
-        else:
-            spacing = 1
-        plt.scatter(wavevectors[::spacing], sq_avg[::spacing], marker='d')
-        plt.xlabel("wavevector, q")
-        plt.ylabel("structure factor")
-        plt.savefig(os.path.join(dirname, "images", "sq_combined.png"))
+        with instrumentation.span("plot"):
+            plt.errorbar(r, gr_avg, yerr=gr_err, fmt='o', markersize=2, capsize=1)
+            plt.errorbar(mean_positions[0], mean_heights[0], xerr=position_err, yerr=height_err,
+                         fmt='none', ecolor='red', capsize=3)
+            plt.xlabel("distance, r")
+            plt.ylabel("pair distribution function, g(r)")
+            plt.savefig(os.path.join(dirname, "images", "gr_combined.png"))
 
 
 """
 Average kinetic, potential, total energies as a function of simulation block
 """
 def combine_en(dirname, extension, block):
-    file_list = find_files_with_extension(dirname, f'**/*{extension}')
-    file_list = sorted(file_list, key=lambda s: int([t for t in s.split("/") if "run_" in t][0].split("_")[1]))
-
-    config_file = find_files_with_extension(dirname, f'run_1/*.sy')[0]
-    found_line = get_line_containing_string(config_file, "PASS")
-
-    num_of_blocks = int(found_line.split(" ")[-1]) # last field in line is number of blocks
+    # files come out of the index in order of run number, with the directives of the .sy file of
+    # the first run that is not quarantined
+    index = load_index(dirname)
+    excluded = quarantined_runs()
+    file_list = files_with_extension(dirname, index, extension, excluded)
+    if not file_list:
+        nothing_to_combine(dirname, extension)
+        return
+    first_run = min(set(run_numbers(index)) - excluded)
+
+    num_of_blocks = int(run_config(index, first_run)["PASS"][-1]) # last field in line is number of blocks
 
     kinetic_array = np.full((num_of_blocks, len(file_list)), np.nan) # number of blocks by number of files
     potential_array = np.full((num_of_blocks, len(file_list)), np.nan)
     total_array = np.full((num_of_blocks, len(file_list)), np.nan)
 
     for i, filename in enumerate(file_list):
-        data = np.loadtxt(filename)
+        with instrumentation.span("load"):
+            data = load_columns(filename, usecols=(0, 1, 2, 3))
         found_blocks = len(data[:, 0])
         kinetic_array[:found_blocks, i] = data[:, 1]
         potential_array[:found_blocks, i] = data[:, 2]
@@ -283,8 +529,9 @@ def combine_en(dirname, extension, block):
     final = np.column_stack([np.arange(1,max_blocks+1), kin_avg, pot_avg, total_avg])
 
     save_file = os.path.join(args.dirname, 'energies_combined')
-    np.savetxt(save_file, final, fmt=['%d', '%1.6e', '%1.6e', '%1.6e'], delimiter='\t', 
-               header='block     kinetic     potential       total')
+    with instrumentation.span("save"):
+        np.savetxt(save_file, final, fmt=['%d', '%1.6e', '%1.6e', '%1.6e'], delimiter='\t',
+                   header='block     kinetic     potential       total')
 
 
 if __name__ == "__main__":
@@ -295,19 +542,29 @@ if __name__ == "__main__":
                                              e.g. '.sd' for combining superfluid density files together")
     parser.add_argument("--plot", action="store_true", help="whether to plot the combined file", default=False)
     parser.add_argument("--method", help="select which method to use: [bootstrap, blocking]", default="blocking")
+    parser.add_argument("--resamples", type=int, help="for .gr files: number of bootstrap resamples with --method bootstrap", default=1000)
+    parser.add_argument("--peaks", type=int, help="for .gr files: number of peaks of g(r) to estimate", default=2)
+    parser.add_argument("--radial_width", type=float, help="for .sq files: also average S(q) in bins of this width in |q|, written to sq_radial", default=0.0)
+    parser.add_argument("--quarantine", help="list of runs to leave out, as written by health_check.py")
     parser.add_argument("--verbose", action="store_true", help="verbosity level")
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
     args = parser.parse_args()
 
     allowed_methods = ["bootstrap", "blocking"]
     if args.method not in allowed_methods:
         raise ValueError(f"Please choose one of: {allowed_methods}")
 
-    allowed_modes = [".sd", ".en", ".sq"]
+    allowed_modes = [".sd", ".en", ".sq", ".gr"]
     if args.extension == ".sd":
         combine_sf(args.dirname, args.extension, args.blocksize)
     elif args.extension == ".en":
         combine_en(args.dirname, args.extension, args.blocksize)
     elif args.extension == ".sq":
-        combine_sq(args.dirname, args.extension, args.blocksize)
+        combine_sq(args.dirname, args.extension, args.blocksize, args.radial_width)
+    elif args.extension == ".gr":
+        combine_gr(args.dirname, args.extension, args.blocksize, args.method, args.resamples, args.peaks)
     else:
-        raise ValueError(f"The provided extension is invalid, please choose from {allowed_modes}")
\ No newline at end of file
+        raise ValueError(f"The provided extension is invalid, please choose from {allowed_modes}")
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
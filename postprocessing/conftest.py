@@ -0,0 +1,121 @@
+import argparse
+import glob
+import os
+
+import matplotlib
+import numpy as np
+import pytest
+
+matplotlib.use("Agg")
+
+import bootstrap_fit
+import combine_files_all_runs
+import metropolis_fitting
+from fits import ALLOWED_FILETYPES
+from synthetic_ensemble import generate_ensemble, superfluid_data
+
+
+"""
+Shared fixtures for the tests and benchmarks of the postprocessing scripts. The scripts keep
+their command-line options in module-level globals (`args`, `verbose`, `rng`, ...), which are
+set here the same way the `__main__` blocks would set them
+"""
+
+
+# (runs, slices) for the small, medium and large synthetic ensembles
+ENSEMBLE_SIZES = {"small": (4, 40), "medium": (20, 160), "large": (100, 640)}
+
+
+"""
+Tests marked slow (machine-dependent micro-benchmarks and the like) only run with --run_slow
+"""
+def pytest_addoption(parser):
+    parser.addoption("--run_slow", action="store_true", help="also run the tests marked slow", default=False)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: slow or machine-dependent test, only run with --run_slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run_slow"):
+        return
+    skip = pytest.mark.skip(reason="slow, run with --run_slow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip)
+
+
+"""
+Synthetic data for the tests, written under the test's temporary directory
+"""
+class SyntheticData:
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+
+    def ensemble(self, size, **kwargs):
+        """
+        size - one of ENSEMBLE_SIZES
+        kwargs - options of generate_ensemble
+
+        return:
+        dirname - ensemble directory containing the runs
+        """
+        num_runs, slices = ENSEMBLE_SIZES[size]
+        dirname = str(self.tmp_path / f"{size}_ensemble")
+        generate_ensemble(dirname, num_runs, slices, **kwargs)
+        return dirname
+
+    def superfluid_curve(self, slices, seed=0):
+        return superfluid_data(np.random.default_rng(seed), slices, beta=0.25)
+
+    def energy_series(self, blocks, seed=0):
+        rng = np.random.default_rng(seed)
+        return np.column_stack([np.arange(1, blocks + 1), rng.normal(size=(blocks, 3))])
+
+    def run_files(self, dirname, extension):
+        return glob.glob(os.path.join(dirname, f"run_*/*{extension}"))
+
+
+@pytest.fixture
+def synthetic(tmp_path):
+    return SyntheticData(tmp_path)
+
+
+@pytest.fixture
+def combine_args(monkeypatch):
+    def configure(dirname):
+        namespace = argparse.Namespace(dirname=dirname, verbose=False, plot=False, quarantine=None)
+        monkeypatch.setattr(combine_files_all_runs, "args", namespace, raising=False)
+        return namespace
+    return configure
+
+
+@pytest.fixture
+def bootstrap_globals(monkeypatch):
+    monkeypatch.setattr(bootstrap_fit, "verbose", False, raising=False)
+
+
+@pytest.fixture
+def metropolis_globals(monkeypatch):
+    def configure(filetype="sf_time", seed=927, **options):
+        namespace = argparse.Namespace(domain="", throwaway_first=True, throwaway_last=True,
+                                       p_interval=0, max_points=100, skip=1, restart=False,
+                                       reduction="skip", backend="python",
+                                       proposal="single", burn_in=10)
+        for key, value in options.items():
+            setattr(namespace, key, value)
+        model = ALLOWED_FILETYPES[filetype]
+        monkeypatch.setattr(metropolis_fitting, "args", namespace, raising=False)
+        monkeypatch.setattr(metropolis_fitting, "verbose", False, raising=False)
+        monkeypatch.setattr(metropolis_fitting, "rng", np.random.default_rng(seed), raising=False)
+        monkeypatch.setattr(metropolis_fitting, "fitting_func", model["fit"], raising=False)
+        monkeypatch.setattr(metropolis_fitting, "fit_eqn", model["fit eqn"], raising=False)
+        monkeypatch.setattr(metropolis_fitting, "x_label", model["x-label"], raising=False)
+        monkeypatch.setattr(metropolis_fitting, "y_label", model["y-label"], raising=False)
+        monkeypatch.setattr(metropolis_fitting, "param_names", model["param names"], raising=False)
+        monkeypatch.setattr(metropolis_fitting, "fitting_bounds", model["bounds"], raising=False)
+        monkeypatch.setattr(metropolis_fitting, "deltas", list(model["displacements"]), raising=False)
+        return namespace
+    return configure
+
@@ -0,0 +1,390 @@
+import argparse
+import datetime
+import json
+import multiprocessing as mp
+import os
+import platform
+import tempfile
+import time
+from math import ceil
+
+import numpy as np
+
+import bootstrap_fit
+import metropolis_fitting
+from bootstrap_fit import process_batch, work_units, UNIT_ITERATIONS
+from ensemble_index import load_index, files_with_extension
+from fits import ALLOWED_FILETYPES, NO_BOUNDS, is_linear
+from loaders import load_columns
+from metropolis_kernels import DEFAULT_BACKEND, get_block_runners
+from streaming_stats import centred_edges
+from synthetic_ensemble import energy_data, superfluid_data
+
+
+"""
+Runtime cost model used to size the fit and combine jobs. `calibrate` micro-benchmarks the
+machine it runs on (run it on a compute node): the cost of one bootstrap resample and of one
+Metropolis pass of every model in ALLOWED_FILETYPES, as a function of the number of fitted points,
+the parse throughput of the output files and the startup cost of a worker pool. `plan` turns
+these figures into the predicted wall time of a bootstrap, Metropolis or combine job for every
+core count, picks the core count past which more cores stop paying off, and prints the Slurm
+directives to request. The figures come from synthetic data, so hard fits (e.g. many failing
+or slowly converging resamples) take longer than predicted: the suggested time has a margin
+"""
+
+
+# default calibration file, shared by the jobs that run the scripts from this directory
+CALIBRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cost_model.json")
+
+# numbers of fitted points the costs are measured at: costs in between are interpolated linearly
+CALIBRATION_POINTS = (50, 200)
+
+# x range and parameters of the synthetic data every model is calibrated on
+CALIBRATION_MODELS = {
+    "en_proj_time": ((0.05, 1.0), (-140.0, 5.0, 10.0)),
+    "en_time_step": ((0.00125, 0.02), (-140.0, 3e6)),
+    "sf_time": ((0.002, 0.25), (0.05, 40.0, 0.3)),
+    "sf_proj_time": ((0.05, 1.0), (0.3, 0.2, 10.0)),
+}
+
+# more cores are only worth it while they cut the predicted time by more than this fraction
+CORE_SLACK = 0.05
+
+# the suggested --time is the prediction times SAFETY plus MARGIN seconds (loading modules, I/O)
+SAFETY = 1.5
+MARGIN = 300
+
+
+"""
+Synthetic data of a model: the model on `points` evenly spaced x values, with 1% noise
+"""
+def model_data(filetype, points, rng):
+    (low, high), params = CALIBRATION_MODELS[filetype]
+    x = np.linspace(low, high, points)
+    y = ALLOWED_FILETYPES[filetype]["fit"](x, *params)
+    yerr = 0.01 * np.abs(y) + 1e-4
+    return x, y + rng.normal(scale=yerr), yerr
+
+
+"""
+Seconds per bootstrap resample of a model, timed through the code path bootstrap_fit.py uses
+"""
+def time_bootstrap(filetype, points, samples, rng):
+    """
+    filetype - model in ALLOWED_FILETYPES
+    points - number of fitted points
+    samples - number of resamples to time (linear models are timed on a whole work unit)
+    rng - random number generator of the synthetic data
+
+    return:
+    seconds - wall time of one resample
+    """
+    model = ALLOWED_FILETYPES[filetype]
+    x, y, yerr = model_data(filetype, points, rng)
+    guess = np.array(CALIBRATION_MODELS[filetype][1])
+    edges = centred_edges(guess, 0.1 * np.abs(guess))
+
+    if is_linear(filetype) and model["bounds"] == NO_BOUNDS:
+        begin = time.perf_counter()
+        bootstrap_fit.linear_bootstrap(model["basis"](x), y, yerr, UNIT_ITERATIONS, edges)
+        return (time.perf_counter() - begin) / UNIT_ITERATIONS
+
+    begin = time.perf_counter()
+    process_batch(model["fit"], [(0, samples)], 0, x, y, yerr, guess, model["bounds"], edges, False)
+    return (time.perf_counter() - begin) / samples
+
+
+"""
+Seconds per Metropolis pass of a model, with the backend metropolis_fitting.py picks by default
+"""
+def time_metropolis(filetype, points, passes, rng, backend=DEFAULT_BACKEND):
+    model = ALLOWED_FILETYPES[filetype]
+    x, y, yerr = model_data(filetype, points, rng)
+    params = np.array(CALIBRATION_MODELS[filetype][1])
+    deltas = 0.01 * np.abs(params)
+
+    if backend == "python":
+        # the pass loop of the engine, drawing from the generator of metropolis_fitting.py
+        metropolis_fitting.rng = rng
+
+        def block(n):
+            current = params
+            for _ in range(n):
+                i = rng.integers(0, len(params))
+                proposed = current.copy()
+                proposed[i] = metropolis_fitting.displace(current[i], deltas[i])
+                current, _ = metropolis_fitting.accept(x, y, yerr, current, proposed, model["fit"])
+    else:
+        run_block, _, kernel_model = get_block_runners(backend, model["fit"])
+
+        def block(n):
+            return run_block(kernel_model, x, y, 1 / yerr ** 2, params, deltas, rng.integers(0, len(params), size=n),
+                             rng.random(n), rng.random(n), np.empty((n, len(params))))
+
+    # the first call compiles a kernel
+    block(10)
+    begin = time.perf_counter()
+    block(passes)
+    return (time.perf_counter() - begin) / passes
+
+
+"""
+Bytes per second parsed by load_columns, on synthetic .en and .sd files
+"""
+def time_parsing(rows, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        files = [(os.path.join(directory, "calibration.en"), energy_data(rng, rows), ["%d", "%1.6e", "%1.6e", "%1.6e"]),
+                 (os.path.join(directory, "calibration.sd"), superfluid_data(rng, rows, 0.25), "%.6e")]
+        for filename, data, fmt in files:
+            np.savetxt(filename, data, fmt=fmt)
+
+        total_bytes = sum(os.path.getsize(filename) for filename, _, _ in files)
+        begin = time.perf_counter()
+        for filename, _, _ in files:
+            load_columns(filename)
+        return total_bytes / (time.perf_counter() - begin)
+
+
+"""
+Startup cost of a pool of n workers, up to the moment all of them answered a first task, as
+a + b * n seconds
+"""
+def time_pool_startup(max_cores):
+    counts = sorted({min(n, max_cores) for n in [1, 2, 4, 8, 16, 32, 64]})
+    seconds = []
+    for n in counts:
+        begin = time.perf_counter()
+        with mp.Pool(processes=n) as pool:
+            pool.map(abs, range(n), chunksize=1)
+        seconds.append(time.perf_counter() - begin)
+
+    if len(counts) == 1:
+        return [seconds[0], 0.0]
+    b, a = np.polyfit(counts, seconds, 1)
+    return [float(max(a, 0.0)), float(max(b, 0.0))]
+
+
+"""
+Measure the cost figures of the machine
+"""
+def calibrate(samples=50, passes=20000, rows=50000, max_cores=None, seed=0):
+    """
+    samples - number of bootstrap resamples timed per model and number of points
+    passes - number of Metropolis passes timed per model and number of points
+    rows - number of rows of each synthetic file whose parsing is timed
+    max_cores - largest pool whose startup is timed (default: the cores of the machine)
+    seed - seed of the synthetic data
+
+    return:
+    calibration - {'machine', 'created', 'cpu_count', 'points', 'bootstrap', 'metropolis',
+                   'parse_bytes_per_s', 'pool_startup'}: per-model costs are [a, b] with
+                   cost = a + b * points seconds
+    """
+    rng = np.random.default_rng(seed)
+    max_cores = max_cores or os.cpu_count()
+
+    costs = {"bootstrap": {}, "metropolis": {}}
+    for filetype in ALLOWED_FILETYPES:
+        for job, timer, amount in [("bootstrap", time_bootstrap, samples), ("metropolis", time_metropolis, passes)]:
+            seconds = [timer(filetype, points, amount, rng) for points in CALIBRATION_POINTS]
+            b = (seconds[1] - seconds[0]) / (CALIBRATION_POINTS[1] - CALIBRATION_POINTS[0])
+            a = seconds[0] - b * CALIBRATION_POINTS[0]
+            # timing noise can make either coefficient negative: the larger size then fixes the other
+            if a < 0:
+                a, b = 0.0, seconds[1] / CALIBRATION_POINTS[1]
+            elif b < 0:
+                a, b = seconds[1], 0.0
+            costs[job][filetype] = [float(a), float(b)]
+
+    return {"machine": platform.node(),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "cpu_count": os.cpu_count(),
+            "points": list(CALIBRATION_POINTS),
+            "bootstrap": costs["bootstrap"],
+            "metropolis": costs["metropolis"],
+            "parse_bytes_per_s": time_parsing(rows, rng),
+            "pool_startup": time_pool_startup(max_cores)}
+
+
+def cost(coefficients, points):
+    return coefficients[0] + coefficients[1] * points
+
+
+"""
+Predicted wall time of a bootstrap fit on `cores` cores, following how fit_with_bootstrap splits
+the work units into batches
+"""
+def bootstrap_time(calibration, filetype, iterations, points, cores, shard=(1, 1)):
+    """
+    calibration - figures returned by calibrate
+    filetype - model in ALLOWED_FILETYPES
+    iterations - total number of bootstrap iterations
+    points - number of fitted points
+    cores - number of cores
+    shard - (k, N): only the work units of the k-th of N shards
+
+    return:
+    seconds - predicted wall time
+    """
+    per_resample = cost(calibration["bootstrap"][filetype], points)
+    units = work_units(iterations, shard)
+    model = ALLOWED_FILETYPES[filetype]
+    # linear models are solved in closed form in the main process
+    if is_linear(filetype) and model["bounds"] == NO_BOUNDS:
+        return sum(n for _, n in units) * per_resample
+
+    num_batches = max(1, min(cores, len(units)))
+    longest = max(sum(n for _, n in units[i * len(units) // num_batches:(i + 1) * len(units) // num_batches])
+                  for i in range(num_batches))
+    return cost(calibration["pool_startup"], cores) + longest * per_resample
+
+
+"""
+Number of shards a bootstrap has to be split into for every shard to fit in the time limit
+"""
+def plan_shards(calibration, filetype, iterations, points, cores, time_limit):
+    """
+    calibration - figures returned by calibrate
+    filetype - model in ALLOWED_FILETYPES
+    iterations - total number of bootstrap iterations
+    points - number of fitted points
+    cores - number of cores of every shard
+    time_limit - longest allowed job in seconds, safety factor and margin included
+
+    return:
+    shards - number of shards (one per work unit at most)
+    seconds - predicted wall time of the longest shard
+    """
+    # the work of the whole run spread evenly over the shards is a lower bound on the shards needed
+    budget = (time_limit - MARGIN) / SAFETY - cost(calibration["pool_startup"], cores)
+    work = bootstrap_time(calibration, filetype, iterations, points, cores) - cost(calibration["pool_startup"], cores)
+    num_units = ceil(iterations / UNIT_ITERATIONS)
+    shards = min(max(1, int(work // budget)), num_units) if budget > 0 else 1
+    while True:
+        seconds = max(bootstrap_time(calibration, filetype, iterations, points, cores, (k, shards))
+                      for k in range(1, shards + 1))
+        if SAFETY * seconds + MARGIN <= time_limit or shards >= num_units:
+            return shards, seconds
+        shards += 1
+
+
+def metropolis_time(calibration, filetype, blocks, passes, points):
+    return blocks * passes * cost(calibration["metropolis"][filetype], points)
+
+
+def combine_time(calibration, total_bytes):
+    return total_bytes / calibration["parse_bytes_per_s"]
+
+
+"""
+Smallest core count whose predicted time is within CORE_SLACK of the fastest one
+"""
+def best_cores(times):
+    """
+    times - {cores: predicted seconds}
+
+    return:
+    cores - recommended number of cores
+    """
+    fastest = min(times.values())
+    return min(cores for cores, seconds in times.items() if seconds <= (1 + CORE_SLACK) * fastest)
+
+
+"""
+Slurm --time of a predicted wall time, with the safety factor and margin, as D-HH:MM:SS
+"""
+def slurm_time(seconds):
+    total = ceil((SAFETY * seconds + MARGIN) / 60) * 60
+    days, rest = divmod(total, 86400)
+    return f"{days}-{rest // 3600:02d}:{rest % 3600 // 60:02d}:00"
+
+
+def parse_duration(text):
+    days, _, clock = text.rpartition("-")
+    fields = [int(field) for field in clock.split(":")]
+    fields = [0] * (3 - len(fields)) + fields
+    return (int(days) if days else 0) * 86400 + fields[0] * 3600 + fields[1] * 60 + fields[2]
+
+
+def format_seconds(seconds):
+    if seconds < 60:
+        return f"{seconds:.2f} s"
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", help="'calibrate' the machine, or 'plan' a job")
+    parser.add_argument("--calibration", help="calibration file", default=CALIBRATION)
+    parser.add_argument("--job", help="type of job to plan: [bootstrap, metropolis, combine]", default="bootstrap")
+    parser.add_argument("--filetype", help=f"model that is fitted: {ALLOWED_FILETYPES.keys()}", default="sf_time")
+    parser.add_argument("--points", type=int, help="number of fitted points (after --max_points / --skip)", default=100)
+    parser.add_argument("--bootstrap_iterations", type=int, help="number of bootstrap iterations", default=int(1e5))
+    parser.add_argument("--blocks", type=int, help="number of Metropolis blocks", default=500)
+    parser.add_argument("--passes", type=int, help="number of Metropolis passes per block", default=500)
+    parser.add_argument("--dirname", help="ensemble directory to be combined")
+    parser.add_argument("--extension", help="extension of the files to be combined", default=".sd")
+    parser.add_argument("--max_cores", type=int, help="largest core count to consider (calibrate: largest pool timed)", default=48)
+    parser.add_argument("--time_limit", help="longest job the cluster allows, as [D-]HH:MM:SS: longer bootstraps are split into shards", default="")
+    parser.add_argument("--samples", type=int, help="calibrate: number of bootstrap resamples timed per model", default=50)
+    args = parser.parse_args()
+
+    allowed_commands = ["calibrate", "plan"]
+    if args.command not in allowed_commands:
+        raise ValueError(f"Please choose one of: {allowed_commands}")
+
+    if args.command == "calibrate":
+        bootstrap_fit.verbose = False
+        calibration = calibrate(samples=args.samples, max_cores=min(args.max_cores, os.cpu_count()))
+        with open(args.calibration, "w") as f:
+            json.dump(calibration, f, indent=2)
+        print(f"Calibrated {calibration['machine']} ({calibration['cpu_count']} cores), written to {args.calibration}")
+        for filetype in ALLOWED_FILETYPES:
+            print(f"{filetype}: {1e3 * cost(calibration['bootstrap'][filetype], 100):.4f} ms per bootstrap resample, "
+                  f"{1e6 * cost(calibration['metropolis'][filetype], 100):.3f} us per Metropolis pass (100 points)")
+        print(f"parsing: {calibration['parse_bytes_per_s'] / 1e6:.1f} MB/s, pool startup: "
+              f"{calibration['pool_startup'][0]:.3f} s + {calibration['pool_startup'][1]:.3f} s per worker")
+
+    else:
+        with open(args.calibration) as f:
+            calibration = json.load(f)
+
+        allowed_jobs = ["bootstrap", "metropolis", "combine"]
+        if args.job not in allowed_jobs:
+            raise ValueError(f"Please choose one of: {allowed_jobs}")
+        if args.filetype not in ALLOWED_FILETYPES:
+            raise ValueError(f"Please choose one of: {ALLOWED_FILETYPES.keys()}")
+
+        # Metropolis and the combiners run in a single process
+        cores = 1
+        shards = 1
+        if args.job == "bootstrap":
+            times = {n: bootstrap_time(calibration, args.filetype, args.bootstrap_iterations, args.points, n)
+                     for n in range(1, args.max_cores + 1)}
+            cores = best_cores(times)
+            seconds = times[cores]
+            for n in sorted({1, 2, 4, 8, 16, 32, args.max_cores, cores}):
+                if n <= args.max_cores:
+                    print(f"{n:4d} cores: {format_seconds(times[n])}, {n * times[n] / 3600:.2f} core-hours")
+            # a bootstrap longer than the time limit is split into shards of consecutive work units
+            if args.time_limit:
+                shards, seconds = plan_shards(calibration, args.filetype, args.bootstrap_iterations, args.points,
+                                              cores, parse_duration(args.time_limit))
+        elif args.job == "metropolis":
+            seconds = metropolis_time(calibration, args.filetype, args.blocks, args.passes, args.points)
+        else:
+            index = load_index(args.dirname)
+            total_bytes = sum(os.path.getsize(filename)
+                              for filename in files_with_extension(args.dirname, index, args.extension))
+            seconds = combine_time(calibration, total_bytes)
+            print(f"{total_bytes / 1e6:.1f} MB of {args.extension} files")
+
+        print(f"Predicted wall time: {format_seconds(seconds)} on {cores} cores"
+              + (f" per shard, in {shards} shards" if shards > 1 else "")
+              + f" (calibrated on {calibration['machine']}, {calibration['created']})")
+        print("Suggested Slurm directives:")
+        print(f"#SBATCH --cpus-per-task={cores}")
+        print(f"#SBATCH --time={slurm_time(seconds)}")
+        if shards > 1:
+            print(f"#SBATCH --array=1-{shards}")
+            print(f"and bootstrap_fit.py --shard \"$SLURM_ARRAY_TASK_ID/{shards}\", then --merge the shard files")
@@ -1,26 +1,22 @@
 import argparse
-import glob
 import os
 
 import numpy as np
-# import matplotlib.pyplot as plt
-
 
-def find_files_with_extension(directory, pattern):
-    search_pattern = os.path.join(directory, pattern)
-    file_list = glob.glob(search_pattern, recursive=True)
-    return file_list
+from ensemble_index import load_index, files_with_extension
+from loaders import load_columns
+# import matplotlib.pyplot as plt
 
 
 def detect_evap(dirname):
 
-    file_list = find_files_with_extension(dirname, pattern=f'**/*.vis')
+    file_list = files_with_extension(dirname, load_index(dirname), '.vis')
     master_array = []
     evaporation = False
     for name in file_list:
         if args.verbose:
             print(f"processing: {name}")
-        data = np.loadtxt(name, usecols=2)
+        data = load_columns(name, usecols=2)
         if data[data > 10].size > 0:
             print(f"Evaporation detected in {name}")
             evaporation = True
@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import instrumentation
+
+
+"""
+Index of an ensemble directory (dirname/run_N/...), built with a single os.scandir pass over
+the run directories: the run numbers, every file of every run with its size and mtime, and the
+directives of each run's .sy configuration file. The index is persisted as a small JSON manifest
+inside the ensemble directory. Reloading it lists the ensemble directory and every run directory,
+and rescans the runs whose entries (files created, removed or renamed) or directory mtime changed
+since the last scan. The listing is compared because on Lustre/NFS a file created in the same mtime
+tick as the last scan leaves the directory's mtime unchanged
+"""
+
+
+MANIFEST = ".ensemble_index.json"
+
+# list of the runs left out of the combined results, written by health_check.py
+QUARANTINE = "quarantine"
+
+RUN_DIRECTORY = re.compile(r"^run_(\d+)$")
+
+
+"""
+Parse the directives of a .sy configuration file, e.g. {'PASS': ['100', '200'], 'RESTART': []}
+"""
+def parse_config(filename):
+    directives = {}
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if fields and not fields[0].startswith("#"):
+                directives[fields[0]] = fields[1:]
+    return directives
+
+
+"""
+Scan a single run directory
+"""
+def scan_run(path):
+    files = {}
+    others = []
+    config = {}
+    mtime_ns = os.stat(path).st_mtime_ns
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+                if entry.name.endswith(".sy"):
+                    config = parse_config(entry.path)
+            else:
+                others.append(entry.name)
+
+    return {"mtime_ns": mtime_ns, "files": files, "others": sorted(others), "config": config}
+
+
+"""
+Whether the indexed entry of a run still matches its directory: same mtime and the same entries
+"""
+def run_unchanged(path, known, mtime_ns):
+    if known is None or mtime_ns != known["mtime_ns"] or "others" not in known:
+        return False
+    return set(os.listdir(path)) == set(known["files"]).union(known["others"])
+
+
+"""
+Index an ensemble directory: one listing of the ensemble directory and one stat and listing per run,
+plus a scan of every run that is new or whose directory changed since the `previous` index
+"""
+def build_index(dirname, previous=None):
+    previous_runs = previous["runs"] if previous else {}
+    runs = {}
+    with os.scandir(dirname) as entries:
+        for entry in entries:
+            match = RUN_DIRECTORY.match(entry.name)
+            if match and entry.is_dir():
+                run = match.group(1)
+                known = previous_runs.get(run)
+                if run_unchanged(entry.path, known, entry.stat().st_mtime_ns):
+                    runs[run] = known
+                else:
+                    runs[run] = scan_run(entry.path)
+
+    return {"runs": runs}
+
+
+"""
+Write the manifest, atomically so that concurrent readers never see a partial file
+"""
+def save_index(dirname, index):
+    path = os.path.join(dirname, MANIFEST)
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        # read-only ensemble directories are indexed every time instead
+        pass
+
+
+"""
+Load the index of an ensemble directory, revalidating (and updating) the persisted manifest
+"""
+def load_index(dirname, stat_files=False):
+    """
+    dirname - ensemble directory containing the runs
+    stat_files - also refresh the size and mtime of every indexed file, which changes without
+                 touching its directory while a simulation appends to it
+
+    return:
+    index - {'runs': {run number: {'mtime_ns', 'files', 'others', 'config'}}}
+    """
+    with instrumentation.span("index"):
+        try:
+            with open(os.path.join(dirname, MANIFEST)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+
+        updated = build_index(dirname, index)
+        changed = updated != index
+        if stat_files:
+            for run, entry in updated["runs"].items():
+                for name, recorded in entry["files"].items():
+                    stat = os.stat(os.path.join(dirname, f"run_{run}", name))
+                    if recorded != [stat.st_size, stat.st_mtime_ns]:
+                        entry["files"][name] = [stat.st_size, stat.st_mtime_ns]
+                        changed = True
+        index = updated
+
+        if changed:
+            save_index(dirname, index)
+
+    return index
+
+
+"""
+Run numbers of the ensemble, in increasing order
+"""
+def run_numbers(index):
+    return sorted(int(run) for run in index["runs"])
+
+
+"""
+Paths of the files ending with `extension`, in order of run number, leaving out the runs in `exclude`
+"""
+def files_with_extension(dirname, index, extension, exclude=()):
+    file_list = []
+    for run in run_numbers(index):
+        if run in exclude:
+            continue
+        names = sorted(name for name in index["runs"][str(run)]["files"] if name.endswith(extension))
+        file_list += [os.path.join(dirname, f"run_{run}", name) for name in names]
+    return file_list
+
+
+"""
+Directives of the .sy configuration file of a run (default: the run with the lowest number)
+"""
+def run_config(index, run=None):
+    if run is None:
+        run = run_numbers(index)[0]
+    return index["runs"][str(run)]["config"]
+
+
+"""
+Run numbers in a quarantine list (lines starting with the run directory, '#' for comments)
+"""
+def load_quarantine(filename):
+    runs = set()
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            match = RUN_DIRECTORY.match(fields[0]) if fields else None
+            if match:
+                runs.add(int(match.group(1)))
+    return runs
+
+
+"""
+Seed of the random resamples of a file of an ensemble, derived from its path: resamples of
+different ensembles (or observables) get independent streams, and a rerun on the same file the
+same stream
+"""
+def ensemble_seed(filename):
+    digest = hashlib.sha256(os.path.realpath(filename).encode()).digest()
+    # 63 bits, so that the seed also fits in the int64 arrays of the saved samples
+    return int.from_bytes(digest[:8], "little") >> 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirname", help="ensemble directory containing the runs")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the manifest and scan the whole ensemble", default=False)
+    parser.add_argument("--stat_files", action="store_true", help="refresh the size and mtime of every indexed file", default=False)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        index = build_index(args.dirname)
+        save_index(args.dirname, index)
+    else:
+        index = load_index(args.dirname, args.stat_files)
+
+    runs = run_numbers(index)
+    print(f"{len(runs)} runs in {args.dirname}")
+    for run in runs:
+        files = index["runs"][str(run)]["files"]
+        size = sum(size for size, _ in files.values())
+        print(f"run_{run} {len(files)} files {size} bytes")
+
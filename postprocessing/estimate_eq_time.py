@@ -1,6 +1,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+from loaders import load_columns
+
 # Attempt at determining the equilibration time by using a moving average
 
 def moving_average(w, x):
@@ -24,11 +26,7 @@ if __name__ == "__main__":
     # input_file = input("Enter a file for estimation to be done: ")
     input_file = "/home/syu7/scratch/graphene_helium/optimal_time_step/slices_160_run/slices_160.he.en"
 
-    with open(input_file) as f:
-        lines = (line for line in f if not line.startswith('#'))
-        energy_data = np.loadtxt(lines)
-
-    total_energies = energy_data[:,-1]
+    total_energies = load_columns(input_file, usecols=3)
 
     # first order moving root mean square deviation
     ma = moving_average(40, total_energies)
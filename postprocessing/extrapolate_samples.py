@@ -0,0 +1,232 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+import instrumentation
+from results_db import make_records, write_records
+from fits import *
+
+
+"""
+Second-level extrapolation (time step -> 0 or projection time -> infinity) which propagates the
+bootstrap samples saved for every ensemble (bootstrap_fit.py/block_average.py --samples_file)
+instead of their printed summaries. One fit is done per joint sample row, all rows at once, so
+the final S(inf) or E_0 comes with an error that carries every correlation of the inputs
+"""
+
+
+"""
+Load saved samples: .npy arrays, or compressed .npz archives written by bootstrap_fit.py
+"""
+def load_samples(path):
+    if path.endswith(".npz"):
+        with np.load(path) as archive:
+            return archive["samples"]
+    return np.load(path)
+
+
+"""
+Seed the samples of a .npz archive were drawn with (None if it was not recorded)
+"""
+def load_seed(path):
+    if not path.endswith(".npz"):
+        return None
+    with np.load(path) as archive:
+        return int(archive["seed"]) if "seed" in archive else None
+
+
+"""
+Read the list of ensembles to extrapolate over: every line holds the value of the independent
+variate followed by the path of the .npy (or .npz) file with that ensemble's samples
+"""
+def read_sample_list(filename, column):
+    """
+    filename - list file, lines starting with '#' are ignored
+    column - column of the sample arrays holding the quantity to extrapolate
+
+    return:
+    x - values of the independent variate, one per ensemble
+    samples - joint sample rows, shape (rows, ensembles)
+    """
+    x = []
+    samples = []
+    seeds = {}
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            value, path = line.split()[:2]
+            instrumentation.count_file(path)
+            ensemble_samples = load_samples(path)
+            # samples drawn from the same stream are correlated, and so would be their pairing below
+            seed = load_seed(path)
+            if seed is not None and seed in seeds:
+                raise ValueError(f"The samples in {path} and {seeds[seed]} were drawn with the same seed {seed}, "
+                                 f"please resample one of them with another --seed")
+            seeds[seed] = path
+            if ensemble_samples.ndim == 2:
+                ensemble_samples = ensemble_samples[:, column]
+            x.append(float(value))
+            samples.append(ensemble_samples)
+
+    # pair up the i-th sample of every ensemble
+    rows = min(len(s) for s in samples)
+
+    return np.array(x), np.column_stack([s[:rows] for s in samples])
+
+
+"""
+Levenberg-Marquardt fit of the same model to every row of a sample matrix at once
+"""
+def batched_fit(fitting_func, x, samples, yerr, guess, max_iterations=200, tolerance=1e-10):
+    """
+    fitting_func - fitting function from fits.py, which broadcasts over its parameters
+    x - values for the independent variate, shape (points,)
+    samples - one set of values for the dependent variate per row, shape (rows, points)
+    yerr - errors for the dependent variate, shape (points,)
+    guess - initial parameters, shared by all rows
+    max_iterations - maximum number of damped Gauss-Newton steps
+    tolerance - relative decrease in chi-squared below which a row counts as converged
+
+    return:
+    params - fitted parameters, shape (rows, parameters)
+    converged - whether the fit of each row converged
+    """
+    rows = samples.shape[0]
+    num_params = len(guess)
+    eps = np.sqrt(np.finfo(float).eps)
+
+    def residuals(p, y):
+        model = fitting_func(x, *(p[:, [k]] for k in range(num_params)))
+        instrumentation.count("model_evaluations", len(p))
+        return (y - model) / yerr
+
+    params = np.tile(np.asarray(guess, dtype=float), (rows, 1))
+    damping = np.full(rows, 1e-3)
+    converged = np.zeros(rows, dtype=bool)
+    res = residuals(params, samples)
+    chisq = np.sum(res ** 2, axis=1)
+
+    for _ in range(max_iterations):
+        active = np.flatnonzero(~converged)
+        if not active.size:
+            break
+        p, y, r = params[active], samples[active], res[active]
+
+        # forward-difference jacobian of the residuals, shape (rows, points, parameters)
+        jac = np.empty(r.shape + (num_params,))
+        for k in range(num_params):
+            h = eps * np.maximum(np.abs(p[:, k]), 1)
+            shifted = p.copy()
+            shifted[:, k] += h
+            jac[:, :, k] = (residuals(shifted, y) - r) / h[:, np.newaxis]
+
+        jtj = np.einsum("rpi,rpj->rij", jac, jac)
+        jtr = np.einsum("rpi,rp->ri", jac, r)
+        diagonal = np.einsum("rii->ri", jtj)
+        lhs = jtj + (damping[active, np.newaxis] * np.maximum(diagonal, eps))[:, :, np.newaxis] * np.eye(num_params)
+        step = -np.linalg.solve(lhs, jtr[:, :, np.newaxis])[:, :, 0]
+
+        trial = p + step
+        trial_res = residuals(trial, y)
+        trial_chisq = np.sum(trial_res ** 2, axis=1)
+
+        better = trial_chisq <= chisq[active]
+        improved = active[better]
+        small_step = np.all(np.abs(step) <= np.sqrt(tolerance) * (np.abs(p) + np.sqrt(tolerance)), axis=1)
+        done = better & small_step & (chisq[active] - trial_chisq <= tolerance * (1 + trial_chisq))
+        params[improved] = trial[better]
+        res[improved] = trial_res[better]
+        chisq[improved] = trial_chisq[better]
+        damping[active] = np.where(better, damping[active] / 10, damping[active] * 10)
+
+        # rows whose damping blew up cannot move any more: they sit at a minimum (or are stuck)
+        converged[active[done | (damping[active] > 1e12)]] = True
+
+    return params, converged
+
+
+"""
+Extrapolate every joint sample row and summarize the resulting parameter distribution
+"""
+def extrapolate(x, samples, filetype):
+    fitting_func = ALLOWED_FILETYPES[filetype]["fit"]
+
+    y = np.mean(samples, axis=0)
+    yerr = np.std(samples, axis=0)
+
+    # a model linear in all its parameters fits every row with one product with the pseudo-inverse
+    if is_linear(filetype):
+        with instrumentation.span("sample fits"):
+            pinv = np.linalg.pinv(ALLOWED_FILETYPES[filetype]["basis"](x) / yerr[:, np.newaxis])
+            params = (samples / yerr) @ pinv.T
+            instrumentation.count("fits_attempted", samples.shape[0])
+        return params, 0.0
+
+    with instrumentation.span("central fit"):
+        guess, _ = curve_fit(fitting_func, x, y, sigma=yerr, absolute_sigma=True, maxfev=10000)
+
+    with instrumentation.span("sample fits"):
+        instrumentation.count("fits_attempted", samples.shape[0])
+        params, converged = batched_fit(fitting_func, x, samples, yerr, guess)
+        instrumentation.count("fits_failed", np.count_nonzero(~converged))
+
+    return params[converged], np.mean(~converged)
+
+
+if __name__ == "__main__":
+
+    start_time = time.perf_counter()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--list", help="file with lines '<x value> <path to .npy samples>', one per ensemble")
+    parser.add_argument("--filetype", help=f"model to extrapolate with: {ALLOWED_FILETYPES.keys()}", default="sf_proj_time")
+    parser.add_argument("--column", type=int, help="column of the sample arrays to extrapolate", default=-1)
+    parser.add_argument("--samples_file", help="Save the extrapolated parameter samples to this .npy file", default="")
+    parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
+    parser.add_argument("--db", help="also add the extrapolated parameters to this results database (see results_db.py)")
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
+    args = parser.parse_args()
+
+    if args.filetype not in ALLOWED_FILETYPES:
+        raise ValueError(f"Please choose one of: {ALLOWED_FILETYPES.keys()}")
+
+    param_names = ALLOWED_FILETYPES[args.filetype]["param names"]
+
+    with instrumentation.span("load"):
+        x, samples = read_sample_list(args.list, args.column)
+
+    if len(x) < len(param_names):
+        raise ValueError(f"Need at least {len(param_names)} ensembles to fit {param_names}, found {len(x)}")
+
+    params, failure_rate = extrapolate(x, samples, args.filetype)
+
+    if args.samples_file:
+        np.save(args.samples_file, params)
+
+    if args.verbose:
+        print(f"Extrapolated {samples.shape[0]} joint samples of {len(x)} ensembles with: "
+              f"{ALLOWED_FILETYPES[args.filetype]['fit eqn']}")
+        print(f"Fraction of sample fits which did not converge: {failure_rate:.2e}")
+
+    # same layout as the output of bootstrap_fit.py: name, value, error
+    for i, name in enumerate(param_names):
+        print(f"{name} {np.mean(params[:, i])} {np.std(params[:, i])}")
+
+    if args.db:
+        with instrumentation.span("database"):
+            # the input is the list of ensembles, whose project is the directory holding the list
+            project = os.path.basename(os.path.dirname(os.path.abspath(args.list)))
+            records = make_records(args.list, f"{args.filetype} extrapolation", "propagated samples", param_names,
+                                   np.mean(params, axis=0), np.std(params, axis=0), time.perf_counter() - start_time,
+                                   options={"column": args.column, "failure_rate": failure_rate}, project=project)
+            write_records(args.db, records)
+
+    if args.verbose:
+        print(f"Elapsed time: {time.perf_counter() - start_time:.6f} seconds")
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
@@ -57,26 +57,80 @@ def superfluid_vs_proj_time_fitting_func(x, s, b, c):
     return b * np.exp(-c * x) + s
 
 
+"""
+Design matrices of the models which are linear in some of their parameters: the columns are the
+functions multiplying the linear parameters (in the order of the parameter names), for fixed values
+of the remaining, nonlinear parameters
+"""
+def energy_vs_time_step_basis(x):
+    """
+    x - array of values for independent variate
+
+    columns multiply: E_0, A
+    """
+    return np.column_stack([np.ones_like(x), x ** 4])
+
+
+def superfluid_vs_time_basis(x, g):
+    """
+    x - array of values for independent variate
+    g - fixed value of the nonlinear parameter G
+
+    columns multiply: A, C
+    """
+    return np.column_stack([(1 - np.exp(-g * x)) / x, np.ones_like(x)])
+
+
+def exponential_decay_basis(x, c):
+    """
+    x - array of values for independent variate
+    c - fixed value of the decay rate C
+
+    columns multiply: E_0 (or S), B
+    """
+    return np.column_stack([np.ones_like(x), np.exp(-c * x)])
+
+
+"""
+Whether a model is linear in all of its parameters, so it can be fitted in closed form
+"""
+def is_linear(filetype):
+    model = ALLOWED_FILETYPES[filetype]
+    return len(model["linear params"]) == len(model["param names"])
+
+
 """
 Variables
 """
 
 NO_BOUNDS = (-np.inf, np.inf)
 ALLOWED_METHODS = {"bootstrap", "covariance"}
+ALLOWED_REDUCTIONS = {"skip", "coarse"}
+# "linear params" are the indices of the parameters the model is linear in, "basis" gives their
+# design matrix as a function of x and the remaining (nonlinear) parameters. bootstrap_fit.py only
+# uses them for models linear in all of their parameters (closed-form fits), window_scan.py for
+# models with a single nonlinear parameter (variable projection over a grid); bootstrap fits of
+# the partially linear models still go through curve_fit
 ALLOWED_FILETYPES = {
                         "en_proj_time": {"fit": energy_vs_proj_time_fitting_func,
                                         "fit eqn": "E_0 + B * exp(-C * x)",
                                         "param names": ["E_0", "B", "C"],
                                         "x-label": r"Projection time ($K^{-1}$)",
                                         "y-label": r"Energy per particle ($K$)", 
-                                        "bounds": NO_BOUNDS},
+                                        "bounds": NO_BOUNDS,
+                                        "displacements": [1, 1, 1],
+                                        "linear params": [0, 1],
+                                        "basis": exponential_decay_basis},
 
                         "en_time_step": {"fit": energy_vs_time_step_fitting_func,
                                         "fit eqn": "E_0 + A * x ** 4",
                                         "param names": ["E_0", "A"],
                                         "x-label": r"Time step ($K^{-1}$)",
                                         "y-label": r"Energy per particle ($K$)",
-                                        "bounds": NO_BOUNDS},
+                                        "bounds": NO_BOUNDS,
+                                        "displacements": [1, 1],
+                                        "linear params": [0, 1],
+                                        "basis": energy_vs_time_step_basis},
 
                         "sf_time":      {"fit": superfluid_vs_time_fitting_func,
                                         "fit eqn": "(A / x) * (1 - exp(-G * x)) + C",
@@ -84,12 +138,17 @@ ALLOWED_FILETYPES = {
                                         "x-label": r"Imaginary time ($K^{-1}$)",
                                         "y-label": r"Superfluid fraction",
                                         "bounds": ([0,0,-0.1],[1000,1000,1]),
-                                        "displacements": [1, 1, 1]},
+                                        "displacements": [1, 1, 1],
+                                        "linear params": [0, 2],
+                                        "basis": superfluid_vs_time_basis},
 
                         "sf_proj_time": {"fit": superfluid_vs_proj_time_fitting_func,
                                         "fit eqn": "B * exp(-C * x) + S",
                                         "param names": ["S", "B", "C"],
                                         "x-label": r"Projection time ($K^{-1}$)",
                                         "y-label": r"Superfluid fraction",
-                                        "bounds": NO_BOUNDS}
+                                        "bounds": NO_BOUNDS,
+                                        "displacements": [1, 1, 1],
+                                        "linear params": [0, 1],
+                                        "basis": exponential_decay_basis}
                         }
@@ -0,0 +1,288 @@
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+import instrumentation
+from ensemble_index import load_index, run_numbers, QUARANTINE
+
+
+"""
+Quick health scan of the runs of an ensemble (dirname/run_N/...), to find crashed, truncated or
+half-written output files before the expensive combining and fitting stages. Only the header and
+the last few KB of every file are read: the rows there have to parse into finite numbers with a
+consistent number of columns, the last line has to be complete, the number of rows (counted, or
+estimated from the file size and the length of the last rows) has to match the SLICES and PASS
+directives of the run's .sy file, and the size of every file is compared against the median size
+of the same kind of file across the ensemble. Files written block by block (.en) are still growing
+while a run is in progress, or when it was stopped early once the ensemble converged: they may have
+fewer rows than PASS, as long as their blocks are numbered consecutively, and their size is not
+compared with the other runs. Runs with problems are written to a quarantine list, which the
+combiners take with --quarantine to leave those runs out
+"""
+
+
+# bytes read from the start and from the end of every file
+HEAD_BYTES = 4096
+TAIL_BYTES = 8192
+
+# relative tolerance of the number of rows when it is estimated from the file size
+ROW_TOLERANCE = 0.02
+
+# expected number of rows of a file, from the directives of the run's .sy file
+EXPECTED_ROWS = {
+    ".sd": lambda config: int(config["SLICES"][0]),   # one row per imaginary time slice
+    ".en": lambda config: int(config["PASS"][-1]),    # one row per block
+}
+
+# files whose first column numbers the rows (1, 2, ...), so that the last row gives the exact count
+NUMBERED_ROWS = {".en"}
+
+# files that grow by a row per block while the run goes on, so that fewer rows than expected, or no
+# file at all yet, is not a problem
+GROWING_FILES = {".en"}
+
+
+"""
+Read the start and the end of a file
+"""
+def read_ends(filename, head_bytes=HEAD_BYTES, tail_bytes=TAIL_BYTES):
+    """
+    filename - path to the output file
+    head_bytes, tail_bytes - number of bytes to read from the start and from the end
+
+    return:
+    size - size of the file in bytes
+    head - first bytes of the file (the whole file if it is small enough)
+    tail - last bytes of the file (the whole file if it is small enough)
+    """
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= head_bytes + tail_bytes:
+            head = tail = f.read()
+        else:
+            head = f.read(head_bytes)
+            f.seek(size - tail_bytes)
+            tail = f.read()
+    instrumentation.count("files_read")
+    instrumentation.count("bytes_parsed", len(head) + (len(tail) if tail is not head else 0))
+    return size, head, tail
+
+
+"""
+Parse whitespace separated rows of numbers, raising a ValueError for rows that are not numbers
+or that have different lengths
+"""
+def parse_rows(lines):
+    text = [line.decode(errors="replace").split() for line in lines]
+    return np.array(text, dtype=float).reshape(len(lines), -1)
+
+
+"""
+Check a single output file from its first and last few KB
+"""
+def inspect_file(filename, expected_rows=None, numbered=False, growing=False):
+    """
+    filename - path to the output file
+    expected_rows - number of rows the file should have (None: not checked)
+    numbered - whether the first column numbers the rows
+    growing - whether the file may still be written, so that it may have fewer rows than expected
+
+    return:
+    problems - descriptions of what is wrong with the file (empty for a healthy file)
+    """
+    size, head, tail = read_ends(filename)
+    if size == 0:
+        return [] if growing else ["empty file"]
+
+    problems = []
+    whole = len(tail) == size
+    if not tail.endswith(b"\n"):
+        problems.append("last line is incomplete")
+
+    # the header is made of the comment lines at the top of the file
+    head_lines = head.split(b"\n")
+    if not whole:
+        head_lines = head_lines[:-1]
+    header_bytes = 0
+    for line in head_lines:
+        if line.strip() and not line.lstrip().startswith(b"#"):
+            break
+        header_bytes += len(line) + 1
+    data_lines = [line for line in head_lines if line.strip() and not line.lstrip().startswith(b"#")]
+    if not data_lines:
+        return problems if growing else problems + ["no data rows"]
+
+    # complete lines at the end: the last piece is empty or incomplete, and the first one is
+    # partial unless the tail is the whole file
+    tail_lines = tail.split(b"\n")[:-1]
+    if not whole:
+        tail_lines = tail_lines[1:]
+    tail_lines = [line for line in tail_lines if line.strip() and not line.lstrip().startswith(b"#")]
+    if not tail_lines:
+        return problems + ["no complete rows at the end"]
+
+    try:
+        first = parse_rows(data_lines[:1])
+        last = parse_rows(tail_lines)
+    except ValueError:
+        return problems + ["unreadable rows"]
+
+    if first.shape[1] != last.shape[1]:
+        problems.append(f"rows of {first.shape[1]} and {last.shape[1]} columns")
+    if not np.all(np.isfinite(last)):
+        problems.append("non-finite values")
+    if not last[:, 1:].any():
+        # the first column is the coordinate (slice, block, wavevector, distance), the rest the measurements
+        problems.append("only zeros")
+
+    if numbered and (first[0, 0] != 1 or np.any(np.diff(last[:, 0]) != 1)):
+        problems.append("rows are not numbered consecutively")
+
+    if expected_rows is not None:
+        if numbered:
+            rows = int(last[-1, 0])
+            exact = True
+        elif whole:
+            rows = len(tail_lines)
+            exact = True
+        else:
+            line_length = sum(len(line) + 1 for line in tail_lines) / len(tail_lines)
+            rows = int(round((size - header_bytes) / line_length))
+            exact = False
+        tolerance = 0 if exact else ROW_TOLERANCE * expected_rows
+        too_few = rows < expected_rows - tolerance and not growing
+        if too_few or rows > expected_rows + tolerance:
+            problems.append(f"{'' if exact else 'about '}{rows} of {expected_rows} rows")
+
+    return problems
+
+
+"""
+Check the files of a single run
+"""
+def check_run(run_dir, files, config, medians, size_tolerance):
+    """
+    run_dir - run directory containing the output files
+    files - [(name, size)] of the files to check
+    config - directives of the run's .sy file
+    medians - {extension: median size of the files with that extension across the ensemble}
+    size_tolerance - largest relative deviation of a file size from the median
+
+    return:
+    problems - descriptions of what is wrong with the run (empty for a healthy run)
+    counters - instrumentation counters of this worker
+    """
+    instrumentation.reset()
+    problems = []
+    if not config:
+        problems.append("no .sy configuration file")
+
+    found = set()
+    for name, size in files:
+        extension = os.path.splitext(name)[1]
+        found.add(extension)
+
+        expected = None
+        if extension in EXPECTED_ROWS:
+            try:
+                expected = EXPECTED_ROWS[extension](config)
+            except (KeyError, IndexError, ValueError):
+                pass
+
+        with instrumentation.span("inspect"):
+            try:
+                file_problems = inspect_file(os.path.join(run_dir, name), expected, extension in NUMBERED_ROWS,
+                                             extension in GROWING_FILES)
+            except OSError as e:
+                file_problems = [f"could not be read ({e.strerror})"]
+
+        # a file that is still growing is only as large as the run is far along
+        median = medians[extension]
+        if median and extension not in GROWING_FILES and abs(size / median - 1) > size_tolerance:
+            file_problems.append(f"size is {100 * size / median:.0f}% of the ensemble median")
+        problems += [f"{name}: {problem}" for problem in file_problems]
+
+    problems += [f"no {extension} file" for extension in sorted(set(medians) - found - GROWING_FILES)]
+    return problems, instrumentation.snapshot()
+
+
+"""
+Check every run of an ensemble, in parallel over the runs
+"""
+def scan_ensemble(dirname, extensions, size_tolerance=0.25, cores=1):
+    """
+    dirname - ensemble directory containing the runs
+    extensions - extensions of the files to check, e.g. ['.sd', '.en']
+    size_tolerance - largest relative deviation of a file size from the ensemble median
+    cores - number of processes
+
+    return:
+    problems - {run number: descriptions of what is wrong}, for the runs with problems only
+    """
+    index = load_index(dirname, stat_files=True)
+    runs = run_numbers(index)
+
+    files = {}
+    sizes = {extension: [] for extension in extensions}
+    for run in runs:
+        entries = index["runs"][str(run)]["files"]
+        files[run] = [(name, entries[name][0]) for name in sorted(entries)
+                      if os.path.splitext(name)[1] in sizes]
+        for name, size in files[run]:
+            sizes[os.path.splitext(name)[1]].append(size)
+    # extensions no run has are not expected from any run
+    medians = {extension: float(np.median(found)) for extension, found in sizes.items() if found}
+
+    tasks = [(os.path.join(dirname, f"run_{run}"), files[run], index["runs"][str(run)]["config"], medians,
+              size_tolerance) for run in runs]
+    problems = {}
+    with instrumentation.span("scan"):
+        with mp.Pool(processes=max(1, min(cores, len(tasks)))) as pool:
+            for run, (run_problems, counters) in zip(runs, pool.starmap(check_run, tasks)):
+                instrumentation.merge(counters)
+                if run_problems:
+                    problems[run] = run_problems
+
+    return problems
+
+
+"""
+Write the quarantine list: one run directory per line, followed by its problems
+"""
+def write_quarantine(filename, problems):
+    with open(filename, "w") as f:
+        f.write("# run  problems\n")
+        for run in sorted(problems):
+            f.write(f"run_{run}\t{'; '.join(problems[run])}\n")
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirname", help="ensemble directory containing the runs")
+    parser.add_argument("--extensions", help="comma separated extensions of the files to check", default=".sd,.en,.sq,.gr")
+    parser.add_argument("--size_tolerance", type=float, help="largest relative deviation of a file size from the ensemble median", default=0.25)
+    parser.add_argument("--output", help=f"quarantine list to write (default: {QUARANTINE} inside the ensemble directory)")
+    parser.add_argument("--cores", type=int, help="Number of cores to use in multiprocessing",
+                        default=int(os.environ.get('SLURM_CPUS_PER_TASK', default=1)))
+    parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
+    args = parser.parse_args()
+
+    problems = scan_ensemble(args.dirname, args.extensions.split(","), args.size_tolerance, args.cores)
+
+    output = args.output or os.path.join(args.dirname, QUARANTINE)
+    write_quarantine(output, problems)
+
+    if args.verbose:
+        for run in sorted(problems):
+            print(f"run_{run}: {'; '.join(problems[run])}")
+    print(f"Quarantined {len(problems)} of {len(load_index(args.dirname)['runs'])} runs in {output}, "
+          f"in {time.perf_counter() - start_time:.2f} seconds")
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
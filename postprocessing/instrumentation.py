@@ -0,0 +1,108 @@
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+"""
+Lightweight instrumentation shared by the postprocessing scripts: named timing spans, counters
+(files read, bytes parsed, fits attempted/failed, model evaluations) and peak resident memory.
+State is kept per process, pool workers hand their counters back with `snapshot` and the
+parent folds them in with `merge`
+"""
+
+
+_spans = {}
+_counters = {}
+_start = time.perf_counter()
+
+
+"""
+Peak resident set size (in MB) of this process, and of its waited-for children (pool workers)
+"""
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes everywhere else
+    if sys.platform == "darwin":
+        return peak / 1024 ** 2
+    return peak / 1024
+
+
+"""
+Time a named section of code, recording the number of calls, total and maximum duration,
+and the peak memory at the time the section finished
+"""
+@contextmanager
+def span(name):
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - begin
+        stats = _spans.setdefault(name, {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+        stats["calls"] += 1
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+        stats["peak_rss_mb"] = peak_rss_mb()
+
+
+"""
+Increment a named counter
+"""
+def count(name, amount=1):
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+"""
+Count a file that is about to be parsed
+"""
+def count_file(filename):
+    count("files_read")
+    count("bytes_parsed", os.path.getsize(filename))
+
+
+"""
+Counters of this process, e.g. for returning them from a pool worker
+"""
+def snapshot():
+    return dict(_counters)
+
+
+"""
+Add counters collected in another process to the counters of this process
+"""
+def merge(counters):
+    for name, amount in counters.items():
+        count(name, amount)
+
+
+"""
+Clear the spans and counters, e.g. at the start of a batch executed by a pool worker
+"""
+def reset():
+    _spans.clear()
+    _counters.clear()
+
+
+"""
+Machine-readable summary of everything recorded so far
+"""
+def report():
+    return {
+        "script": os.path.basename(sys.argv[0]),
+        "wall_s": time.perf_counter() - _start,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "spans": {name: dict(stats) for name, stats in _spans.items()},
+        "counters": dict(_counters),
+    }
+
+
+"""
+Write the summary to a JSON file
+"""
+def write_report(path):
+    with open(path, "w") as f:
+        json.dump(report(), f, indent=2)
@@ -0,0 +1,71 @@
+import re
+
+import numpy as np
+
+import instrumentation
+
+
+"""
+Shared reader for the whitespace-delimited output files of the PIGS simulation
+(.sd, .en, .sq, .gr, .vis): comment lines starting with '#' are skipped and only the
+requested columns are returned, as contiguous float64 arrays
+"""
+
+
+# np.loadtxt is backed by a C tokenizer from numpy 1.23 onwards, which handles comments and
+# column selection without any per-line Python work; older versions are pure Python, so
+# there we parse the whole file with a single call to np.fromstring instead
+C_PARSER = tuple(int(v) for v in np.__version__.split(".")[:2]) >= (1, 23)
+
+COMMENT_LINES = re.compile(r"(?m)^[ \t]*#.*$")
+
+
+"""
+Parse a whole file with one call to np.fromstring: returns a 2d array (rows x columns)
+"""
+def bulk_parse(filename):
+    with open(filename) as f:
+        text = f.read()
+    if "#" in text:
+        text = COMMENT_LINES.sub("", text)
+
+    first_row = next((line for line in text.splitlines() if line.strip()), "")
+    num_columns = len(first_row.split())
+    if not num_columns:
+        return np.empty((0, 0))
+
+    values = np.fromstring(text, sep=" ")
+    if values.size % num_columns:
+        raise ValueError(f"{filename} does not have the same number of columns on every row")
+
+    return values.reshape(-1, num_columns)
+
+
+"""
+Read the requested columns of an output file
+"""
+def load_columns(filename, usecols=None):
+    """
+    filename - path to the output file
+    usecols - column index, or sequence of column indices, to read (default: all columns)
+
+    return:
+    data - contiguous float64 array: 1d if `usecols` is a single index, otherwise 2d (rows x columns);
+           a file without data gives no rows, with the requested number of columns
+    """
+    instrumentation.count_file(filename)
+    single = isinstance(usecols, (int, np.integer))
+
+    if C_PARSER:
+        data = np.loadtxt(filename, comments="#", usecols=usecols, ndmin=1 if single else 2)
+    else:
+        data = bulk_parse(filename)
+        if usecols is not None and len(data):
+            data = data[:, usecols]
+
+    # the same empty result from both parsers
+    if usecols is not None and not len(data):
+        data = np.empty(0 if single else (0, len(usecols)))
+
+    return np.ascontiguousarray(data, dtype=np.float64)
+
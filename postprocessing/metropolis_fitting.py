@@ -7,8 +7,18 @@ from scipy.optimize import curve_fit
 from math import ceil
 
 # custom imports
+import instrumentation
+from loaders import load_columns
 from fits import *
-from bootstrap_fit import select_interval
+from bootstrap_fit import select_interval, coarse_grain
+from metropolis_kernels import ALLOWED_BACKENDS, DEFAULT_BACKEND, get_block_runners
+from autocorrelation import integrated_time
+
+
+ALLOWED_PROPOSALS = {"single", "adaptive"}
+
+# at most this many post burn-in passes are kept for estimating the autocorrelation time
+MAX_TRACE_LENGTH = 1000000
 
 
 # check the quality of the final fit using a chi-squared test
@@ -25,6 +35,7 @@ def check_fit(x, y_obs, yerr, params):
     chisq - chi-squared measure of fit
     """
     y_fit = fitting_func(x, *params)
+    instrumentation.count("model_evaluations")
 
     return np.average((y_obs - y_fit) ** 2 / (yerr ** 2))
 
@@ -39,16 +50,17 @@ def plot_fit(x, y_obs, yerr, params, savename):
     yerr - error bars for dependent variate
     params - fitting parameters
     """
-    y_fit = fitting_func(x, *params)
+    with instrumentation.span("plot"):
+        y_fit = fitting_func(x, *params)
 
-    plt.plot(x, y_fit, zorder=2)
-    plt.errorbar(x, y_obs, yerr=yerr, fmt='o', markersize=3,
-                           capsize=2, label="data", zorder=1)
-    plt.title(f"Fit: {fit_eqn}")
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    plt.savefig(savename)
-    plt.clf()
+        plt.plot(x, y_fit, zorder=2)
+        plt.errorbar(x, y_obs, yerr=yerr, fmt='o', markersize=3,
+                               capsize=2, label="data", zorder=1)
+        plt.title(f"Fit: {fit_eqn}")
+        plt.xlabel(x_label)
+        plt.ylabel(y_label)
+        plt.savefig(savename)
+        plt.clf()
 
 
 def tune_acceptance(displ, acc_rate):
@@ -103,6 +115,7 @@ def accept(x, y_obs, yerr, prev, trial, fitting_func):
 
     y_fit_prev = fitting_func(x, *prev)
     y_fit_trial = fitting_func(x, *trial)
+    instrumentation.count("model_evaluations", 2)
 
     diff = (y_obs - y_fit_trial) ** 2 - (y_obs - y_fit_prev) ** 2
     exp_arg = np.sum(diff / (2 * yerr ** 2))
@@ -123,6 +136,30 @@ def accept(x, y_obs, yerr, prev, trial, fitting_func):
     return new, inc
 
 
+# covariance of the joint moves of the adaptive proposal
+def adaptive_proposal(sums, outer_sums, count):
+    """
+    Proposal covariance learnt from the burn-in passes (Haario, Saksman & Tamminen):
+    (2.38^2 / d) * Sigma + eps * I, with Sigma the sample covariance of the d parameters
+
+    sums - sum of the parameters over the burn-in passes
+    outer_sums - sum of the outer products of the parameters over the burn-in passes
+    count - number of burn-in passes
+
+    return:
+    cholesky factor of the proposal covariance, for drawing correlated steps
+    """
+    mean = sums / count
+    covariance = outer_sums / count - np.outer(mean, mean)
+    num_params = len(mean)
+
+    # the small diagonal term keeps the proposal non-degenerate if a parameter barely moved
+    eps = 1e-10 * np.maximum(np.abs(mean), 1) ** 2
+    proposal = (2.38 ** 2 / num_params) * covariance + np.diag(eps)
+
+    return np.linalg.cholesky(proposal)
+
+
 # main sampling engine for Monte Carlo simulation
 def engine(data, total_blocks, total_passes, filetype, savepath):
     """
@@ -156,9 +193,12 @@ def engine(data, total_blocks, total_passes, filetype, savepath):
         skip = args.skip
 
     # apply the modifications to data-points
-    x = x[start:end:skip]
-    y = y[start:end:skip]
-    yerr = yerr[start:end:skip]
+    if args.reduction == "coarse":
+        x, y, yerr = coarse_grain(x[start:end], y[start:end], yerr[start:end], args.max_points)
+    else:
+        x = x[start:end:skip]
+        y = y[start:end:skip]
+        yerr = yerr[start:end:skip]
 
     # load fitting parameters from checkpoint file if available
     if args.restart:
@@ -169,7 +209,9 @@ def engine(data, total_blocks, total_passes, filetype, savepath):
 
     # get fitting parameters using scipy.optimize.curve_fit (just to get started) 
     else:
-        params, _ = curve_fit(fitting_func, x, y, sigma=yerr, absolute_sigma=True, bounds=fitting_bounds)
+        with instrumentation.span("initial fit"):
+            instrumentation.count("fits_attempted")
+            params, _ = curve_fit(fitting_func, x, y, sigma=yerr, absolute_sigma=True, bounds=fitting_bounds)
 
     print(f"Initial parameters: {params} with goodness of fit: {check_fit(x, y, yerr, params)}")
 
@@ -197,27 +239,85 @@ def engine(data, total_blocks, total_passes, filetype, savepath):
     # write checkpoint file every 'x' number of blocks
     write_checkpoint = 50 # set x = 50
 
+    # blocks of passes are handed to a compiled (or NumPy) kernel unless the reference loop is
+    # requested; joint moves of the adaptive proposal always go through a kernel
+    backend = args.backend
+    if args.proposal == "adaptive" and backend == "python":
+        backend = "numpy"
+    if backend != "python":
+        run_block, run_block_joint, model = get_block_runners(backend, fitting_func)
+        inv_var = 1 / yerr ** 2
+
+    # the first blocks are burn-in: their passes feed the covariance of the adaptive proposal,
+    # and only the passes after them go into the autocorrelation time
+    burn_in = min(args.burn_in, total_blocks // 2)
+    if args.proposal == "adaptive" and burn_in < 1:
+        raise ValueError("The adaptive proposal needs at least one burn-in block to learn its covariance")
+    burn_in_sums = np.zeros(len(params))
+    burn_in_outer_sums = np.zeros((len(params), len(params)))
+    proposal_cholesky = None
+
+    stride = max(1, ceil((total_blocks - burn_in) * total_passes / MAX_TRACE_LENGTH))
+    post_burn_in_trace = []
+    trace = np.empty((total_passes, len(params)))
+    sampling_time = 0
+
     for _block_ in range(0, total_blocks): # results are recorded after each block
         
         # counting successful updates for calculating acceptance rates
         successes = {name:0 for name in param_names}
         attempts = {name:0 for name in param_names} 
 
-        for _pass_ in range(total_passes): # each pass corresponds to single Metropolis update
-
-            # randomly choose a particular parameter to update during a pass
-            i = rng.integers(0, 3)
-
-            # proposal step
-            proposed = params.copy()
-            proposed[i] = displace(params[i], deltas[i])
-
-            # acceptance step
-            params, inc = accept(x, y, yerr, params, proposed, fitting_func)
-
-            # increment based on success/failure of move
-            successes[param_names[i]] += inc
-            attempts[param_names[i]] += 1
+        block_start = time.perf_counter()
+        with instrumentation.span("sampling"):
+            if args.proposal == "adaptive" and _block_ >= burn_in:
+                if proposal_cholesky is None:
+                    proposal_cholesky = adaptive_proposal(burn_in_sums, burn_in_outer_sums, burn_in * total_passes)
+                # every pass moves all parameters along a correlated step drawn from the learnt covariance
+                steps = rng.standard_normal((total_passes, len(params))) @ proposal_cholesky.T
+                params, accepted = run_block_joint(model, x, y, inv_var, params, steps,
+                                                   rng.random(total_passes), trace)
+                instrumentation.count("model_evaluations", total_passes + 1)
+                for name in param_names:
+                    successes[name] = accepted
+                    attempts[name] = total_passes
+            elif backend != "python":
+                # the kernel consumes pre-drawn variates: parameter choices, displacements, acceptance tests
+                params, block_successes, block_attempts = run_block(model, x, y, inv_var, params,
+                                                                    np.asarray(deltas, dtype=float),
+                                                                    rng.integers(0, len(params), size=total_passes),
+                                                                    rng.random(total_passes),
+                                                                    rng.random(total_passes),
+                                                                    trace)
+                instrumentation.count("model_evaluations", total_passes + 1)
+                for i, name in enumerate(param_names):
+                    successes[name] = block_successes[i]
+                    attempts[name] = block_attempts[i]
+            else:
+                for _pass_ in range(total_passes): # each pass corresponds to single Metropolis update
+
+                    # randomly choose a particular parameter to update during a pass
+                    i = rng.integers(0, len(params))
+
+                    # proposal step
+                    proposed = params.copy()
+                    proposed[i] = displace(params[i], deltas[i])
+
+                    # acceptance step
+                    params, inc = accept(x, y, yerr, params, proposed, fitting_func)
+
+                    # increment based on success/failure of move
+                    successes[param_names[i]] += inc
+                    attempts[param_names[i]] += 1
+
+                    trace[_pass_] = params
+        sampling_time += time.perf_counter() - block_start
+
+        if _block_ < burn_in:
+            burn_in_sums += np.sum(trace, axis=0)
+            burn_in_outer_sums += trace.T @ trace
+        else:
+            post_burn_in_trace.append(trace[::stride].copy())
 
         # add the parameters to the master array (for histogramming later)
         master_array[_block_, :] = params
@@ -245,12 +345,21 @@ def engine(data, total_blocks, total_passes, filetype, savepath):
         if _block_ % write_checkpoint == 0:
             np.save(savepath + "/checkpoint.npy", params) 
 
+    # integrated autocorrelation time (in passes) and effective number of samples of each parameter
+    tau = integrated_time(np.concatenate(post_burn_in_trace)) * stride
+    effective_samples = (total_blocks - burn_in) * total_passes / tau
+    samples_per_second = np.min(effective_samples) / sampling_time
+
+    print("Integrated autocorrelation time (passes): " + ", ".join(f"{name}: {t:.2f}" for name, t in zip(param_names, tau)))
+    print(f"Effective samples per second ({args.proposal} proposals): {samples_per_second:.2f}")
+
     # write the final parameters
     with open(raw_file, "a") as rf:
         rf.write("-"*30)
         rf.write("Final parameter estimates: ")
         for i, name in enumerate(param_names):
-            rf.write(f"{name}:   mean: {np.mean(master_array[:, i])}    std: {np.std(master_array[:, i])}")
+            rf.write(f"{name}:   mean: {np.mean(master_array[:, i])}    std: {np.std(master_array[:, i])}"
+                     f"    tau: {tau[i]:.2f}    ess: {effective_samples[i]:.1f}")
 
     # plot the fit at the end of the simulation
     plot_fit(x, y, yerr, params, savepath + "/posterior_fit.png")
@@ -270,6 +379,12 @@ if __name__ == "__main__":
     parser.add_argument("--blocks", type=int, help="Number of blocks in Monte Carlo simulation", default=500)
     parser.add_argument("--passes", type=int, help="Number of passes per block", default=500)
     parser.add_argument("--restart", action="store_true", help="Restart simulation from a checkpoint", default=False)
+    parser.add_argument("--backend", help=f"Backend running the Metropolis passes: {ALLOWED_BACKENDS} \
+                                           (the kernels draw their random numbers in another order than the python loop)",
+                                      default=DEFAULT_BACKEND)
+    parser.add_argument("--proposal", help=f"Metropolis moves: one parameter at a time, or joint moves with a covariance \
+                                            learnt during burn-in: {ALLOWED_PROPOSALS}", default="single")
+    parser.add_argument("--burn_in", type=int, help="Number of burn-in blocks, excluded from the autocorrelation time", default=50)
     parser.add_argument("--checkpoint_every", type=int, help="Number of blocks in-between saving to checkpoint file", default=10)
     # post-processing options
     parser.add_argument("--filename", help="Name of data file")
@@ -278,12 +393,16 @@ if __name__ == "__main__":
                                         type=float, default=0)
     parser.add_argument("--domain", help="domain of fit", default="")
     parser.add_argument("--max_points", type=int, help="Maximum number of points to fit: will skip sufficiently many to ensure this", default=1000)
+    parser.add_argument("--skip", help="only fit every n points in dataset", default=1, type=int)
+    parser.add_argument("--reduction", help=f"how to reduce the number of points to max_points: {ALLOWED_REDUCTIONS}",
+                                       default="skip")
     parser.add_argument("--throwaway_first", action="store_true", help="Throw away entries up until the maximum of curve", default=False)
     parser.add_argument("--throwaway_last", action="store_true", help="Throw away entries beyond minimum of curve", default=False)
     parser.add_argument("--filetype", help=f"Type of file that is being fit to: {ALLOWED_FILETYPES.keys()}", default="sf_time")
     parser.add_argument("--cores", type=int, help="Number of cores to use in multiprocessing", default=4)
     parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
     parser.add_argument("--save", action="store_true", help="Whether or not the save plot/fit param. results to files", default=False)
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
     args = parser.parse_args()
 
     verbose = args.verbose
@@ -303,6 +422,15 @@ if __name__ == "__main__":
     if args.filetype not in ALLOWED_FILETYPES:
         raise ValueError(f"Please choose one of: {ALLOWED_FILETYPES.keys()}")
 
+    if args.reduction not in ALLOWED_REDUCTIONS:
+        raise ValueError(f"Please choose one of: {ALLOWED_REDUCTIONS}")
+
+    if args.backend not in ALLOWED_BACKENDS:
+        raise ValueError(f"Please choose one of: {ALLOWED_BACKENDS}")
+
+    if args.proposal not in ALLOWED_PROPOSALS:
+        raise ValueError(f"Please choose one of: {ALLOWED_PROPOSALS}")
+
     if args.domain:
         domain = [float(pt) for pt in args.domain.split(",")]
         args.domain = domain
@@ -312,9 +440,8 @@ if __name__ == "__main__":
         print(f"Analyzing file @ {args.filename}")
         print("-----------------------------------------------------------------------")
 
-    with open(args.filename) as f:
-        lines = (line for line in f if not line.startswith('#'))
-        data = np.loadtxt(lines)
+    with instrumentation.span("load"):
+        data = load_columns(args.filename, usecols=(0, 1, 2))
 
     if args.save:
         save = os.path.dirname(args.filename) + "/images/metropolis"
@@ -335,4 +462,7 @@ if __name__ == "__main__":
 
     if verbose:
         print(f"Elapsed simulation time: {elapsed_time:.6f} seconds")
-        print("-----------------------------------------------------------------------")
\ No newline at end of file
+        print("-----------------------------------------------------------------------")
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
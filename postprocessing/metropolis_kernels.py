@@ -0,0 +1,188 @@
+import numpy as np
+
+from fits import (energy_vs_proj_time_fitting_func, energy_vs_time_step_fitting_func,
+                  superfluid_vs_proj_time_fitting_func, superfluid_vs_time_fitting_func)
+
+try:
+    import numba
+    from numba.extending import register_jitable
+except ImportError:
+    numba = None
+
+
+"""
+Inner loop of the Metropolis engine: a whole block of passes is run in one call, which returns
+the block statistics (final parameters, accepted and attempted moves) to the Python driver in
+metropolis_fitting.py and records the parameters after every pass in a trace array. Passes
+either displace one parameter at a time or make a joint move of all parameters along pre-drawn
+(correlated) steps. The loops are compiled with Numba when it is installed, otherwise the same
+loops run in Python with NumPy evaluating the model. The model is passed to the kernels by its
+index in MODELS rather than as a function, so that the compiled kernels are cached on disk and
+only compiled once per machine instead of once per process
+"""
+
+
+ALLOWED_BACKENDS = {"auto", "python", "numpy", "numba"}
+
+# backend of metropolis_fitting.py --backend: the reference loop, whose random draws are those of
+# the original engine (the kernels draw their variates a block at a time, in another order)
+DEFAULT_BACKEND = "python"
+
+# fitting functions of fits.py the kernels can evaluate
+MODELS = (energy_vs_proj_time_fitting_func, energy_vs_time_step_fitting_func,
+          superfluid_vs_time_fitting_func, superfluid_vs_proj_time_fitting_func)
+
+
+"""
+Make a function callable from the compiled kernels, while plain calls still run it in Python
+"""
+def jitable(func):
+    if numba is not None:
+        register_jitable(func)
+    return func
+
+
+# the kernels cached on disk are only recompiled when this file changes, so touch it after
+# changing the fitting functions of MODELS
+for func in MODELS:
+    jitable(func)
+
+
+"""
+Evaluate the fitting function MODELS[model] for the parameter array p
+"""
+@jitable
+def evaluate(model, x, p):
+    if model == 0:
+        return energy_vs_proj_time_fitting_func(x, p[0], p[1], p[2])
+    elif model == 1:
+        return energy_vs_time_step_fitting_func(x, p[0], p[1])
+    elif model == 2:
+        return superfluid_vs_time_fitting_func(x, p[0], p[1], p[2])
+    return superfluid_vs_proj_time_fitting_func(x, p[0], p[1], p[2])
+
+
+"""
+Run a block of Metropolis passes, each pass displacing one randomly chosen parameter
+"""
+def run_block(model, x, y, inv_var, params, deltas, choices, u_displace, u_accept, trace):
+    """
+    model - index of the fitting function in MODELS
+    x - array of values for independent variate
+    y - array of values for dependent variate
+    inv_var - inverse variances of the dependent variate, 1 / yerr ** 2
+    params - parameters at the start of the block
+    deltas - maximum displacement of each parameter
+    choices - index of the parameter displaced during each pass
+    u_displace - uniform variates in [0, 1) for the proposals
+    u_accept - uniform variates in [0, 1) for the acceptance tests
+    trace - output array, filled with the parameters after every pass (passes x parameters)
+
+    return:
+    params - parameters at the end of the block
+    successes - number of accepted moves of each parameter
+    attempts - number of attempted moves of each parameter
+    """
+    params = params.copy()
+    successes = np.zeros(params.shape[0], dtype=np.int64)
+    attempts = np.zeros(params.shape[0], dtype=np.int64)
+
+    # half of chi-squared (the exponent of the likelihood) of the current parameters is kept,
+    # so every pass evaluates the model only once
+    residual = y - evaluate(model, x, params)
+    current = 0.5 * np.sum(residual * residual * inv_var)
+
+    for n in range(choices.shape[0]):
+        # displace the chosen parameter in place, and put it back if the move is rejected
+        i = choices[n]
+        previous = params[i]
+        params[i] = previous + (u_displace[n] - 0.5) * deltas[i]
+
+        residual = y - evaluate(model, x, params)
+        proposed = 0.5 * np.sum(residual * residual * inv_var)
+        exp_arg = proposed - current
+        attempts[i] += 1
+
+        if exp_arg < 0 or u_accept[n] < np.exp(-exp_arg):
+            current = proposed
+            successes[i] += 1
+        else:
+            params[i] = previous
+
+        trace[n, :] = params
+
+    return params, successes, attempts
+
+
+"""
+Run a block of Metropolis passes, each pass moving all parameters at once by a pre-drawn step
+"""
+def run_block_joint(model, x, y, inv_var, params, steps, u_accept, trace):
+    """
+    model - index of the fitting function in MODELS
+    x - array of values for independent variate
+    y - array of values for dependent variate
+    inv_var - inverse variances of the dependent variate, 1 / yerr ** 2
+    params - parameters at the start of the block
+    steps - proposed displacement of the parameters during each pass (passes x parameters)
+    u_accept - uniform variates in [0, 1) for the acceptance tests
+    trace - output array, filled with the parameters after every pass (passes x parameters)
+
+    return:
+    params - parameters at the end of the block
+    accepted - number of accepted moves
+    """
+    params = params.copy()
+    accepted = 0
+
+    residual = y - evaluate(model, x, params)
+    current = 0.5 * np.sum(residual * residual * inv_var)
+
+    for n in range(steps.shape[0]):
+        trial = params + steps[n]
+
+        residual = y - evaluate(model, x, trial)
+        proposed = 0.5 * np.sum(residual * residual * inv_var)
+        exp_arg = proposed - current
+
+        if exp_arg < 0 or u_accept[n] < np.exp(-exp_arg):
+            params = trial
+            current = proposed
+            accepted += 1
+
+        trace[n, :] = params
+
+    return params, accepted
+
+
+if numba is not None:
+    compiled_run_block = numba.njit(cache=True)(run_block)
+    compiled_run_block_joint = numba.njit(cache=True)(run_block_joint)
+
+
+"""
+Return the block runners and model for the requested backend
+"""
+def get_block_runners(backend, fitting_func):
+    """
+    backend - one of ALLOWED_BACKENDS: 'auto' picks numba when it is installed, numpy otherwise
+    fitting_func - fitting function from fits.py
+
+    return:
+    runner - function with the signature of run_block
+    joint_runner - function with the signature of run_block_joint
+    model - index of the fitting function in MODELS, to pass to the runners
+    """
+    if fitting_func not in MODELS:
+        raise ValueError(f"Please choose one of: {[func.__name__ for func in MODELS]}")
+    model = MODELS.index(fitting_func)
+
+    if backend == "auto":
+        backend = "numba" if numba is not None else "numpy"
+
+    if backend == "numba":
+        if numba is None:
+            raise ValueError("The numba backend was requested but numba is not installed")
+        return compiled_run_block, compiled_run_block_joint, model
+
+    return run_block, run_block_joint, model
@@ -0,0 +1,261 @@
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+import instrumentation
+from ensemble_index import load_index, run_numbers
+from loaders import load_columns
+
+
+"""
+Live convergence monitor of an ensemble (dirname/run_N/...) whose simulations are still running.
+The .en files are only ever appended to, so every pass reads just the bytes written since the
+previous one (the byte offsets are kept in a small JSON state file); the .sd files are re-read
+only when their size or mtime changed. After dropping the equilibration blocks, every run is
+reduced to a mean total energy and a mean superfluid fraction on the plateau of S(t), and the
+ensemble errors are estimated from the scatter between the (independent) runs. Once the errors
+reach the targets, a stop marker is written along with the Slurm job IDs of the runs
+"""
+
+
+STATE = ".convergence_state.json"
+
+# marker written once the targets are met: run_ensemble.sh does not start (or restart) runs
+STOP_MARKER = "STOP"
+
+# Slurm job IDs of the runs of a converged ensemble, one per line, e.g. for `scancel $(cat ...)`
+JOB_LIST = "converged_jobs"
+
+# file run_ensemble.sh writes the Slurm job ID of a run into
+JOB_ID_FILE = "job_id"
+
+
+"""
+Read the complete rows appended to a growing file since byte `offset`
+"""
+def read_appended(filename, offset, usecols):
+    """
+    filename - path to the output file
+    offset - number of bytes already read
+    usecols - columns to read
+
+    return:
+    rows - the new complete rows (a partially written last line is left for the next pass)
+    offset - number of bytes read up to the end of the last complete row
+    """
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b"\n") + 1
+    instrumentation.count("files_read")
+    instrumentation.count("bytes_parsed", end)
+    if not chunk[:end].strip():
+        return np.empty((0, len(usecols))), offset + end
+
+    rows = np.loadtxt(io.StringIO(chunk[:end].decode()), comments="#", usecols=usecols, ndmin=2)
+    return rows.reshape(-1, len(usecols)), offset + end
+
+
+"""
+Error-weighted mean superfluid fraction of a run on the plateau of S(t)
+"""
+def plateau_fraction(data, plateau):
+    """
+    data - columns t, sf_fraction, error of a .sd file
+    plateau - (a, b): the plateau is a * t_max <= t <= b * t_max
+
+    return:
+    fraction - mean superfluid fraction on the plateau (NaN for an empty file)
+    """
+    if not len(data):
+        return np.nan
+    t, fraction, error = data.T
+    on_plateau = (t >= plateau[0] * t[-1]) & (t <= plateau[1] * t[-1])
+    weights = 1 / np.maximum(error[on_plateau], 1e-12) ** 2
+    return np.sum(weights * fraction[on_plateau]) / np.sum(weights)
+
+
+"""
+Ensemble mean and error from the means of independent runs, weighted by their number of samples
+"""
+def ensemble_error(means, weights):
+    """
+    means - mean of every run
+    weights - number of samples behind every mean (runs without samples are left out)
+
+    return:
+    mean, error - weighted mean of the runs, and its error from the scatter between the runs
+                  (NaN with fewer than two runs)
+    """
+    means, weights = np.asarray(means, dtype=float), np.asarray(weights, dtype=float)
+    used = (weights > 0) & np.isfinite(means)
+    means, weights = means[used], weights[used]
+    if len(means) < 2:
+        return (means[0] if len(means) else np.nan), np.nan
+
+    mean = np.sum(weights * means) / np.sum(weights)
+    scatter = np.sum(weights * (means - mean) ** 2)
+    return mean, np.sqrt(scatter / ((len(means) - 1) * np.sum(weights)))
+
+
+"""
+Bring the state of the ensemble up to date with the files on disk
+"""
+def update(dirname, state, throwaway, plateau):
+    """
+    dirname - ensemble directory containing the runs
+    state - {'runs': {run number: per-run state}}, as returned by a previous call (or empty)
+    throwaway - number of equilibration blocks dropped from the start of every .en file
+    plateau - (a, b) range of the S(t) plateau, as fractions of the total projection time
+
+    return:
+    state - the updated state, which is also what gets persisted between passes
+    """
+    index = load_index(dirname, stat_files=True)
+    runs = state.setdefault("runs", {})
+
+    for run in run_numbers(index):
+        files = index["runs"][str(run)]["files"]
+        entry = runs.setdefault(str(run), {"en": None, "offset": 0, "blocks": 0, "count": 0, "sum": 0.0,
+                                           "sd_stat": None, "fraction": None})
+        run_dir = os.path.join(dirname, f"run_{run}")
+
+        en_files = sorted(name for name in files if name.endswith(".en"))
+        if en_files:
+            name = en_files[0]
+            size = files[name][0]
+            # a different or truncated file (e.g. a run started over) is read from the start
+            if name != entry["en"] or size < entry["offset"]:
+                entry.update(en=name, offset=0, blocks=0, count=0, sum=0.0)
+            if size > entry["offset"]:
+                with instrumentation.span("read en"):
+                    rows, entry["offset"] = read_appended(os.path.join(run_dir, name), entry["offset"], (3,))
+                kept = rows[max(0, throwaway - entry["blocks"]):, 0]
+                entry["blocks"] += len(rows)
+                entry["count"] += len(kept)
+                entry["sum"] += float(np.sum(kept))
+
+        sd_files = sorted(name for name in files if name.endswith(".sd"))
+        if sd_files and [sd_files[0]] + files[sd_files[0]] != entry["sd_stat"]:
+            # the simulation rewrites its .sd file, so it is read whole, but only when it changed
+            with instrumentation.span("read sd"):
+                data = load_columns(os.path.join(run_dir, sd_files[0]), usecols=(0, 1, 2))
+            entry["sd_stat"] = [sd_files[0]] + files[sd_files[0]]
+            fraction = plateau_fraction(data, plateau)
+            entry["fraction"] = None if np.isnan(fraction) else float(fraction)
+
+    return state
+
+
+"""
+Ensemble estimates of the total energy and of the superfluid fraction plateau
+"""
+def summarize(state):
+    runs = state["runs"].values()
+    counts = [entry["count"] for entry in runs]
+    energies = [entry["sum"] / entry["count"] if entry["count"] else np.nan for entry in runs]
+    fractions = [np.nan if entry["fraction"] is None else entry["fraction"] for entry in runs]
+
+    energy, energy_err = ensemble_error(energies, counts)
+    # every run contributes its S(t) with the weight of its post-equilibration blocks
+    fraction, fraction_err = ensemble_error(fractions, counts if sum(counts) else np.ones(len(counts)))
+
+    return {"runs": len(counts), "blocks": int(sum(counts)),
+            "energy": energy, "energy_err": energy_err, "fraction": fraction, "fraction_err": fraction_err}
+
+
+"""
+Whether the errors of the ensemble reached the targets (targets of 0 are not checked)
+"""
+def converged(summary, energy_target, fraction_target):
+    checks = []
+    if energy_target:
+        checks.append(summary["energy_err"] <= energy_target)
+    if fraction_target:
+        checks.append(summary["fraction_err"] <= fraction_target)
+    return bool(checks) and all(checks)
+
+
+"""
+Write the stop marker and the list of Slurm job IDs of the runs
+"""
+def signal_stop(dirname, summary):
+    job_ids = []
+    for entry in sorted(os.scandir(dirname), key=lambda entry: entry.name):
+        job_file = os.path.join(entry.path, JOB_ID_FILE)
+        if entry.is_dir() and os.path.exists(job_file):
+            with open(job_file) as f:
+                job_ids += f.read().split()
+
+    with open(os.path.join(dirname, JOB_LIST), "w") as f:
+        f.write("".join(f"{job_id}\n" for job_id in job_ids))
+    with open(os.path.join(dirname, STOP_MARKER), "w") as f:
+        json.dump({key: float(value) for key, value in summary.items()}, f)
+
+    return job_ids
+
+
+def load_state(dirname):
+    try:
+        with open(os.path.join(dirname, STATE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(dirname, state):
+    path = os.path.join(dirname, STATE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirname", help="ensemble directory containing the runs")
+    parser.add_argument("--throwaway", type=int, help="number of equilibration blocks to drop from every run", default=0)
+    parser.add_argument("--plateau", help="range of the S(t) plateau, as fractions of the projection time: 'a,b'", default="0.25,0.75")
+    parser.add_argument("--energy_error", type=float, help="target error of the ensemble total energy (0: not checked)", default=0)
+    parser.add_argument("--sf_error", type=float, help="target error of the ensemble superfluid fraction (0: not checked)", default=0)
+    parser.add_argument("--interval", type=float, help="keep monitoring, with this many seconds between passes (0: a single pass)", default=0)
+    parser.add_argument("--reset", action="store_true", help="forget the saved state and read every file from the start", default=False)
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
+    args = parser.parse_args()
+
+    if not args.energy_error and not args.sf_error:
+        raise ValueError("Please give at least one of --energy_error and --sf_error")
+
+    plateau = [float(pt) for pt in args.plateau.split(",")]
+    if len(plateau) != 2 or not 0 <= plateau[0] < plateau[1] <= 1:
+        raise ValueError("Please give the plateau as 'a,b' with 0 <= a < b <= 1")
+
+    state = {} if args.reset else load_state(args.dirname)
+    # the state is only valid for the options it was accumulated with
+    if state.get("options") != [args.throwaway, plateau]:
+        state = {"options": [args.throwaway, plateau]}
+
+    while True:
+        state = update(args.dirname, state, args.throwaway, plateau)
+        save_state(args.dirname, state)
+        summary = summarize(state)
+
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {summary['runs']} runs, {summary['blocks']} blocks: "
+              f"E = {summary['energy']:.6f} +- {summary['energy_err']:.6f}, "
+              f"sf = {summary['fraction']:.6f} +- {summary['fraction_err']:.6f}", flush=True)
+
+        if converged(summary, args.energy_error, args.sf_error):
+            job_ids = signal_stop(args.dirname, summary)
+            print(f"Targets reached: wrote {os.path.join(args.dirname, STOP_MARKER)} and "
+                  f"{len(job_ids)} job IDs to {os.path.join(args.dirname, JOB_LIST)}")
+            break
+
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
@@ -0,0 +1,232 @@
+import argparse
+import multiprocessing as mp
+import os
+import re
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+import instrumentation
+from loaders import load_columns
+from vis_density import read_chunks, Decimator
+
+
+"""
+Per-run plots of the simulation output files, reproducing the images of plot_files.p
+(<run>/images/<name>_<plot>.png). Runs are rendered in parallel over a process pool, and an image
+is only redrawn if it is missing or older than the file it is drawn from
+"""
+
+
+RUN_DIRECTORY = re.compile(r"^run_\d+$")
+
+# bin width of the histograms of z positions and random variates, as in plot_files.p
+BINWIDTH = 0.1
+
+# maximum number of beads drawn in the world-line projections of a .vis file
+MAX_BEADS = 50000
+
+
+"""
+Draw a single image
+"""
+def save_plot(filename, xlabel, ylabel, title, draw):
+    plt.figure()
+    draw()
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    plt.legend(loc="upper right")
+    plt.savefig(filename)
+    plt.close()
+
+
+"""
+Histogram with boxes centred on multiples of BINWIDTH, normalized by the number of records
+"""
+def draw_histogram(values, num_records, **kwargs):
+    centres, counts = np.unique(BINWIDTH * np.floor(values / BINWIDTH) + BINWIDTH / 2, return_counts=True)
+    plt.bar(centres, counts / num_records, width=BINWIDTH, alpha=0.5, **kwargs)
+
+
+def plot_gr(data_file, stem):
+    data = load_columns(data_file, usecols=(0, 1))
+    save_plot(f"{stem}_g(r).png", "Distance, r", "Pair distribution function, g(r)", "Pair distribution function",
+              lambda: plt.scatter(data[:, 0], data[:, 1], s=4, label="Data"))
+
+
+def plot_en(data_file, stem):
+    data = load_columns(data_file, usecols=(0, 1, 2, 3))
+    for column, energy in [(1, "kinetic"), (2, "potential"), (3, "total")]:
+        save_plot(f"{stem}_{energy}.png", "Block", f"{energy.capitalize()} energy per particle",
+                  f"{energy.capitalize()} energy per particle versus block",
+                  lambda: plt.plot(data[:, 0], data[:, column], label="data"))
+
+
+def plot_sd(data_file, stem):
+    data = load_columns(data_file, usecols=(0, 1, 2))
+    save_plot(f"{stem}_sd.png", "Projection time", "Superfluid density",
+              "Superfluid density as function of projection time",
+              lambda: plt.errorbar(data[:, 0], data[:, 1], yerr=data[:, 2], fmt='o', markersize=2, capsize=2, label="data"))
+
+
+def plot_sq(data_file, stem):
+    data = load_columns(data_file, usecols=(0, 1))
+    save_plot(f"{stem}_sq.png", "Wavevector q", "S(q)", "Structure factor S(q)",
+              lambda: plt.scatter(data[:, 0], data[:, 1], marker='d', s=6, label="data"))
+
+
+def plot_vis(data_file, stem):
+    # the file is streamed: the z histogram sees every bead, the projections a bounded subset
+    decimator = Decimator(MAX_BEADS)
+    bins = {}
+    num_records = 0
+    for chunk in read_chunks(data_file):
+        centres, counts = np.unique(BINWIDTH * np.floor(chunk[:, 2] / BINWIDTH) + BINWIDTH / 2, return_counts=True)
+        for centre, count in zip(centres, counts):
+            bins[centre] = bins.get(centre, 0) + count
+        num_records += len(chunk)
+        decimator.add(chunk)
+    beads = decimator.result()
+
+    carbon_file = os.path.join(os.path.dirname(data_file), "initial.c.ic")
+    carbon = load_columns(carbon_file, usecols=(0, 1, 2)) if os.path.exists(carbon_file) else np.empty((0, 3))
+
+    for (i, j), plane in [((0, 1), "xy"), ((0, 2), "xz"), ((1, 2), "yz")]:
+        def draw():
+            plt.scatter(beads[:, i], beads[:, j], s=1, label="helium")
+            plt.scatter(carbon[:, i], carbon[:, j], s=6, c="black", label="carbon")
+        save_plot(f"{stem}_vis_{plane}.png", "XYZ"[i], "XYZ"[j],
+                  f"Imaginary time world-lines in {plane.upper()}-plane", draw)
+
+    centres = np.array(sorted(bins))
+    save_plot(f"{stem}_zhist.png", "Z", "Frequency", "Histogram of z positions of particles",
+              lambda: plt.bar(centres, [bins[c] / num_records for c in centres], width=BINWIDTH,
+                              alpha=0.5, color="green", label="z positions"))
+
+
+def plot_mass(data_file, stem):
+    data = load_columns(data_file, usecols=(0, 1, 2))
+    save_plot(f"{stem}_pseudocurrent.png", "Projection time", "Center-of-mass Pseudocurrent",
+              "Center-of-mass Pseudocurrent as function of projection time",
+              lambda: plt.errorbar(data[:, 0], data[:, 1], yerr=data[:, 2], fmt='o', markersize=2, capsize=2, label="Data"))
+
+
+def plot_iseed(data_file, stem):
+    values = load_columns(data_file, usecols=0)
+    # as in plot_files.p (`every ::1::records-5`, inclusive): the first record and the last four are left out
+    values = values[1:len(values) - 4]
+
+    def draw():
+        draw_histogram(values, len(values), label="variates")
+        plt.ylim(0, 1)
+    save_plot(f"{stem}_variates.png", "Value", "Frequency", "Histogram of generated random variates", draw)
+
+
+# extension: (plotting function, suffixes of the images it draws)
+PLOTS = {
+    ".gr": (plot_gr, ["_g(r)"]),
+    ".en": (plot_en, ["_kinetic", "_potential", "_total"]),
+    ".sd": (plot_sd, ["_sd"]),
+    ".sq": (plot_sq, ["_sq"]),
+    ".vis": (plot_vis, ["_vis_xy", "_vis_xz", "_vis_yz", "_zhist"]),
+    ".mass": (plot_mass, ["_pseudocurrent"]),
+    ".iseed": (plot_iseed, ["_variates"]),
+}
+
+
+"""
+Render the images of a single run directory which are missing or out of date
+"""
+def render_run(run_dir, force=False):
+    """
+    run_dir - run directory containing the output files
+    force - redraw every image, even if it is up to date
+
+    return:
+    rendered - number of source files plotted
+    skipped - number of source files whose images were all up to date
+    counters - instrumentation counters of this worker
+    """
+    instrumentation.reset()
+    output_folder = os.path.join(run_dir, "images")
+    os.makedirs(output_folder, exist_ok=True)
+
+    with os.scandir(output_folder) as entries:
+        images = {entry.name: entry.stat().st_mtime_ns for entry in entries if entry.name.endswith(".png")}
+
+    rendered = 0
+    skipped = 0
+    with os.scandir(run_dir) as entries:
+        sources = [(entry.name, entry.path, entry.stat().st_mtime_ns) for entry in entries if entry.is_file()]
+
+    for name, path, mtime in sorted(sources):
+        extension = os.path.splitext(name)[1]
+        if extension not in PLOTS:
+            continue
+        plot, suffixes = PLOTS[extension]
+        stem = name[:-len(extension)]
+        outputs = [images.get(f"{stem}{suffix}.png", -1) for suffix in suffixes]
+
+        if not force and min(outputs) >= mtime:
+            skipped += 1
+            continue
+
+        try:
+            plot(path, os.path.join(output_folder, stem))
+            rendered += 1
+        except (ValueError, OSError) as e:
+            # empty, partially written or vanished files (e.g. runs that just started) are left for the next pass
+            print(f"Could not plot {path}: {e}")
+
+    return rendered, skipped, instrumentation.snapshot()
+
+
+"""
+Find the run directories below a directory, without descending into them
+"""
+def find_run_directories(root):
+    run_dirs = []
+    for dirpath, dirnames, _ in os.walk(root):
+        runs = [d for d in dirnames if RUN_DIRECTORY.match(d)]
+        run_dirs += [os.path.join(dirpath, d) for d in runs]
+        dirnames[:] = [d for d in dirnames if not RUN_DIRECTORY.match(d) and d != "images"]
+    if RUN_DIRECTORY.match(os.path.basename(os.path.normpath(root))):
+        run_dirs.append(root)
+    return sorted(run_dirs)
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirname", help="run directory, or directory containing run directories at any depth")
+    parser.add_argument("--force", action="store_true", help="redraw all images, even those newer than their source", default=False)
+    parser.add_argument("--cores", type=int, help="Number of cores to use in multiprocessing",
+                        default=int(os.environ.get('SLURM_CPUS_PER_TASK', default=1)))
+    parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
+    args = parser.parse_args()
+
+    with instrumentation.span("glob"):
+        run_dirs = find_run_directories(args.dirname)
+
+    total_rendered = 0
+    total_skipped = 0
+    with instrumentation.span("plot"):
+        with mp.Pool(processes=max(1, min(args.cores, len(run_dirs)))) as pool:
+            for run_dir, (rendered, skipped, counters) in zip(run_dirs, pool.starmap(render_run, [(d, args.force) for d in run_dirs])):
+                instrumentation.merge(counters)
+                total_rendered += rendered
+                total_skipped += skipped
+                if args.verbose:
+                    print(f"{run_dir}: {rendered} files plotted, {skipped} up to date")
+
+    print(f"Plotted {total_rendered} files in {len(run_dirs)} runs, {total_skipped} up to date, "
+          f"in {time.perf_counter() - start_time:.2f} seconds")
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
@@ -0,0 +1,245 @@
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from ensemble_index import parse_config, load_index, run_config, RUN_DIRECTORY
+
+
+"""
+Local SQLite store of the results of the postprocessing scripts (fitted parameters, block
+averages, extrapolations), one row per parameter with its error, the timing of the run and where
+it came from: project, beta, time step / slices, observable, method and a hash of the input file.
+The scripts pass --db to add their results, in one batched transaction. The store usually sits on
+the cluster filesystem, where jobs on different nodes write to it, so it keeps SQLite's rollback
+journal (WAL needs memory shared on one host): every batch takes the write lock up front with
+BEGIN IMMEDIATE and is retried while another job holds it. The CLI queries the store and exports
+tables as TSV, e.g. for the tables of a paper
+"""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    created TEXT NOT NULL,
+    project TEXT,
+    beta REAL,
+    tau REAL,
+    slices INTEGER,
+    observable TEXT NOT NULL,
+    method TEXT NOT NULL,
+    parameter TEXT NOT NULL,
+    value REAL,
+    error REAL,
+    input_path TEXT,
+    input_hash TEXT,
+    script TEXT,
+    elapsed_s REAL,
+    options TEXT
+);
+CREATE INDEX IF NOT EXISTS results_lookup ON results (project, observable, method, beta, tau, slices);
+CREATE INDEX IF NOT EXISTS results_input ON results (input_hash);
+"""
+
+COLUMNS = ["created", "project", "beta", "tau", "slices", "observable", "method", "parameter",
+           "value", "error", "input_path", "input_hash", "script", "elapsed_s", "options"]
+
+# seconds a writer waits for the lock held by another job before an attempt fails
+TIMEOUT = 60
+
+# attempts of an operation on a locked database, and the wait before the first retry in seconds
+# (doubled on every retry, with jitter so that the waiting jobs do not retry in step)
+RETRIES = 5
+RETRY_WAIT = 1.0
+
+
+def connect(path):
+    # transactions are begun explicitly
+    conn = sqlite3.connect(path, timeout=TIMEOUT, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+"""
+Run an operation on the store, retrying it while the database is locked by another job
+"""
+def with_retries(operation):
+    for attempt in range(RETRIES):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if ("locked" not in str(e) and "busy" not in str(e)) or attempt == RETRIES - 1:
+                raise
+            time.sleep(RETRY_WAIT * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+"""
+SHA-256 of a file's contents, read in chunks
+"""
+def file_hash(filename, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+"""
+Project, beta, time step and slices of an output file: from the .sy file next to it, or from the
+.sy file of the first run of the ensemble directory it sits in (e.g. for sf_fractions_combined)
+"""
+def describe_input(filename, project=None):
+    """
+    filename - input file of the result
+    project - name of the project (default: the directory holding the parameter directories,
+              e.g. 'study' for study/slices_80/ensemble/sf_fractions_combined)
+
+    return:
+    description - {'project', 'beta', 'tau', 'slices'}, None where unknown
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    config = {}
+    configs = sorted(glob.glob(os.path.join(directory, "*.sy")))
+    if configs:
+        config = parse_config(configs[0])
+    elif any(RUN_DIRECTORY.match(name) for name in os.listdir(directory)):
+        config = run_config(load_index(directory))
+
+    if project is None:
+        parts = directory.split(os.sep)
+        # the ensemble (or run) directory sits inside a parameter directory inside the project
+        while parts and (parts[-1] == "ensemble" or RUN_DIRECTORY.match(parts[-1])):
+            parts.pop()
+        project = parts[-2] if len(parts) >= 2 else None
+
+    beta = float(config["BETA"][0]) if "BETA" in config else None
+    slices = int(config["SLICES"][0]) if "SLICES" in config else None
+    tau = beta / slices if beta is not None and slices else None
+
+    return {"project": project, "beta": beta, "tau": tau, "slices": slices}
+
+
+"""
+Rows of the results of one run of a script, one per parameter
+"""
+def make_records(filename, observable, method, names, values, errors, elapsed, options=None, project=None):
+    """
+    filename - input file of the result (None if there is no single input file)
+    observable - what was fitted or averaged, e.g. the filetype of the fit
+    method - how, e.g. 'bootstrap' or 'covariance'
+    names, values, errors - parameters with their values and errors
+    elapsed - wall time of the run in seconds
+    options - options of the run worth recording, stored as JSON
+    project - name of the project (default: inferred from the path of `filename`)
+
+    return:
+    records - rows for write_records
+    """
+    if filename:
+        description = describe_input(filename, project)
+        path, digest = os.path.abspath(filename), file_hash(filename)
+    else:
+        description = {"project": project, "beta": None, "tau": None, "slices": None}
+        path, digest = None, None
+
+    created = datetime.datetime.now().isoformat(timespec="seconds")
+    script = os.path.basename(sys.argv[0])
+    options = json.dumps(options or {}, sort_keys=True, default=str)
+    return [(created, description["project"], description["beta"], description["tau"], description["slices"],
+             observable, method, name, float(value), float(error), path, digest, script, elapsed, options)
+            for name, value, error in zip(names, values, errors)]
+
+
+"""
+Add rows to the store in a single transaction, holding the write lock from its start
+"""
+def write_records(path, records):
+    def insert():
+        conn = connect(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                                 records)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    with_retries(insert)
+
+
+"""
+Select rows of the store
+"""
+def query(path, columns, filters, latest=False):
+    """
+    path - database file
+    columns - columns to return
+    filters - {column: value} the rows have to match
+    latest - only return the newest row for every (input file, observable, method, parameter), however
+             often the file was regenerated
+
+    return:
+    rows - list of tuples, ordered by project, observable, method, beta, tau/slices and parameter
+    """
+    unknown = [c for c in list(columns) + list(filters) if c not in COLUMNS + ["id"]]
+    if unknown:
+        raise ValueError(f"Please choose one of: {COLUMNS}")
+
+    where = " AND ".join(f"{column} = ?" for column in filters) or "1"
+    if latest:
+        where += " AND id IN (SELECT MAX(id) FROM results GROUP BY input_path, project, observable, method, parameter)"
+    sql = (f"SELECT {', '.join(columns)} FROM results WHERE {where} "
+           f"ORDER BY project, observable, method, beta, tau, slices, parameter, id")
+
+    def select():
+        conn = connect(path)
+        try:
+            return conn.execute(sql, list(filters.values())).fetchall()
+        finally:
+            conn.close()
+
+    return with_retries(select)
+
+
+def format_tsv(columns, rows):
+    lines = ["\t".join(columns)]
+    lines += ["\t".join("" if value is None else str(value) for value in row) for row in rows]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="results database file")
+    parser.add_argument("--columns", help="comma separated columns to export",
+                        default="project,beta,tau,slices,observable,method,parameter,value,error")
+    for column in ["project", "observable", "method", "parameter", "input_hash"]:
+        parser.add_argument(f"--{column}", help=f"only rows with this {column}")
+    for column in ["beta", "tau"]:
+        parser.add_argument(f"--{column}", type=float, help=f"only rows with this {column}")
+    parser.add_argument("--slices", type=int, help="only rows with this number of slices")
+    parser.add_argument("--latest", action="store_true", help="only the newest result of every input file, observable, method and parameter", default=False)
+    parser.add_argument("--output", help="write the TSV table to this file instead of stdout")
+    args = parser.parse_args()
+
+    columns = args.columns.split(",")
+    filters = {column: getattr(args, column) for column in ["project", "observable", "method", "parameter",
+                                                            "input_hash", "beta", "tau", "slices"]
+               if getattr(args, column) is not None}
+
+    table = format_tsv(columns, query(args.db, columns, filters, args.latest))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(table)
+    else:
+        sys.stdout.write(table)
@@ -0,0 +1,85 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+"""
+Datasets shared with the workers of a multiprocessing pool without copying: the parent places
+the arrays (data points, errors, covariance or Cholesky factors, ...) once in a block of shared
+memory, and every worker attaches to it when the pool starts, through the pool initializer, as
+read-only NumPy views. The tasks sent to the pool then only carry their own parameters, so their
+cost does not grow with the size of the data
+"""
+
+
+# views of the shared arrays in a pool worker, set by `attach_worker`
+_arrays = {}
+_block = None
+
+
+"""
+Copy arrays into a new block of shared memory
+"""
+def create(arrays):
+    """
+    arrays - {name: array}
+
+    return:
+    block - the SharedMemory block: the caller closes and unlinks it once the pool is done
+    layout - {name: (offset, shape, dtype)} of every array in the block, to pass to `attach`
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        # every array starts on a 64 byte boundary
+        offset = -(-offset // 64) * 64
+        layout[name] = (offset, array.shape, array.dtype.str)
+        offset += array.nbytes
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, array in arrays.items():
+        view(block, layout[name])[...] = array
+    return block, layout
+
+
+def view(block, entry):
+    offset, shape, dtype = entry
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+
+
+"""
+Attach to a block of shared memory, as read-only views of its arrays
+"""
+def attach(name, layout):
+    block = shared_memory.SharedMemory(name=name)
+    arrays = {}
+    for key, entry in layout.items():
+        arrays[key] = view(block, entry)
+        arrays[key].flags.writeable = False
+    return block, arrays
+
+
+"""
+Pool initializer: attach the worker to the shared arrays once, for all of its tasks
+"""
+def attach_worker(name, layout):
+    global _block
+    _block, arrays = attach(name, layout)
+    _arrays.clear()
+    _arrays.update(arrays)
+
+
+"""
+Shared arrays of this pool worker
+"""
+def arrays():
+    return _arrays
+
+
+"""
+Release a block created with `create`: its memory is freed once every worker has exited
+"""
+def release(block):
+    block.close()
+    block.unlink()
@@ -0,0 +1,257 @@
+import numpy as np
+
+
+"""
+Mergeable, constant-memory summaries of streams of samples with several columns (e.g. the fitting
+parameters of bootstrap iterations): running moments, fixed-bin histograms and a quantile sketch
+in the spirit of the merging t-digest. Pool workers summarize their own samples and the parent
+merges the summaries, so no samples have to be kept or sent between processes
+"""
+
+
+# number of t-digest centroids is at most COMPRESSION + 1 per column
+COMPRESSION = 200
+
+
+"""
+Compress weighted points into centroids of a t-digest: the arcsine scale function makes the
+centroids small near the tails, where quantiles need the most resolution
+"""
+def compress(means, weights, compression=COMPRESSION):
+    """
+    means - values of the points (or centroids)
+    weights - weights of the points
+    compression - resolution of the sketch
+
+    return:
+    means, weights - centroids, sorted by their means
+    """
+    order = np.argsort(means, kind="stable")
+    means, weights = means[order], weights[order]
+
+    # quantile at the middle of every point, mapped through the scale function to a bucket index
+    q = (np.cumsum(weights) - weights / 2) / np.sum(weights)
+    buckets = np.floor(compression * (np.arcsin(2 * q - 1) / np.pi + 0.5))
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+    bucket_weights = np.add.reduceat(weights, starts)
+    bucket_means = np.add.reduceat(means * weights, starts) / bucket_weights
+
+    return bucket_means, bucket_weights
+
+
+class StreamingSummary:
+    """
+    Summary of a stream of samples, shape (samples, columns)
+
+    edges - bin edges of the histogram of every column, shape (columns, bins + 1): samples outside
+            of them are counted in an underflow and an overflow bin
+    compression - resolution of the quantile sketch
+    """
+
+    def __init__(self, edges, compression=COMPRESSION):
+        self.edges = np.asarray(edges, dtype=float)
+        num_columns = self.edges.shape[0]
+
+        self.count = 0
+        self.mean = np.zeros(num_columns)
+        self.m2 = np.zeros(num_columns)
+        self.minimum = np.full(num_columns, np.inf)
+        self.maximum = np.full(num_columns, -np.inf)
+        # underflow, the bins, overflow
+        self.counts = np.zeros((num_columns, self.edges.shape[1] + 1), dtype=np.int64)
+        self.compression = compression
+        self.centroids = [(np.empty(0), np.empty(0)) for _ in range(num_columns)]
+
+    def _merge_moments(self, count, mean, m2):
+        # Chan et al.: combine the means and sums of squared deviations of two parts of the stream
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def add(self, samples):
+        """
+        Fold a chunk of samples, shape (samples, columns), into the summary
+        """
+        samples = np.asarray(samples, dtype=float).reshape(-1, self.edges.shape[0])
+        if not len(samples):
+            return
+
+        mean = np.mean(samples, axis=0)
+        self._merge_moments(len(samples), mean, np.sum((samples - mean) ** 2, axis=0))
+        self.minimum = np.minimum(self.minimum, np.min(samples, axis=0))
+        self.maximum = np.maximum(self.maximum, np.max(samples, axis=0))
+
+        for k in range(samples.shape[1]):
+            bins = np.searchsorted(self.edges[k], samples[:, k], side="right")
+            self.counts[k] += np.bincount(bins, minlength=self.counts.shape[1])
+
+            means, weights = self.centroids[k]
+            self.centroids[k] = compress(np.concatenate([means, samples[:, k]]),
+                                         np.concatenate([weights, np.ones(len(samples))]), self.compression)
+
+    def merge(self, other):
+        """
+        Fold the summary of another part of the stream (with the same bin edges) into this one
+        """
+        if not other.count:
+            return
+
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.counts += other.counts
+
+        for k, ((means, weights), (other_means, other_weights)) in enumerate(zip(self.centroids, other.centroids)):
+            self.centroids[k] = compress(np.concatenate([means, other_means]),
+                                         np.concatenate([weights, other_weights]), self.compression)
+
+    @property
+    def std(self):
+        # population standard deviation, as np.std of the samples
+        return np.sqrt(self.m2 / self.count)
+
+    def quantile(self, q):
+        """
+        Estimated quantiles q (scalar or array) of every column, shape (len(q), columns)
+        """
+        q = np.atleast_1d(q)
+        result = np.empty((len(q), len(self.centroids)))
+        for k, (means, weights) in enumerate(self.centroids):
+            # centroids sit at the quantile of their middle, the extremes at 0 and 1
+            midpoints = (np.cumsum(weights) - weights / 2) / np.sum(weights)
+            result[:, k] = np.interp(q, np.r_[0, midpoints, 1], np.r_[self.minimum[k], means, self.maximum[k]])
+        return result
+
+    def histogram(self, column):
+        """
+        Bin edges and normalized density of a column, the samples outside the bins included in the norm
+        """
+        edges = self.edges[column]
+        density = self.counts[column, 1:-1] / (self.count * np.diff(edges))
+        return edges, density
+
+    def outside(self, column):
+        """
+        Number of samples of a column below and above the bins
+        """
+        return self.counts[column, 0], self.counts[column, -1]
+
+
+"""
+Summaries of consecutive chunks of samples, the same as StreamingSummary.add on every chunk, but
+with every run of equal-sized chunks summarized at once by array operations along the chunks
+"""
+def summarize_chunks(samples, sizes, edges, compression=COMPRESSION):
+    """
+    samples - samples of all chunks one after the other, shape (samples, columns)
+    sizes - number of samples of every chunk
+    edges - bin edges of the histogram of every column, shape (columns, bins + 1)
+    compression - resolution of the quantile sketch
+
+    return:
+    summaries - StreamingSummary of every chunk, in order
+    """
+    samples = np.asarray(samples, dtype=float)
+    summaries = []
+    start = 0
+    while len(summaries) < len(sizes):
+        size = sizes[len(summaries)]
+        num_chunks = 1
+        while len(summaries) + num_chunks < len(sizes) and sizes[len(summaries) + num_chunks] == size:
+            num_chunks += 1
+        # contiguous columns, shape (columns, chunks, samples of a chunk)
+        columns = np.ascontiguousarray(samples[start:start + num_chunks * size].T).reshape(-1, num_chunks, size)
+        start += num_chunks * size
+        if not size:
+            summaries += [StreamingSummary(edges, compression) for _ in range(num_chunks)]
+            continue
+
+        mean = np.mean(columns, axis=2)
+        m2 = np.sum((columns - mean[:, :, np.newaxis]) ** 2, axis=2)
+        minimum, maximum = np.min(columns, axis=2), np.max(columns, axis=2)
+        group = [StreamingSummary(edges, compression) for _ in range(num_chunks)]
+        num_bins = group[0].counts.shape[1]
+        for k, column in enumerate(columns):
+            # the bins of every chunk are counted at once, offset by the chunk
+            bins = np.searchsorted(group[0].edges[k], column, side="right")
+            bins += num_bins * np.arange(num_chunks)[:, np.newaxis]
+            counts = np.bincount(bins.ravel(), minlength=num_chunks * num_bins).reshape(num_chunks, num_bins)
+
+            # every chunk starts from an empty sketch of unit weights, so all chunks share the
+            # buckets of `compress`, and only the sorted values differ
+            weights = np.ones(size)
+            q = (np.cumsum(weights) - weights / 2) / size
+            buckets = np.floor(compression * (np.arcsin(2 * q - 1) / np.pi + 0.5))
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            bucket_weights = np.add.reduceat(weights, starts)
+            bucket_means = np.add.reduceat(np.sort(column, axis=1), starts, axis=1) / bucket_weights
+
+            for c, summary in enumerate(group):
+                summary.counts[k] = counts[c]
+                summary.centroids[k] = (bucket_means[c], bucket_weights)
+
+        for c, summary in enumerate(group):
+            summary._merge_moments(size, mean[:, c], m2[:, c])
+            summary.minimum, summary.maximum = minimum[:, c], maximum[:, c]
+        summaries += group
+
+    return summaries
+
+
+"""
+Bin edges centred on `centre` and spanning `width` standard deviations `scale` on either side,
+with a fallback width for columns whose scale is not a positive finite number
+"""
+def centred_edges(centre, scale, bins=200, width=10):
+    centre = np.asarray(centre, dtype=float)
+    scale = np.asarray(scale, dtype=float)
+    fallback = 0.1 * np.abs(centre) + 1e-12
+    scale = np.where(np.isfinite(scale) & (scale > 0), scale, fallback)
+    return centre[:, np.newaxis] + width * scale[:, np.newaxis] * np.linspace(-1, 1, bins + 1)
+
+
+"""
+Pack a list of summaries with the same bin edges into a few arrays, e.g. for np.savez: the
+centroids of every summary and column are concatenated, with their lengths stored alongside
+"""
+def pack_summaries(summaries):
+    centroids = [centroid for summary in summaries for centroid in summary.centroids]
+    return {
+        "edges": summaries[0].edges,
+        "compression": np.array(summaries[0].compression),
+        "count": np.array([summary.count for summary in summaries]),
+        "mean": np.array([summary.mean for summary in summaries]),
+        "m2": np.array([summary.m2 for summary in summaries]),
+        "minimum": np.array([summary.minimum for summary in summaries]),
+        "maximum": np.array([summary.maximum for summary in summaries]),
+        "counts": np.array([summary.counts for summary in summaries]),
+        "centroid_lengths": np.array([len(means) for means, _ in centroids]),
+        "centroid_means": np.concatenate([means for means, _ in centroids]),
+        "centroid_weights": np.concatenate([weights for _, weights in centroids]),
+    }
+
+
+"""
+Inverse of pack_summaries: the summaries are restored exactly, so merging them gives the same
+result as merging the originals
+"""
+def unpack_summaries(packed):
+    num_columns = packed["edges"].shape[0]
+    offsets = np.r_[0, np.cumsum(packed["centroid_lengths"])]
+    summaries = []
+    for n in range(len(packed["count"])):
+        summary = StreamingSummary(packed["edges"], int(packed["compression"]))
+        summary.count = int(packed["count"][n])
+        summary.mean = packed["mean"][n]
+        summary.m2 = packed["m2"][n]
+        summary.minimum = packed["minimum"][n]
+        summary.maximum = packed["maximum"][n]
+        summary.counts = packed["counts"][n].copy()
+        blocks = range(n * num_columns, (n + 1) * num_columns)
+        summary.centroids = [(packed["centroid_means"][offsets[k]:offsets[k + 1]],
+                              packed["centroid_weights"][offsets[k]:offsets[k + 1]]) for k in blocks]
+        summaries.append(summary)
+    return summaries
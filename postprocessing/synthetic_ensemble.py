@@ -0,0 +1,153 @@
+import argparse
+import os
+
+import numpy as np
+
+from fits import superfluid_vs_time_fitting_func
+
+
+"""
+Write a synthetic ensemble of PIGS output files (.sd, .en, .sq, .vis, .gr, .sy) laid out like
+a production ensemble, i.e. <dirname>/run_1, ..., <dirname>/run_n. Used for benchmarking
+and testing the postprocessing scripts without access to the cluster
+"""
+
+
+"""
+Configuration file with the directives read by the postprocessing scripts
+"""
+def write_config(path, slices, beta, passes, blocks):
+    with open(path, "w") as f:
+        f.write("BOX 25.56 24.59 40.0\n")
+        f.write("TYPE he 4.0026 1\n")
+        f.write(f"SLICES {slices}\n")
+        f.write(f"BETA {beta}\n")
+        f.write(f"PASS {passes} {blocks}\n")
+        f.write("RESTART\n")
+
+
+"""
+Superfluid fraction S(t) on the imaginary time slices, following the Zhang (1995) form
+"""
+def superfluid_data(rng, slices, beta, params=(0.05, 40.0, 0.3), noise=0.01):
+    t = np.linspace(beta / slices, beta, slices)
+    sf = superfluid_vs_time_fitting_func(t, *params)
+    err = noise * (1 + rng.random(slices))
+    return np.column_stack([t, sf + rng.normal(scale=err), err])
+
+
+"""
+Kinetic, potential and total energies per block, with a short equilibration transient
+"""
+def energy_data(rng, blocks, e_0=-140.0, kinetic=15.0, noise=0.5):
+    block = np.arange(1, blocks + 1)
+    transient = 5.0 * np.exp(-block / (0.05 * blocks + 1))
+    kin = kinetic + rng.normal(scale=noise, size=blocks)
+    tot = e_0 + transient + rng.normal(scale=noise, size=blocks)
+    return np.column_stack([block, kin, tot - kin, tot])
+
+
+"""
+Magnitudes of the `num_q` shortest wavevectors of the reciprocal lattice of the box, shared by
+every run of an ensemble: lattice symmetry makes many of them degenerate, as in the simulation
+"""
+def wavevector_set(num_q, box=(25.56, 24.59)):
+    n = np.arange(-num_q, num_q + 1)
+    qx, qy = np.meshgrid(2 * np.pi * n / box[0], 2 * np.pi * n / box[1])
+    q = np.hypot(qx, qy).ravel()
+    return np.round(np.sort(q[q > 0])[:num_q], 4)
+
+
+"""
+Structure factor on a set of wavevectors, written out of order as the simulation does
+"""
+def structure_factor_data(rng, q):
+    num_q = len(q)
+    sq = 1 - np.exp(-q ** 2 / 4) + 0.3 * np.exp(-(q - 2.1) ** 2 / 0.1)
+    weights = rng.integers(1, 50, size=num_q).astype(float)
+    data = np.column_stack([q, sq + rng.normal(scale=0.01, size=num_q), weights])
+    return data[rng.permutation(num_q)]
+
+
+"""
+Pair distribution function g(r) on a fixed grid of distances, with shells at 3.6 and 7.0
+"""
+def pair_distribution_data(rng, num_r=240, r_max=12.0, noise=0.02):
+    r = np.linspace(r_max / num_r, r_max, num_r)
+    gr = (1 / (1 + np.exp(-(r - 2.6) / 0.12))) * (1 + 0.45 * np.exp(-(r - 3.6) ** 2 / 0.18)
+                                                    - 0.15 * np.exp(-(r - 5.0) ** 2 / 0.5)
+                                                    + 0.1 * np.exp(-(r - 7.0) ** 2 / 0.6))
+    return np.column_stack([r, gr + rng.normal(scale=noise, size=num_r) * (gr > 0.05)])
+
+
+"""
+Imaginary time world-line positions (x, y, z) of every particle on every slice
+"""
+def worldline_data(rng, slices, num_particles, box=(25.56, 24.59), z_0=2.9):
+    sites = rng.uniform(0, 1, size=(num_particles, 2)) * box
+    steps = rng.normal(scale=0.05, size=(num_particles, slices, 3))
+    paths = np.cumsum(steps, axis=1)
+    paths[:, :, :2] += sites[:, np.newaxis, :]
+    paths[:, :, 2] += z_0
+    return paths.reshape(-1, 3)
+
+
+"""
+Write all the files for a single run directory
+"""
+def write_run(run_dir, name, rng, slices, beta, passes, blocks, wavevectors, num_particles):
+    os.makedirs(run_dir, exist_ok=True)
+    write_config(os.path.join(run_dir, f"{name}.sy"), slices, beta, passes, blocks)
+    np.savetxt(os.path.join(run_dir, f"{name}.he.sd"), superfluid_data(rng, slices, beta),
+               fmt="%.6e", header="t  sf_fraction  error")
+    np.savetxt(os.path.join(run_dir, f"{name}.he.en"), energy_data(rng, blocks),
+               fmt=["%d", "%1.6e", "%1.6e", "%1.6e"], header=" block  kinetic  potential  total")
+    np.savetxt(os.path.join(run_dir, f"{name}.he.sq"), structure_factor_data(rng, wavevectors),
+               fmt="%.6e", header="q  S(q)  weight")
+    np.savetxt(os.path.join(run_dir, f"{name}.he.vis"), worldline_data(rng, slices, num_particles),
+               fmt="%.5f")
+    np.savetxt(os.path.join(run_dir, f"{name}.he.gr"), pair_distribution_data(rng), fmt="%.6e")
+
+
+"""
+Generate a whole ensemble of runs inside `dirname`
+"""
+def generate_ensemble(dirname, num_runs, slices, beta=0.25, passes=100, blocks=200,
+                      num_q=200, num_particles=16, name="synthetic", seed=0):
+    """
+    dirname - ensemble directory that will contain run_1, ..., run_n
+    num_runs - number of runs in the ensemble
+    slices - number of imaginary time slices
+    beta - total projection time
+    passes - number of passes per block, written to the PASS directive
+    blocks - number of blocks in each run
+    num_q - number of wavevectors in each structure factor file
+    num_particles - number of particles in each world-line file
+    name - base name of the files inside each run directory
+    seed - seed for the random number generator
+    """
+    rng = np.random.default_rng(seed)
+    wavevectors = wavevector_set(num_q)
+    run_dirs = []
+    for n in range(1, num_runs + 1):
+        run_dir = os.path.join(dirname, f"run_{n}")
+        write_run(run_dir, name, rng, slices, beta, passes, blocks, wavevectors, num_particles)
+        run_dirs.append(run_dir)
+
+    return run_dirs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirname", help="ensemble directory to be created")
+    parser.add_argument("--runs", type=int, help="number of runs in the ensemble", default=20)
+    parser.add_argument("--slices", type=int, help="number of imaginary time slices", default=160)
+    parser.add_argument("--beta", type=float, help="total projection time", default=0.25)
+    parser.add_argument("--blocks", type=int, help="number of blocks per run", default=200)
+    parser.add_argument("--num_q", type=int, help="number of wavevectors per structure factor file", default=200)
+    parser.add_argument("--particles", type=int, help="number of particles in the world-line files", default=16)
+    parser.add_argument("--seed", type=int, help="seed for the random number generator", default=0)
+    args = parser.parse_args()
+
+    generate_ensemble(args.dirname, args.runs, args.slices, beta=args.beta, blocks=args.blocks,
+                      num_q=args.num_q, num_particles=args.particles, seed=args.seed)
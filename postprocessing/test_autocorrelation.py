@@ -0,0 +1,34 @@
+import numpy as np
+
+import autocorrelation
+
+
+"""
+Tests of the autocorrelation estimates of Monte Carlo series
+"""
+
+
+def test_integrated_time():
+    # AR(1) process x_t = phi x_{t-1} + noise has tau = (1 + phi) / (1 - phi)
+    rng = np.random.default_rng(2)
+    phi = np.array([0.0, 0.5, 0.9])
+    noise = rng.normal(size=(100000, 3))
+    series = np.empty_like(noise)
+    series[0] = noise[0]
+    for t in range(1, len(noise)):
+        series[t] = phi * series[t - 1] + noise[t]
+    tau = autocorrelation.integrated_time(series)
+    np.testing.assert_allclose(tau, (1 + phi) / (1 - phi), rtol=0.1)
+
+
+def test_effective_sample_size_of_chain(tmp_path):
+    # raw.param chains are read without their summary footer, independent draws have ess ~ N
+    rng = np.random.default_rng(3)
+    chain = np.column_stack([np.arange(1, 5001), rng.normal(size=(5000, 2))])
+    filename = str(tmp_path / "raw.param")
+    np.savetxt(filename, chain, header="block A G")
+    with open(filename, "a") as f:
+        f.write("-" * 30 + "Final parameter estimates: A:   mean: 0.0    std: 1.0")
+    series = autocorrelation.read_series(filename, [1, 2])
+    assert series.shape == (5000, 2)
+    np.testing.assert_allclose(autocorrelation.effective_sample_size(series), 5000, rtol=0.15)
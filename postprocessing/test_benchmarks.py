@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import combine_files_all_runs
+import metropolis_fitting
+from block_average import average_all
+from bootstrap_fit import fit_with_bootstrap, fit_with_covariance
+from streaming_stats import centred_edges
+from fits import ALLOWED_FILETYPES
+
+
+"""
+Benchmarks for the hot paths of the postprocessing scripts at small, medium and large sizes.
+Run with `python -m pytest test_benchmarks.py --benchmark-only`
+"""
+
+
+SIZES = ["small", "medium", "large"]
+
+# (total bootstrap iterations, cores) per size
+BOOTSTRAP_SIZES = {"small": (200, 2), "medium": (1000, 2), "large": (4000, 4)}
+
+# (blocks, passes) per size
+METROPOLIS_SIZES = {"small": (5, 100), "medium": (20, 250), "large": (50, 500)}
+
+# number of blocks in the energies file per size
+BLOCK_AVERAGE_SIZES = {"small": 1000, "medium": 100000, "large": 1000000}
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_combine_sf(benchmark, synthetic, combine_args, size):
+    dirname = synthetic.ensemble(size, blocks=20, num_q=10, num_particles=1)
+    combine_args(dirname)
+    benchmark(combine_files_all_runs.combine_sf, dirname, ".sd", 2)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_fit_with_bootstrap(benchmark, synthetic, bootstrap_globals, size):
+    iterations, cores = BOOTSTRAP_SIZES[size]
+    data = synthetic.superfluid_curve(100)
+    x, y, yerr = data.T
+    bounds = ALLOWED_FILETYPES["sf_time"]["bounds"]
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    guess, errors = fit_with_covariance(func, x, y, yerr, 0, len(x), 1, bounds)
+    unit_summaries, _ = benchmark.pedantic(fit_with_bootstrap,
+                                           args=(func, x, y, yerr, 0, len(x), 1, guess, iterations, cores, bounds,
+                                                 centred_edges(guess, errors)),
+                                           rounds=1, iterations=1)
+    assert sum(summary.count for summary in unit_summaries) == iterations
+
+
+@pytest.mark.parametrize("backend", ["python", "auto"])
+@pytest.mark.parametrize("size", SIZES)
+def test_engine(benchmark, tmp_path, synthetic, metropolis_globals, size, backend):
+    blocks, passes = METROPOLIS_SIZES[size]
+    metropolis_globals(backend=backend)
+    data = synthetic.superfluid_curve(160)
+    benchmark.pedantic(metropolis_fitting.engine, args=(data, blocks, passes, "sf_time", str(tmp_path)),
+                       rounds=1, iterations=1)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_average_all(benchmark, synthetic, size):
+    data = synthetic.energy_series(BLOCK_AVERAGE_SIZES[size])
+    output = benchmark(average_all, data, 20, 0, [1, 2, 3])
+    assert len(output.split()) == 6
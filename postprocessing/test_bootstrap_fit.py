@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+import bootstrap_fit
+import instrumentation
+from bootstrap_fit import fit_with_bootstrap, fit_with_covariance, merge_units
+from streaming_stats import centred_edges
+from fits import ALLOWED_FILETYPES
+from scipy.optimize import curve_fit
+
+
+"""
+Tests of the bootstrap work units of bootstrap_fit.py: sharding, failed fits and checkpoints
+"""
+
+
+def test_sharded_bootstrap_is_bit_identical(tmp_path, synthetic, bootstrap_globals, monkeypatch):
+    # shards merged in unit order reproduce one large run exactly, whatever the number of cores
+    monkeypatch.setattr(bootstrap_fit, "UNIT_ITERATIONS", 40)
+    x, y, yerr = synthetic.superfluid_curve(60).T
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    bounds = ALLOWED_FILETYPES["sf_time"]["bounds"]
+    guess, errors = fit_with_covariance(func, x, y, yerr, 0, len(x), 1, bounds)
+    edges = centred_edges(guess, errors)
+
+    whole, samples = fit_with_bootstrap(func, x, y, yerr, 0, len(x), 1, guess, 220, 1, bounds, edges, True)
+    shard_files = []
+    for k, cores in [(3, 1), (1, 2), (2, 3)]:
+        units, shard_samples = fit_with_bootstrap(func, x, y, yerr, 0, len(x), 1, guess, 220, cores, bounds,
+                                                  edges, True, shard=(k, 3))
+        shard_files.append(str(tmp_path / f"shard_{k}.npz"))
+        bootstrap_fit.save_shard(shard_files[-1], units, shard_samples, (k, 3), 220, bootstrap_fit.BOOTSTRAP_SEED)
+    merged, merged_samples = bootstrap_fit.load_shards(shard_files, 220, bootstrap_fit.BOOTSTRAP_SEED, edges, True)
+
+    np.testing.assert_array_equal(merged_samples, samples)
+    expected, actual = merge_units(whole, edges), merge_units(merged, edges)
+    for name in ["mean", "m2", "minimum", "maximum", "counts"]:
+        np.testing.assert_array_equal(getattr(actual, name), getattr(expected, name))
+    np.testing.assert_array_equal(actual.quantile([0.1, 0.5, 0.9]), expected.quantile([0.1, 0.5, 0.9]))
+
+    with pytest.raises(ValueError):
+        bootstrap_fit.load_shards(shard_files[:2], 220, bootstrap_fit.BOOTSTRAP_SEED, edges)
+
+
+def test_bootstrap_failures_and_checkpoints(tmp_path, synthetic, bootstrap_globals, monkeypatch):
+    monkeypatch.setattr(bootstrap_fit, "UNIT_ITERATIONS", 40)
+    x, y, yerr = synthetic.superfluid_curve(60).T
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    bounds = ALLOWED_FILETYPES["sf_time"]["bounds"]
+    guess, errors = fit_with_covariance(func, x, y, yerr, 0, len(x), 1, bounds)
+    edges = centred_edges(guess, errors)
+
+    # fits of resamples whose first point is high fail from the original guess only
+    def flaky_curve_fit(f, xdata, ydata, p0, **kwargs):
+        if ydata[0] > y[0] + yerr[0] and np.array_equal(p0, guess):
+            raise RuntimeError("Optimal parameters not found")
+        return curve_fit(f, xdata, ydata, p0=p0, **kwargs)
+    monkeypatch.setattr(bootstrap_fit, "curve_fit", flaky_curve_fit)
+    high = 0
+    for unit, iterations in bootstrap_fit.work_units(220):
+        rng = bootstrap_fit.unit_rng(bootstrap_fit.BOOTSTRAP_SEED, unit)
+        high += sum(rng.normal(size=y.size, loc=y, scale=yerr)[0] > y[0] + yerr[0] for _ in range(iterations))
+    assert high > 0
+
+    # failures are counted per unit instead of failing the whole run, and retries recover them
+    failing, _ = fit_with_bootstrap(func, x, y, yerr, 0, len(x), 1, guess, 220, 2, bounds, edges)
+    assert merge_units(failing, edges).count == 220 - high
+    retried, _ = fit_with_bootstrap(func, x, y, yerr, 0, len(x), 1, guess, 220, 2, bounds, edges, retries=2)
+    assert merge_units(retried, edges).count == 220
+
+    # a rerun after a job was killed only does the units missing from the checkpoint directory
+    checkpoint = str(tmp_path / "checkpoint")
+    whole, samples = fit_with_bootstrap(func, x, y, yerr, 0, len(x), 1, guess, 220, 2, bounds, edges, True,
+                                        retries=2, checkpoint=checkpoint)
+    for unit in [1, 5]:
+        os.remove(bootstrap_fit.unit_checkpoint(checkpoint, unit))
+    instrumentation.reset()
+    resumed, resumed_samples = fit_with_bootstrap(func, x, y, yerr, 0, len(x), 1, guess, 220, 2, bounds, edges, True,
+                                                  retries=2, checkpoint=checkpoint)
+    counters = instrumentation.snapshot()
+    assert counters["fits_attempted"] - counters["fits_failed"] == 40 + 20
+    np.testing.assert_array_equal(resumed_samples, samples)
+    np.testing.assert_array_equal(merge_units(resumed, edges).mean, merge_units(whole, edges).mean)
+
+
+def test_linear_bootstrap_chunks(bootstrap_globals):
+    # the size of the chunks held in memory changes neither the samples nor the summaries
+    x = np.array([0.00125, 0.0025, 0.005, 0.01, 0.02])
+    yerr = np.full(len(x), 0.01)
+    y = -140 + 3e6 * x ** 4
+    basis = ALLOWED_FILETYPES["en_time_step"]["basis"](x)
+    edges = centred_edges(*bootstrap_fit.linear_fit(basis, y, yerr))
+
+    whole, samples = bootstrap_fit.linear_bootstrap(basis, y, yerr, 5500, edges, True)
+    chunked, chunked_samples = bootstrap_fit.linear_bootstrap(basis, y, yerr, 5500, edges, True, chunk_elements=1)
+    assert np.array_equal(samples, chunked_samples)
+    assert np.allclose([s.mean for s in whole], [s.mean for s in chunked])
+    assert bootstrap_fit.linear_bootstrap(basis, y, yerr, 5500, edges, chunk_elements=1)[1] is None
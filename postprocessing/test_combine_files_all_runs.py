@@ -0,0 +1,43 @@
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+import combine_files_all_runs
+
+
+"""
+Tests of the combiners of combine_files_all_runs.py beyond their parity with the original scripts
+"""
+
+
+def test_combine_sq_radial_in_one_pass(synthetic, combine_args, monkeypatch):
+    # the full and the radial average come from one pass over the files, each plotted on its own
+    dirname = synthetic.ensemble("small", blocks=20, num_q=60, num_particles=1)
+    combine_args(dirname).plot = True
+    loaded = []
+    load_columns = combine_files_all_runs.load_columns
+    monkeypatch.setattr(combine_files_all_runs, "load_columns",
+                        lambda filename, **kwargs: loaded.append(filename) or load_columns(filename, **kwargs))
+
+    combine_files_all_runs.combine_sq(dirname, ".sq", 1, 0.25)
+    assert sorted(loaded) == sorted(synthetic.run_files(dirname, ".sq"))
+    full = np.loadtxt(os.path.join(dirname, "sq_combined"))
+    radial = np.loadtxt(os.path.join(dirname, "sq_radial"))
+    assert len(radial) < len(full)
+    # the radial plot holds only its own curve
+    assert len(plt.gca().containers) == 1
+    assert os.path.exists(os.path.join(dirname, "images", "sq_combined.png"))
+    assert os.path.exists(os.path.join(dirname, "images", "sq_radial.png"))
+    plt.close("all")
+
+
+def test_combine_gr_needs_two_blocks(synthetic, combine_args):
+    # a single block has no scatter to estimate the errors from
+    dirname = synthetic.ensemble("small", blocks=20, num_q=5, num_particles=1)
+    combine_args(dirname)
+    with pytest.raises(ValueError, match="at least 2 blocks"):
+        combine_files_all_runs.combine_gr(dirname, ".gr", 4)
+    combine_files_all_runs.combine_gr(dirname, ".gr", 2)
+    assert np.all(np.isfinite(np.loadtxt(os.path.join(dirname, "gr_combined"))))
@@ -0,0 +1,42 @@
+import pytest
+
+import bootstrap_fit
+import cost_model
+from fits import ALLOWED_FILETYPES
+
+
+"""
+Tests of the runtime cost model
+"""
+
+
+# a fixed calibration, so that the predictions do not depend on the machine running the tests
+CALIBRATION = {"bootstrap": {"sf_time": [1e-3, 1e-5], "en_time_step": [1e-6, 0.0]},
+               "metropolis": {"sf_time": [2e-6, 1e-8]},
+               "pool_startup": [0.05, 0.01], "parse_bytes_per_s": 1e8}
+
+
+def test_cost_model_plan(bootstrap_globals):
+    # 10 work units of 1 ms + 100 * 10 us per resample: the time stops falling at 10 cores
+    times = {cores: cost_model.bootstrap_time(CALIBRATION, "sf_time", 10 * bootstrap_fit.UNIT_ITERATIONS, 100, cores)
+             for cores in range(1, 49)}
+    assert times[1] == pytest.approx(0.06 + 10000 * 2e-3)
+    assert times[10] == pytest.approx(0.15 + 1000 * 2e-3)
+    assert cost_model.best_cores(times) == 10
+    # linear models are solved in the main process
+    assert cost_model.bootstrap_time(CALIBRATION, "en_time_step", 10000, 100, 48) == pytest.approx(0.01)
+    # a shard per two work units keeps every shard within 5 minutes of wall time
+    assert cost_model.plan_shards(CALIBRATION, "sf_time", 10 ** 6, 100, 1, 300 + 1.5 * 5) == (500, pytest.approx(4.06))
+    assert cost_model.metropolis_time(CALIBRATION, "sf_time", 500, 500, 100) == pytest.approx(250000 * 3e-6)
+    assert cost_model.combine_time(CALIBRATION, 5 * 10 ** 8) == pytest.approx(5)
+    assert cost_model.slurm_time(3600) == "0-01:35:00"
+    assert cost_model.parse_duration("1-02:00:30") == 93630
+
+
+@pytest.mark.slow
+def test_calibration_runs_real_code_paths(bootstrap_globals):
+    # micro-benchmarks (pool startup included), so only run with --run_slow
+    figures = cost_model.calibrate(samples=5, passes=200, rows=1000, max_cores=2)
+    for job in ["bootstrap", "metropolis"]:
+        assert all(cost_model.cost(figures[job][filetype], 100) > 0 for filetype in ALLOWED_FILETYPES)
+    assert figures["parse_bytes_per_s"] > 0
@@ -0,0 +1,33 @@
+import os
+
+import ensemble_index
+
+
+"""
+Tests of the ensemble manifest
+"""
+
+
+def test_ensemble_index_matches_glob(synthetic):
+    dirname = synthetic.ensemble("small")
+    index = ensemble_index.load_index(dirname)
+    assert sorted(ensemble_index.files_with_extension(dirname, index, ".sd")) == sorted(synthetic.run_files(dirname, ".sd"))
+    assert ensemble_index.run_config(index, 1)["PASS"] == ["100", "200"]
+    # a file created after the manifest was written is picked up on the next load
+    extra = os.path.join(dirname, "run_2", "extra.sd")
+    open(extra, "w").close()
+    index = ensemble_index.load_index(dirname)
+    assert extra in ensemble_index.files_with_extension(dirname, index, ".sd")
+
+
+def test_ensemble_index_coarse_mtime(synthetic):
+    # a file created within the mtime granularity of the last scan leaves the directory mtime unchanged
+    dirname = synthetic.ensemble("small")
+    ensemble_index.load_index(dirname)
+    run_dir = os.path.join(dirname, "run_3")
+    stat = os.stat(run_dir)
+    extra = os.path.join(run_dir, "extra.sd")
+    open(extra, "w").close()
+    os.utime(run_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    index = ensemble_index.load_index(dirname)
+    assert extra in ensemble_index.files_with_extension(dirname, index, ".sd")
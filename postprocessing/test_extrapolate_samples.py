@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+from block_average import bootstrap_means
+from ensemble_index import ensemble_seed
+from extrapolate_samples import read_sample_list
+
+
+"""
+Tests of the samples propagated through the final extrapolation
+"""
+
+
+def test_ensembles_get_independent_samples(synthetic, tmp_path):
+    # the energies of two ensembles, resampled with the seeds derived from their paths
+    sample_list = str(tmp_path / "energy_samples_list")
+    with open(sample_list, "w") as f:
+        for k, tau in enumerate([0.01, 0.02]):
+            dirname = str(tmp_path / f"tau_{tau}")
+            os.makedirs(dirname)
+            filename = os.path.join(dirname, "energies_combined")
+            np.savetxt(filename, synthetic.energy_series(2000, seed=0))
+            seed = ensemble_seed(filename)
+            np.savez_compressed(os.path.join(dirname, "energy_samples.npz"), seed=np.array(seed),
+                                samples=bootstrap_means(np.loadtxt(filename), 20, 0, [1, 2, 3], 4000, seed))
+            f.write(f"{tau} {os.path.join(dirname, 'energy_samples.npz')}\n")
+
+    # same data, different ensembles: the paired samples are uncorrelated
+    x, samples = read_sample_list(sample_list, 2)
+    assert samples.shape == (4000, 2)
+    assert abs(np.corrcoef(samples.T)[0, 1]) < 0.05
+
+    # samples drawn from one stream are refused
+    with open(sample_list, "a") as f:
+        f.write(f"0.04 {os.path.join(str(tmp_path), 'tau_0.01', 'energy_samples.npz')}\n")
+    with pytest.raises(ValueError):
+        read_sample_list(sample_list, 2)
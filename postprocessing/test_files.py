@@ -1,15 +1,35 @@
 import unittest
+
+import numpy as np
+
+import metropolis_fitting
 from metropolis_fitting import accept
+from fits import superfluid_vs_time_fitting_func
 
 
 class TestMetropolis(unittest.TestCase):
-    
+
+    def setUp(self):
+        metropolis_fitting.rng = np.random.default_rng(927)
+        self.x = np.linspace(0.01, 0.25, 50)
+        self.params = np.array([0.05, 40.0, 0.3])
+        self.y = superfluid_vs_time_fitting_func(self.x, *self.params)
+        self.yerr = np.full_like(self.x, 0.01)
+
     def test_accept(self):
-        # Test case for the add_numbers function
-        result = accept(2, 3)
-        self.assertEqual(result, 5)  # Assert that the result is equal to 5
+        # a move towards the true parameters always lowers chi-squared, so it is always accepted
+        prev = self.params + np.array([0, 0, 0.05])
+        new, inc = accept(self.x, self.y, self.yerr, prev, self.params, superfluid_vs_time_fitting_func)
+        self.assertEqual(inc, 1)
+        np.testing.assert_array_equal(new, self.params)
+
+    def test_reject(self):
+        # a move far away from the data has a vanishing acceptance ratio
+        trial = self.params + np.array([0, 0, 1.0])
+        new, inc = accept(self.x, self.y, self.yerr, self.params, trial, superfluid_vs_time_fitting_func)
+        self.assertEqual(inc, 0)
+        np.testing.assert_array_equal(new, self.params)
 
-        # Add more test cases as needed
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+
+import combine_files_all_runs
+import ensemble_index
+import health_check
+from synthetic_ensemble import superfluid_data
+
+
+"""
+Tests of the health scan that quarantines damaged runs
+"""
+
+
+def test_health_check_quarantines_damaged_runs(synthetic, combine_args, tmp_path):
+    dirname = synthetic.ensemble("medium", blocks=2000, num_q=5, num_particles=1)
+    assert health_check.scan_ensemble(dirname, [".sd", ".en", ".sq", ".gr"], cores=2) == {}
+
+    # a run killed mid-line, a run that wrote only zeros and a run that lost a file
+    truncated = os.path.join(dirname, "run_3", "synthetic.he.en")
+    with open(truncated, "rb") as f:
+        content = f.read()
+    with open(truncated, "wb") as f:
+        f.write(content[:int(0.6 * len(content))])
+    zeros = os.path.join(dirname, "run_7", "synthetic.he.sd")
+    data = np.loadtxt(zeros)
+    data[:, 1:] = 0
+    np.savetxt(zeros, data, fmt="%.6e")
+    os.remove(os.path.join(dirname, "run_12", "synthetic.he.sq"))
+
+    problems = health_check.scan_ensemble(dirname, [".sd", ".en", ".sq", ".gr"], cores=2)
+    assert sorted(problems) == [3, 7, 12]
+    assert "synthetic.he.en: last line is incomplete" in problems[3]
+
+    # the combiners leave the quarantined runs out
+    quarantine = os.path.join(dirname, ensemble_index.QUARANTINE)
+    health_check.write_quarantine(quarantine, problems)
+    combine_args(dirname).quarantine = quarantine
+    combine_files_all_runs.combine_en(dirname, ".en", 20)
+    healthy = [np.loadtxt(os.path.join(dirname, f"run_{run}", "synthetic.he.en"))[:, 3]
+               for run in range(1, 21) if run not in problems]
+    energies = np.loadtxt(os.path.join(dirname, "energies_combined"))
+    np.testing.assert_allclose(energies[:, 3], np.mean(healthy, axis=0), rtol=1e-6)
+
+    # files larger than the bytes read: the number of rows is estimated from the length of the last rows
+    large = str(tmp_path / "large.sd")
+    np.savetxt(large, superfluid_data(np.random.default_rng(0), 2000, 0.25), fmt="%.6e", header="t  sf_fraction  error")
+    assert health_check.inspect_file(large, 2000) == []
+    with open(large, "rb") as f:
+        content = f.read()
+    with open(large, "wb") as f:
+        f.write(content[:content.rfind(b"\n", 0, int(0.7 * len(content))) + 1])
+    assert health_check.inspect_file(large, 2000) == ["about 1399 of 2000 rows"]
+
+
+def test_health_check_keeps_partial_runs(synthetic, combine_args, capsys):
+    dirname = synthetic.ensemble("medium", blocks=200, num_q=5, num_particles=1)
+
+    # a run still going (or stopped once the ensemble converged), a run that has not written its
+    # first block yet and a run whose blocks got out of order
+    running = os.path.join(dirname, "run_2", "synthetic.he.en")
+    with open(running, "rb") as f:
+        lines = f.readlines()
+    with open(running, "wb") as f:
+        f.writelines(lines[:len(lines) // 3])
+    os.remove(os.path.join(dirname, "run_4", "synthetic.he.en"))
+    garbled = os.path.join(dirname, "run_5", "synthetic.he.en")
+    with open(garbled, "rb") as f:
+        lines = f.readlines()
+    lines[-3], lines[-2] = lines[-2], lines[-3]
+    with open(garbled, "wb") as f:
+        f.writelines(lines)
+
+    problems = health_check.scan_ensemble(dirname, [".sd", ".en", ".sq", ".gr"], cores=2)
+    assert problems == {5: ["synthetic.he.en: rows are not numbered consecutively"]}
+
+    # the partial run still counts towards the blocks it has reached
+    quarantine = os.path.join(dirname, ensemble_index.QUARANTINE)
+    health_check.write_quarantine(quarantine, problems)
+    combine_args(dirname).quarantine = quarantine
+    combine_files_all_runs.combine_en(dirname, ".en", 20)
+    energies = np.loadtxt(os.path.join(dirname, "energies_combined"))
+    early = [np.loadtxt(os.path.join(dirname, f"run_{run}", "synthetic.he.en"))[0, 3]
+             for run in range(1, 21) if run not in (4, 5)]
+    assert len(energies) == 200
+    np.testing.assert_allclose(energies[0, 3], np.mean(early), rtol=1e-6)
+
+    # with every run quarantined the combiners report it and write nothing
+    os.remove(os.path.join(dirname, "energies_combined"))
+    health_check.write_quarantine(quarantine, {run: ["damaged"] for run in range(1, 21)})
+    for extension, combine in [(".sd", combine_files_all_runs.combine_sf), (".en", combine_files_all_runs.combine_en),
+                               (".sq", combine_files_all_runs.combine_sq)]:
+        combine(dirname, extension, 20)
+        assert f"No {extension} files left to combine" in capsys.readouterr().out
+    combine_files_all_runs.combine_gr(dirname, ".gr", 20)
+    assert "No .gr files left to combine" in capsys.readouterr().out
+    assert not os.path.exists(os.path.join(dirname, "energies_combined"))
@@ -0,0 +1,29 @@
+import warnings
+
+import numpy as np
+import pytest
+
+import loaders
+
+
+"""
+Tests of the shared reader of the simulation's output files
+"""
+
+
+@pytest.mark.parametrize("c_parser", [True, False])
+def test_load_columns_empty_file(tmp_path, monkeypatch, c_parser):
+    # files the simulation has not written to yet give no rows on both parsers
+    monkeypatch.setattr(loaders, "C_PARSER", c_parser)
+    for text in ["", "# only a comment\n"]:
+        filename = str(tmp_path / "run.en")
+        with open(filename, "w") as f:
+            f.write(text)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            assert loaders.load_columns(filename, usecols=(0, 1, 2)).shape == (0, 3)
+            assert loaders.load_columns(filename, usecols=1).shape == (0,)
+
+    with open(filename, "w") as f:
+        f.write("# block energy\n1 2.0 3.0\n2 4.0 5.0\n")
+    np.testing.assert_array_equal(loaders.load_columns(filename, usecols=(0, 2)), [[1, 3], [2, 5]])
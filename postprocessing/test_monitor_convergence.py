@@ -0,0 +1,34 @@
+import numpy as np
+
+import monitor_convergence
+
+
+"""
+Tests of the incremental convergence monitor
+"""
+
+
+def test_convergence_monitor_reads_incrementally(synthetic):
+    # a monitor that saw the .en files half written (mid-line) ends up where a fresh one starts
+    dirname = synthetic.ensemble("small", blocks=120, num_q=5, num_particles=1)
+    en_files = sorted(synthetic.run_files(dirname, ".en"))
+    contents = []
+    for filename in en_files:
+        with open(filename, "rb") as f:
+            contents.append(f.read())
+        with open(filename, "wb") as f:
+            f.write(contents[-1][:len(contents[-1]) // 2])
+
+    state = monitor_convergence.update(dirname, {}, 30, (0.25, 0.75))
+    for filename, content in zip(en_files, contents):
+        with open(filename, "wb") as f:
+            f.write(content)
+    incremental = monitor_convergence.summarize(monitor_convergence.update(dirname, state, 30, (0.25, 0.75)))
+    fresh = monitor_convergence.summarize(monitor_convergence.update(dirname, {}, 30, (0.25, 0.75)))
+
+    means = [np.mean(np.loadtxt(filename)[30:, 3]) for filename in en_files]
+    energy, _ = monitor_convergence.ensemble_error(means, [90] * len(means))
+    assert incremental["blocks"] == fresh["blocks"] == 90 * len(en_files)
+    np.testing.assert_allclose(incremental["energy"], energy, rtol=1e-12)
+    np.testing.assert_allclose(incremental["energy_err"], fresh["energy_err"], rtol=1e-10)
+    np.testing.assert_allclose(np.std(means, ddof=1) / np.sqrt(len(means)), fresh["energy_err"], rtol=1e-10)
@@ -0,0 +1,410 @@
+import os
+
+import numpy as np
+import pytest
+
+import combine_files_all_runs
+import loaders
+import metropolis_kernels
+import metropolis_fitting
+import window_scan
+from block_average import average_all
+from bootstrap_fit import coarse_grain, fit_with_bootstrap, fit_with_covariance, linear_bootstrap, linear_fit, merge_units
+from extrapolate_samples import batched_fit
+from streaming_stats import StreamingSummary, centred_edges, summarize_chunks
+from fits import ALLOWED_FILETYPES
+from scipy.optimize import curve_fit
+
+
+"""
+Parity tests: the postprocessing hot paths are checked against frozen copies of the reference
+implementations below, so that performance work cannot quietly change the physics. New fast
+paths should be added here next to the reference they replace
+"""
+
+
+"""
+Reference implementations, frozen from the original scripts
+"""
+def reference_combine_sf(file_list, blocksize):
+    fractions = []
+    for filename in file_list:
+        data = np.loadtxt(filename)
+        if data.any():
+            betas = data[:, 0]
+            fractions.append(data[:, 1])
+    fraction_array = np.column_stack(fractions)
+    num_points, num_runs = fraction_array.shape
+    num_blocks = num_runs // blocksize
+    block_avg = np.average(fraction_array[:, :num_blocks*blocksize].reshape(num_points, num_blocks, blocksize), axis=-1)
+    if num_runs % blocksize != 0:
+        excess_avg = np.average(fraction_array[:, num_blocks*blocksize:], axis=1)
+        block_avg = np.column_stack([block_avg, excess_avg])
+    return betas, np.average(block_avg, axis=1), np.std(block_avg, axis=1)
+
+
+def reference_combine_en(file_list, num_of_blocks):
+    arrays = np.full((3, num_of_blocks, len(file_list)), np.nan)
+    for i, filename in enumerate(file_list):
+        data = np.loadtxt(filename)
+        arrays[:, :len(data), i] = data[:, 1:4].T
+    averages = np.nanmean(arrays, axis=2)
+    return averages[:, ~np.isnan(averages[2])]
+
+
+def reference_combine_sq(file_list, radial_width=0.0):
+    # the original argsort-and-stack average, with the weighted scatter between runs as error
+    values, weights = [], []
+    for filename in file_list:
+        data = np.loadtxt(filename)
+        data = data[np.argsort(data[:, 0], kind="stable")]
+        q = data[:, 0]
+        if radial_width > 0:
+            bins = np.floor(q / radial_width)
+            groups = [bins == b for b in np.unique(bins)]
+            q = np.array([np.mean(q[g]) for g in groups])
+            w = np.array([np.sum(data[g, 2]) for g in groups])
+            sq = np.array([np.sum(data[g, 1] * data[g, 2]) for g in groups]) / w
+            data = np.column_stack([q, sq, w])
+        values.append(data[:, 1])
+        weights.append(data[:, 2])
+    sq_array, weights_array = np.column_stack(values), np.column_stack(weights)
+    sq_avg = np.sum(weights_array * sq_array, axis=1) / np.sum(weights_array, axis=1)
+    scatter = np.sum(weights_array * (sq_array - sq_avg[:, np.newaxis]) ** 2, axis=1)
+    sq_err = np.sqrt(scatter / ((len(file_list) - 1) * np.sum(weights_array, axis=1)))
+    return q, sq_avg, sq_err
+
+
+def reference_average_all(X, block_size, throwaway, indices):
+    X = X[throwaway:]
+    X = X[X.shape[0] % block_size:, indices]
+    output = ""
+    for col in range(X.shape[1]):
+        blocks = X[:, col].reshape(-1, block_size).mean(axis=1)
+        err = np.sqrt(np.var(blocks, ddof=1) / len(blocks))
+        output += f"{np.mean(blocks):.4f} {err:.5f} "
+    return output
+
+
+def reference_metropolis(x, y, yerr, params, deltas, blocks, passes, fitting_func, rng):
+    # the pass loop of the original engine, with the displacements tuned after every block
+    block_params = []
+    for _ in range(blocks):
+        successes, attempts = np.zeros(len(params)), np.zeros(len(params))
+        for _ in range(passes):
+            i = rng.integers(0, 3)
+            proposed = params.copy()
+            proposed[i] = params[i] + (rng.random() - 0.5) * deltas[i]
+            diff = (y - fitting_func(x, *proposed)) ** 2 - (y - fitting_func(x, *params)) ** 2
+            exp_arg = np.sum(diff / (2 * yerr ** 2))
+            if exp_arg < 0 or rng.random() < np.exp(-exp_arg):
+                params = proposed
+                successes[i] += 1
+            attempts[i] += 1
+        block_params.append(params)
+        deltas = [delta * 2 * successes[i] / attempts[i] + 0.001 for i, delta in enumerate(deltas)]
+    return np.array(block_params)
+
+
+"""
+Helpers
+"""
+def assert_parity(actual, reference, rtol=1e-4, atol=1e-8):
+    np.testing.assert_allclose(actual, reference, rtol=rtol, atol=atol)
+
+
+"""
+Tests
+"""
+def test_combine_sf_parity(synthetic, combine_args):
+    dirname = synthetic.ensemble("medium", blocks=20, num_q=10, num_particles=1)
+    combine_args(dirname)
+    # a block size of one makes the blocked error independent of the order the runs are read in
+    combine_files_all_runs.combine_sf(dirname, ".sd", 1)
+    combined = np.loadtxt(os.path.join(dirname, "sf_fractions_combined"))
+    betas, avg, err = reference_combine_sf(synthetic.run_files(dirname, ".sd"), 1)
+    assert_parity(combined[:, 0], betas)
+    assert_parity(combined[:, 1], avg)
+    assert_parity(combined[:, 2], err)
+
+
+def test_combine_sf_blocked_mean_parity(synthetic, combine_args):
+    dirname = synthetic.ensemble("medium", blocks=20, num_q=10, num_particles=1)
+    combine_args(dirname)
+    combine_files_all_runs.combine_sf(dirname, ".sd", 5)
+    combined = np.loadtxt(os.path.join(dirname, "sf_fractions_combined"))
+    _, avg, _ = reference_combine_sf(synthetic.run_files(dirname, ".sd"), 5)
+    assert_parity(combined[:, 1], avg)
+
+
+def test_combine_en_parity(synthetic, combine_args):
+    dirname = synthetic.ensemble("small", blocks=200, num_q=10, num_particles=1)
+    combine_args(dirname)
+    combine_files_all_runs.combine_en(dirname, ".en", 1)
+    combined = np.loadtxt(os.path.join(dirname, "energies_combined"))
+    reference = reference_combine_en(synthetic.run_files(dirname, ".en"), 200)
+    assert_parity(combined[:, 1:].T, reference, rtol=1e-6)
+
+
+@pytest.mark.parametrize("radial_width", [0.0, 0.25])
+def test_combine_sq_parity(synthetic, combine_args, radial_width):
+    dirname = synthetic.ensemble("small", blocks=20, num_q=60, num_particles=1)
+    combine_args(dirname)
+    file_list = sorted(synthetic.run_files(dirname, ".sq"))
+    # rewrite one run in the row order of the first, so that the shared index is reused for it
+    first, second = np.loadtxt(file_list[0]), np.loadtxt(file_list[1])
+    reordered = np.empty_like(second)
+    reordered[np.argsort(first[:, 0], kind="stable")] = second[np.argsort(second[:, 0], kind="stable")]
+    np.savetxt(file_list[1], reordered)
+
+    combine_files_all_runs.combine_sq(dirname, ".sq", 1, radial_width)
+    combined = np.loadtxt(os.path.join(dirname, "sq_radial" if radial_width else "sq_combined"))
+    for column, reference in enumerate(reference_combine_sq(file_list, radial_width)):
+        assert_parity(combined[:, column], reference, rtol=1e-3)
+    # the radial average comes with the full one
+    combined = np.loadtxt(os.path.join(dirname, "sq_combined"))
+    for column, reference in enumerate(reference_combine_sq(file_list)):
+        assert_parity(combined[:, column], reference, rtol=1e-3)
+
+
+def test_combine_gr_parity(synthetic, combine_args):
+    dirname = synthetic.ensemble("medium", blocks=20, num_q=5, num_particles=1)
+    combine_args(dirname)
+    curves = np.array([np.loadtxt(filename)[:, 1] for filename in synthetic.run_files(dirname, ".gr")])
+
+    # blocks of one run: the standard error of the mean over the runs
+    combine_files_all_runs.combine_gr(dirname, ".gr", 1, "blocking")
+    blocked = np.loadtxt(os.path.join(dirname, "gr_combined"))
+    blocked_peaks = np.loadtxt(os.path.join(dirname, "gr_peaks"))
+    assert_parity(blocked[:, 1], np.mean(curves, axis=0), rtol=1e-6)
+    assert_parity(blocked[:, 2], np.std(curves, axis=0, ddof=1) / np.sqrt(len(curves)), rtol=1e-6)
+
+    # the Poisson bootstrap gives the same average, and errors close to the blocked ones
+    combine_files_all_runs.combine_gr(dirname, ".gr", 1, "bootstrap", resamples=4000)
+    resampled = np.loadtxt(os.path.join(dirname, "gr_combined"))
+    resampled_peaks = np.loadtxt(os.path.join(dirname, "gr_peaks"))
+    assert_parity(resampled[:, 1], blocked[:, 1], rtol=1e-6)
+    occupied = blocked[:, 2] > 0
+    assert np.median(np.abs(resampled[occupied, 2] / blocked[occupied, 2] - 1)) < 0.1
+
+    # the shells of the synthetic g(r) are found, with errors that agree between the two methods
+    assert_parity(blocked_peaks[:, 1], [3.6, 7.0], rtol=0.02)
+    assert_parity(resampled_peaks[:, 2], blocked_peaks[:, 2], rtol=0.25)
+
+
+@pytest.mark.parametrize("blocks", [1000, 1013])
+def test_average_all_parity(synthetic, blocks):
+    data = synthetic.energy_series(blocks)
+    assert average_all(data, 20, 7, [1, 2, 3]) == reference_average_all(data, 20, 7, [1, 2, 3])
+
+
+def test_bootstrap_matches_covariance(synthetic, bootstrap_globals):
+    data = synthetic.superfluid_curve(100)
+    x, y, yerr = data.T
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    bounds = ALLOWED_FILETYPES["sf_time"]["bounds"]
+    guess, errors = fit_with_covariance(func, x, y, yerr, 0, len(x), 1, bounds)
+    edges = centred_edges(guess, errors)
+    unit_summaries, generated = fit_with_bootstrap(func, x, y, yerr, 0, len(x), 1, guess, 400, 2, bounds,
+                                                   edges, keep_samples=True)
+    summary = merge_units(unit_summaries, edges)
+    # the bootstrap distribution is centred on the least-squares solution
+    np.testing.assert_allclose(np.mean(generated, axis=0), guess, rtol=0.05)
+    # and the merged worker summaries agree with the raw samples
+    assert summary.count == len(generated)
+    assert_parity(summary.mean, np.mean(generated, axis=0), rtol=1e-10)
+    assert_parity(summary.std, np.std(generated, axis=0), rtol=1e-10)
+
+
+def test_window_scan_matches_curve_fit(synthetic):
+    # warm-started fits of every window are at least as good as cold fits of bootstrap_fit.py, and
+    # give the same C well within its error (G is barely determined by the late windows)
+    x, y, yerr = synthetic.superfluid_curve(100).T
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    bounds = ALLOWED_FILETYPES["sf_time"]["bounds"]
+    windows, results = window_scan.scan_windows(x, y, yerr, "sf_time", 4, 2)
+    assert len(windows) == 16
+    for (start, end), row in zip(windows, results):
+        params, errors = fit_with_covariance(func, x, y, yerr, start, end, 1, bounds)
+        chi2 = np.sum(((y[start:end] - func(x[start:end], *params)) / yerr[start:end]) ** 2) / (end - start - 3)
+        assert row[-1] <= chi2 * (1 + 1e-6)
+        assert abs(row[2] - params[2]) < 0.1 * errors[2]
+
+
+def test_engine_matches_least_squares(tmp_path, synthetic, metropolis_globals):
+    metropolis_globals()
+    data = synthetic.superfluid_curve(160)
+    params, errors = metropolis_fitting.engine(data, 40, 250, "sf_time", str(tmp_path))
+    x, y, yerr = data.T
+    start, end = metropolis_fitting.select_interval(x, y, "", True, True, 0)
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    bounds = ALLOWED_FILETYPES["sf_time"]["bounds"]
+    guess, guess_err = fit_with_covariance(func, x, y, yerr, start, end, 1, bounds)
+    # the asymptotic superfluid fraction is what the paper reports
+    assert abs(params[-1] - guess[-1]) < 5 * guess_err[-1]
+
+
+@pytest.mark.parametrize("extension", [".sd", ".en", ".sq", ".vis"])
+def test_loader_parity(synthetic, extension):
+    dirname = synthetic.ensemble("small", blocks=50, num_q=20, num_particles=2)
+    filename = synthetic.run_files(dirname, extension)[0]
+    reference = np.loadtxt(filename)
+    assert_parity(loaders.load_columns(filename), reference, rtol=0)
+    assert_parity(loaders.bulk_parse(filename), reference, rtol=0)
+    column = loaders.load_columns(filename, usecols=2)
+    assert column.flags["C_CONTIGUOUS"]
+    assert_parity(column, reference[:, 2], rtol=0)
+
+
+@pytest.mark.parametrize("filetype", ["sf_proj_time", "en_time_step"])
+def test_batched_fit_parity(filetype):
+    rng = np.random.default_rng(3)
+    func = ALLOWED_FILETYPES[filetype]["fit"]
+    x = np.array([0.25, 0.5, 1.0, 1.5, 2.0])
+    truth = [0.3, -0.2, 3.0] if filetype == "sf_proj_time" else [-140.0, 2.0]
+    yerr = np.full(x.size, 0.005)
+    samples = func(x, *truth) + rng.normal(scale=yerr, size=(50, x.size))
+    guess, _ = curve_fit(func, x, samples.mean(axis=0), sigma=yerr)
+    params, converged = batched_fit(func, x, samples, yerr, guess)
+    assert converged.all()
+    # one reference fit per joint sample row
+    reference = np.array([curve_fit(func, x, row, p0=guess, sigma=yerr, xtol=1e-12, ftol=1e-12)[0]
+                          for row in samples])
+    assert_parity(params, reference, rtol=1e-4, atol=1e-6)
+
+
+def test_coarse_grain_parity(synthetic):
+    x, y, yerr = synthetic.superfluid_curve(640).T
+    cx, cy, cerr = coarse_grain(x, y, yerr, 100)
+    assert len(cx) == 100
+    # reference: error-weighted mean of every bin, one bin at a time
+    edges = np.append((np.arange(100) * len(x)) // 100, len(x))
+    for i, (a, b) in enumerate(zip(edges[:-1], edges[1:])):
+        w = 1 / yerr[a:b] ** 2
+        assert_parity([cx[i], cy[i], cerr[i]],
+                      [np.average(x[a:b], weights=w), np.average(y[a:b], weights=w), 1 / np.sqrt(w.sum())],
+                      rtol=1e-12)
+    # the coarse-grained fit agrees with the fit to every point
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    bounds = ALLOWED_FILETYPES["sf_time"]["bounds"]
+    full, full_err = fit_with_covariance(func, x, y, yerr, 0, len(x), 1, bounds)
+    coarse, _ = fit_with_covariance(func, cx, cy, cerr, 0, len(cx), 1, bounds)
+    assert abs(coarse[-1] - full[-1]) < 0.5 * full_err[-1]
+
+
+def test_block_kernel_parity(synthetic):
+    pytest.importorskip("numba")
+    x, y, yerr = synthetic.superfluid_curve(100).T
+    func = ALLOWED_FILETYPES["sf_time"]["fit"]
+    guess, _ = fit_with_covariance(func, x, y, yerr, 0, len(x), 1, ALLOWED_FILETYPES["sf_time"]["bounds"])
+    rng = np.random.default_rng(5)
+    variates = (rng.integers(0, 3, size=2000), rng.random(2000), rng.random(2000))
+    steps = rng.normal(scale=[0.005, 0.5, 0.005], size=(2000, 3))
+    runners = [metropolis_kernels.get_block_runners(backend, func) for backend in ["numpy", "numba"]]
+    traces = np.empty((4, 2000, 3))
+    results = [run_block(model, x, y, 1 / yerr ** 2, guess, np.array([0.01, 1.0, 0.01]), *variates, traces[k])
+               for k, (run_block, _, model) in enumerate(runners)]
+    joint = [run_block_joint(model, x, y, 1 / yerr ** 2, guess, steps, variates[2], traces[2 + k])
+             for k, (_, run_block_joint, model) in enumerate(runners)]
+    # same variates, same decisions: the compiled kernels follow the NumPy chains exactly
+    assert_parity(results[0][0], results[1][0], rtol=1e-12)
+    np.testing.assert_array_equal(results[0][1], results[1][1])
+    np.testing.assert_array_equal(results[0][2], results[1][2])
+    assert_parity(traces[0], traces[1], rtol=1e-12)
+    assert_parity(traces[2], traces[3], rtol=1e-12)
+    assert joint[0][1] == joint[1][1]
+
+
+def test_default_backend_reproduces_engine(tmp_path, synthetic, metropolis_globals):
+    # the default backend draws the same random numbers in the same order as the original engine
+    metropolis_globals(backend=metropolis_kernels.DEFAULT_BACKEND, max_points=60)
+    data = synthetic.superfluid_curve(160)
+    params, errors = metropolis_fitting.engine(data, 6, 50, "sf_time", str(tmp_path))
+
+    model = ALLOWED_FILETYPES["sf_time"]
+    x, y, yerr = data.T
+    start, end = metropolis_fitting.select_interval(x, y, "", True, True, 0)
+    skip = int(np.ceil((end - start) / 60))
+    x, y, yerr = x[start:end:skip], y[start:end:skip], yerr[start:end:skip]
+    guess, _ = curve_fit(model["fit"], x, y, sigma=yerr, absolute_sigma=True, bounds=model["bounds"])
+    reference = reference_metropolis(x, y, yerr, guess, list(model["displacements"]), 6, 50, model["fit"],
+                                     np.random.default_rng(927))
+    assert_parity(params, np.mean(reference, axis=0), rtol=1e-12, atol=0)
+    assert_parity(errors, np.std(reference, axis=0), rtol=1e-12, atol=0)
+
+
+def test_engine_backend_parity(tmp_path, synthetic, metropolis_globals):
+    data = synthetic.superfluid_curve(160)
+    estimates = {}
+    for backend in ["python", "auto"]:
+        metropolis_globals(backend=backend)
+        estimates[backend] = metropolis_fitting.engine(data, 40, 250, "sf_time", str(tmp_path))
+    (reference, reference_err), (params, _) = estimates["python"], estimates["auto"]
+    assert np.all(np.abs(params - reference) < 5 * reference_err + 1e-3 * np.abs(reference))
+
+
+def test_adaptive_proposals_match_single(tmp_path, synthetic, metropolis_globals):
+    data = synthetic.superfluid_curve(160)
+    estimates = {}
+    for proposal in ["single", "adaptive"]:
+        metropolis_globals(backend="numpy", proposal=proposal, burn_in=10)
+        estimates[proposal] = metropolis_fitting.engine(data, 40, 250, "sf_time", str(tmp_path))
+    (reference, reference_err), (params, _) = estimates["single"], estimates["adaptive"]
+    assert np.all(np.abs(params - reference) < 5 * reference_err + 1e-3 * np.abs(reference))
+
+
+def test_linear_fit_parity():
+    # en_time_step is linear in E_0 and A: closed form and bootstrap match curve_fit and its covariance
+    rng = np.random.default_rng(4)
+    x = np.array([0.00125, 0.0025, 0.005, 0.01, 0.02])
+    yerr = np.full(len(x), 0.01)
+    y = -140 + 3e6 * x ** 4 + rng.normal(scale=yerr)
+    model = ALLOWED_FILETYPES["en_time_step"]
+    reference, covariance = curve_fit(model["fit"], x, y, p0=[-140, 1e6], sigma=yerr, absolute_sigma=True)
+    params, errors = linear_fit(model["basis"](x), y, yerr)
+    assert_parity(params, reference, rtol=1e-6)
+    assert_parity(errors, np.sqrt(np.diag(covariance)), rtol=1e-5)
+    edges = centred_edges(params, errors)
+    summary = merge_units(linear_bootstrap(model["basis"](x), y, yerr, 200000, edges)[0], edges)
+    assert_parity(summary.mean, reference, rtol=1e-4, atol=0)
+    assert_parity(summary.std, np.sqrt(np.diag(covariance)), rtol=1e-2)
+
+
+def test_streaming_summary_parity():
+    # summaries of chunks, merged in any grouping, match the statistics of the whole sample
+    rng = np.random.default_rng(6)
+    samples = np.column_stack([rng.normal(size=60000), rng.exponential(size=60000)])
+    edges = centred_edges([0, 1], [1, 1], bins=100, width=5)
+    whole = StreamingSummary(edges)
+    whole.add(samples)
+    merged = StreamingSummary(edges)
+    for chunk in np.array_split(samples, 7):
+        part = StreamingSummary(edges)
+        part.add(chunk)
+        merged.merge(part)
+    for summary in [whole, merged]:
+        assert_parity(summary.mean, np.mean(samples, axis=0), rtol=1e-12)
+        assert_parity(summary.std, np.std(samples, axis=0), rtol=1e-12)
+        np.testing.assert_array_equal(summary.counts[0, 1:-1], np.histogram(samples[:, 0], bins=edges[0])[0])
+        q = [0.001, 0.16, 0.5, 0.84, 0.999]
+        assert_parity(summary.quantile(q), np.quantile(samples, q, axis=0), rtol=0.01, atol=0.02)
+
+
+def test_summarize_chunks_parity():
+    # chunks summarized at once match the summaries of StreamingSummary.add, a chunk at a time
+    rng = np.random.default_rng(7)
+    samples = np.column_stack([rng.normal(size=2337), rng.exponential(size=2337)])
+    sizes = [1000, 1000, 300, 37]
+    edges = centred_edges([0, 1], [1, 1], bins=100, width=5)
+    start = 0
+    for size, summary in zip(sizes, summarize_chunks(samples, sizes, edges)):
+        reference = StreamingSummary(edges)
+        reference.add(samples[start:start + size])
+        start += size
+        assert summary.count == reference.count
+        for name in ["mean", "m2", "minimum", "maximum"]:
+            assert_parity(getattr(summary, name), getattr(reference, name), rtol=1e-12, atol=0)
+        np.testing.assert_array_equal(summary.counts, reference.counts)
+        for (means, weights), (reference_means, reference_weights) in zip(summary.centroids, reference.centroids):
+            np.testing.assert_array_equal(weights, reference_weights)
+            assert_parity(means, reference_means, rtol=1e-12, atol=0)
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+
+import render_plots
+
+
+"""
+Tests of the batch plot renderer
+"""
+
+
+def test_render_plots_skips_up_to_date(synthetic):
+    dirname = synthetic.ensemble("small")
+    run_dirs = render_plots.find_run_directories(os.path.dirname(dirname))
+    assert len(run_dirs) == 4
+    rendered, skipped, _ = render_plots.render_run(run_dirs[0])
+    assert (rendered, skipped) == (5, 0)
+    assert os.path.exists(os.path.join(run_dirs[0], "images", "synthetic.he_total.png"))
+    # only the file that changed since its images were drawn is plotted again
+    source = os.path.join(run_dirs[0], "synthetic.he.en")
+    os.utime(source, ns=(os.stat(source).st_atime_ns, os.stat(source).st_mtime_ns + 10 ** 10))
+    assert render_plots.render_run(run_dirs[0])[:2] == (1, 4)
+
+
+def test_render_plots_iseed_records_and_unreadable_files(tmp_path, monkeypatch, capsys):
+    run_dir = tmp_path / "run_1"
+    run_dir.mkdir()
+    np.savetxt(run_dir / "synthetic.iseed", np.linspace(0.05, 0.95, 20))
+    drawn = []
+    draw_histogram = render_plots.draw_histogram
+
+    def recording(values, num_records, **kwargs):
+        drawn.append(values)
+        draw_histogram(values, num_records, **kwargs)
+    monkeypatch.setattr(render_plots, "draw_histogram", recording)
+    assert render_plots.render_run(str(run_dir))[:2] == (1, 0)
+    # gnuplot's `every ::1::records-5` plots records 1 to 15 of 0 to 19
+    np.testing.assert_array_equal(drawn[0], np.linspace(0.05, 0.95, 20)[1:16])
+
+    # a file that cannot be read is reported and left for the next pass
+    def unreadable(data_file, stem):
+        raise PermissionError(13, "Permission denied", data_file)
+    monkeypatch.setitem(render_plots.PLOTS, ".iseed", (unreadable, ["_variates"]))
+    assert render_plots.render_run(str(run_dir), force=True)[:2] == (0, 0)
+    assert f"Could not plot {run_dir / 'synthetic.iseed'}" in capsys.readouterr().out
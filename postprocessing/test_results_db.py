@@ -0,0 +1,43 @@
+import multiprocessing
+
+import results_db
+
+
+"""
+Tests of the results store
+"""
+
+
+def write_results(db, filename, observable):
+    results_db.write_records(db, results_db.make_records(filename, observable, "blocking", ["kinetic", "total"],
+                                                         [1.0, 2.0], [0.1, 0.2], 0.5))
+
+
+def test_results_db_concurrent_writes(synthetic, tmp_path):
+    dirname = synthetic.ensemble("small", blocks=20, num_q=5, num_particles=1)
+    db = str(tmp_path / "results.sqlite")
+    filename = sorted(synthetic.run_files(dirname, ".en"))[0]
+    # concurrent jobs writing to one store: every batch lands, none is lost to a locked database
+    with multiprocessing.Pool(4) as pool:
+        pool.starmap(write_results, [(db, filename, f"energy_{n}") for n in range(40)])
+
+    rows = results_db.query(db, ["project", "beta", "tau", "slices", "parameter", "value"], {"observable": "energy_7"})
+    # runs sit in <project>/<parameter directory>/run_N
+    project = tmp_path.name
+    assert rows == [(project, 0.25, 0.25 / 40, 40, "kinetic", 1.0), (project, 0.25, 0.25 / 40, 40, "total", 2.0)]
+    assert len(results_db.query(db, ["id"], {"method": "blocking"})) == 80
+
+    # the store keeps the rollback journal, which works on network filesystems
+    conn = results_db.connect(db)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    conn.close()
+
+    # a regenerated input file only keeps its newest rows
+    write_results(db, filename, "energy_7")
+    with open(filename, "a") as f:
+        f.write("\n")
+    write_results(db, filename, "energy_7")
+    assert len(results_db.query(db, ["input_hash"], {"observable": "energy_7"})) == 6
+    assert len(results_db.query(db, ["id"], {"observable": "energy_7"}, latest=True)) == 2
+    table = results_db.format_tsv(["parameter", "error"], results_db.query(db, ["parameter", "error"], {"observable": "energy_7"}, latest=True))
+    assert table == "parameter\terror\nkinetic\t0.1\ntotal\t0.2\n"
@@ -0,0 +1,34 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import shared_data
+
+
+"""
+Tests of the datasets shared with pool workers
+"""
+
+
+def shared_sum(key):
+    array = shared_data.arrays()[key]
+    return float(np.sum(array)), array.flags.writeable
+
+
+def test_shared_arrays_reach_pool_workers():
+    rng = np.random.default_rng(3)
+    factor = rng.normal(size=(50, 50))
+    data = {"y": rng.normal(size=1001), "cholesky": np.linalg.cholesky(factor @ factor.T + 50 * np.eye(50)),
+            "counts": np.arange(7, dtype=np.int64)}
+    block, layout = shared_data.create(data)
+    try:
+        with multiprocessing.Pool(2, initializer=shared_data.attach_worker, initargs=(block.name, layout)) as pool:
+            results = pool.map(shared_sum, list(data))
+    finally:
+        shared_data.release(block)
+
+    # workers see the parent's data, read-only, and the block is gone once released
+    assert results == [(float(np.sum(array)), False) for array in data.values()]
+    with pytest.raises(FileNotFoundError):
+        shared_data.attach(block.name, layout)
@@ -0,0 +1,25 @@
+import numpy as np
+
+import vis_density
+
+
+"""
+Tests of the streamed bead densities of .vis files
+"""
+
+
+def test_vis_histograms_parity(synthetic):
+    dirname = synthetic.ensemble("small")
+    filename = synthetic.run_files(dirname, "vis")[0]
+    beads = np.loadtxt(filename)
+    z_edges = np.linspace(0, 15, 151)
+    x_edges, y_edges = np.linspace(0, 25.56, 41), np.linspace(0, 24.59, 41)
+    # small chunks, so the streamed histograms are summed over many chunks
+    z_counts, xy_counts, outside, decimated, _ = vis_density.process_run(filename, z_edges, x_edges, y_edges,
+                                                                         max_points=500, chunk_rows=777)
+    np.testing.assert_array_equal(z_counts, np.histogram(beads[:, 2], bins=z_edges)[0])
+    x, y = np.mod(beads[:, 0], 25.56), np.mod(beads[:, 1], 24.59)
+    np.testing.assert_array_equal(xy_counts, np.histogram2d(x, y, bins=(x_edges, y_edges))[0])
+    assert 250 < len(decimated) <= 500
+    stride = len(beads) // len(decimated)
+    np.testing.assert_array_equal(decimated, beads[::stride][:len(decimated)])
@@ -0,0 +1,198 @@
+import argparse
+import multiprocessing as mp
+import os
+from itertools import islice
+
+import numpy as np
+
+import instrumentation
+from ensemble_index import load_index, files_with_extension, run_config, scan_run
+
+
+"""
+Density histograms and decimated worldlines from the .vis worldline files (x y z per bead).
+Every file is streamed in chunks of fixed size into fixed-bin histograms, a 1d histogram of z and
+a 2d histogram of (x, y), so memory does not grow with the number of slices or particles. A
+bounded, evenly decimated subset of the beads is kept for interactive viewing with gnuplot.
+Runs are processed in parallel, and their histograms are summed into ensemble histograms
+"""
+
+
+# number of beads parsed at a time
+CHUNK_ROWS = 200000
+
+
+"""
+Read a .vis file in chunks of at most `chunk_rows` beads
+"""
+def read_chunks(filename, chunk_rows=CHUNK_ROWS):
+    instrumentation.count_file(filename)
+    with open(filename) as f:
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                break
+            chunk = np.loadtxt(lines, usecols=(0, 1, 2), ndmin=2)
+            if len(chunk):
+                yield chunk
+
+
+"""
+Keep every `stride`-th bead of a stream, doubling the stride whenever more than `max_points`
+beads are kept: the subset stays evenly spread along the worldlines and bounded in size
+"""
+class Decimator:
+
+    def __init__(self, max_points):
+        self.max_points = max_points
+        self.stride = 1
+        self.seen = 0
+        self.kept = []
+
+    def add(self, chunk):
+        offset = (-self.seen) % self.stride
+        self.kept.append(chunk[offset::self.stride])
+        self.seen += len(chunk)
+
+        while sum(len(k) for k in self.kept) > self.max_points:
+            # beads kept so far sit at multiples of the old stride: keep every other one of them
+            kept = np.concatenate(self.kept)
+            self.kept = [kept[::2]]
+            self.stride *= 2
+
+    def result(self):
+        return np.concatenate(self.kept) if self.kept else np.empty((0, 3))
+
+
+"""
+Stream a single .vis file into its histograms and decimated worldlines
+"""
+def process_run(filename, z_edges, x_edges, y_edges, max_points, chunk_rows=CHUNK_ROWS):
+    """
+    filename - path to the .vis file
+    z_edges - bin edges of the z histogram
+    x_edges, y_edges - bin edges of the (x, y) histogram
+    max_points - maximum number of beads in the decimated worldlines
+    chunk_rows - number of beads parsed at a time
+
+    return:
+    z_counts - counts of the z histogram
+    xy_counts - counts of the (x, y) histogram
+    outside - number of beads outside the z range, i.e. evaporated or below the substrate
+    decimated - decimated beads, at most `max_points` rows
+    counters - instrumentation counters of this worker
+    """
+    instrumentation.reset()
+    z_counts = np.zeros(len(z_edges) - 1, dtype=np.int64)
+    xy_counts = np.zeros((len(x_edges) - 1, len(y_edges) - 1), dtype=np.int64)
+    outside = 0
+    decimator = Decimator(max_points)
+
+    for chunk in read_chunks(filename, chunk_rows):
+        # the beads are wrapped into the periodic cell before binning in the plane
+        x = np.mod(chunk[:, 0] - x_edges[0], x_edges[-1] - x_edges[0]) + x_edges[0]
+        y = np.mod(chunk[:, 1] - y_edges[0], y_edges[-1] - y_edges[0]) + y_edges[0]
+
+        z_counts += np.histogram(chunk[:, 2], bins=z_edges)[0]
+        xy_counts += np.histogram2d(x, y, bins=(x_edges, y_edges))[0].astype(np.int64)
+        outside += np.count_nonzero((chunk[:, 2] < z_edges[0]) | (chunk[:, 2] > z_edges[-1]))
+        decimator.add(chunk)
+
+    return z_counts, xy_counts, outside, decimator.result(), instrumentation.snapshot()
+
+
+"""
+Write the histograms normalized to densities: the z histogram as 'z density' columns, the (x, y)
+histogram as 'x y density' rows with a blank line between x values (gnuplot pm3d format)
+"""
+def save_histograms(prefix, z_counts, xy_counts, z_edges, x_edges, y_edges):
+    total = max(np.sum(z_counts), 1)
+    z_centres = 0.5 * (z_edges[1:] + z_edges[:-1])
+    np.savetxt(prefix + "_zhist", np.column_stack([z_centres, z_counts / (total * np.diff(z_edges))]),
+               fmt="%.6e", delimiter="\t", header="z  density")
+
+    areas = np.outer(np.diff(x_edges), np.diff(y_edges))
+    density = xy_counts / (max(np.sum(xy_counts), 1) * areas)
+    x_centres = 0.5 * (x_edges[1:] + x_edges[:-1])
+    y_centres = 0.5 * (y_edges[1:] + y_edges[:-1])
+    with open(prefix + "_xyhist", "w") as f:
+        f.write("# x  y  density\n")
+        for i, x in enumerate(x_centres):
+            np.savetxt(f, np.column_stack([np.full(len(y_centres), x), y_centres, density[i]]),
+                       fmt="%.6e", delimiter="\t")
+            f.write("\n")
+
+
+"""
+Process all the .vis files of an ensemble (or the given files) in parallel
+"""
+def vis_density(file_list, z_edges, x_edges, y_edges, max_points, cores, ensemble_prefix=""):
+    with instrumentation.span("histograms"):
+        with mp.Pool(processes=min(cores, len(file_list))) as pool:
+            results = pool.starmap(process_run, [(name, z_edges, x_edges, y_edges, max_points) for name in file_list])
+
+    z_total = np.zeros(len(z_edges) - 1, dtype=np.int64)
+    xy_total = np.zeros((len(x_edges) - 1, len(y_edges) - 1), dtype=np.int64)
+
+    with instrumentation.span("save"):
+        for name, (z_counts, xy_counts, outside, decimated, counters) in zip(file_list, results):
+            instrumentation.merge(counters)
+            prefix = os.path.splitext(name)[0]
+            save_histograms(prefix, z_counts, xy_counts, z_edges, x_edges, y_edges)
+            np.savetxt(prefix + "_decimated.dat", decimated, fmt="%.4f")
+            z_total += z_counts
+            xy_total += xy_counts
+
+            if args.verbose:
+                print(f"{name}: {np.sum(z_counts) + outside} beads, {outside} outside z range, "
+                      f"{len(decimated)} kept for viewing")
+
+        if ensemble_prefix:
+            save_histograms(ensemble_prefix, z_total, xy_total, z_edges, x_edges, y_edges)
+
+    return z_total, xy_total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirname", help="ensemble directory containing the runs")
+    parser.add_argument("--filenames", nargs="+", help="process these .vis files instead of all the runs of an ensemble")
+    parser.add_argument("--box", help="periodic cell 'Lx,Ly' for the (x, y) histogram (default: BOX from the .sy file)", default="")
+    parser.add_argument("--z_range", help="'z_min,z_max' of the z histogram", default="0,15")
+    parser.add_argument("--z_bins", type=int, help="number of bins of the z histogram", default=150)
+    parser.add_argument("--xy_bins", type=int, help="number of bins per direction of the (x, y) histogram", default=100)
+    parser.add_argument("--max_points", type=int, help="maximum number of beads kept for viewing per run", default=20000)
+    parser.add_argument("--cores", type=int, help="Number of cores to use in multiprocessing",
+                        default=int(os.environ.get('SLURM_CPUS_PER_TASK', default=1)))
+    parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
+    args = parser.parse_args()
+
+    if args.filenames:
+        file_list = args.filenames
+        config = scan_run(os.path.dirname(os.path.abspath(file_list[0])))["config"]
+    else:
+        index = load_index(args.dirname)
+        file_list = files_with_extension(args.dirname, index, ".vis")
+        config = run_config(index) if file_list else {}
+
+    if not file_list:
+        raise ValueError("No .vis files found")
+
+    if args.box:
+        box = [float(length) for length in args.box.split(",")]
+    elif "BOX" in config:
+        box = [float(length) for length in config["BOX"][:2]]
+    else:
+        raise ValueError("Could not find the BOX directive of a .sy file, please pass --box")
+
+    z_min, z_max = [float(z) for z in args.z_range.split(",")]
+    z_edges = np.linspace(z_min, z_max, args.z_bins + 1)
+    x_edges = np.linspace(0, box[0], args.xy_bins + 1)
+    y_edges = np.linspace(0, box[1], args.xy_bins + 1)
+
+    ensemble_prefix = "" if args.filenames else os.path.join(args.dirname, "vis_combined")
+    vis_density(file_list, z_edges, x_edges, y_edges, args.max_points, args.cores, ensemble_prefix)
+
+    if args.profile:
+        instrumentation.write_report(args.profile)
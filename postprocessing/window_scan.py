@@ -0,0 +1,290 @@
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.optimize import curve_fit
+
+import instrumentation
+from fits import *
+from loaders import load_columns
+
+
+"""
+Stability scan of a fit over a grid of (start, end) windows of the data, e.g. of the asymptotic
+superfluid fraction C of an sf_time fit against the interval choices of bootstrap_fit.py. The
+model has to be linear in all but one of its parameters: for every value of that parameter on a
+grid, the linear parameters of every window follow in closed form from prefix sums of the
+weighted data (variable projection), so all windows and grid values are solved at once. The best
+grid point of a window is the warm start of a short least-squares fit on that window, which
+gives the parameters and their errors. The fits of the windows run in parallel
+"""
+
+
+# number of grid values of the nonlinear parameter
+GRID_POINTS = 400
+
+# grid range of a nonlinear parameter without finite bounds
+DEFAULT_RANGE = (1e-3, 1e3)
+
+# smallest number of points in a window, beyond the number of parameters
+MIN_DOF = 3
+
+
+"""
+Windows (start, end) on a grid: starts in the first half of the data, ends in the second half
+"""
+def window_grid(num_points, scan_points, num_params):
+    """
+    num_points - number of data points
+    scan_points - number of grid values of the start and of the end of a window
+    num_params - number of fitting parameters, windows have at least num_params + MIN_DOF points
+
+    return:
+    starts, ends - grid values of the start (inclusive) and end (exclusive) indices
+    windows - (start, end) of every window, shape (windows, 2)
+    """
+    starts = np.unique(np.linspace(0, num_points // 2, scan_points, endpoint=False).astype(int))
+    ends = np.unique(np.linspace(num_points, num_points // 2, scan_points, endpoint=False).astype(int))[::-1]
+    windows = np.array([(s, e) for s in starts for e in ends if e - s >= num_params + MIN_DOF]).reshape(-1, 2)
+    return starts, ends, windows
+
+
+"""
+Grid of values of the nonlinear parameter, logarithmic between its bounds
+"""
+def parameter_grid(filetype, nonlinear):
+    lower, upper = ALLOWED_FILETYPES[filetype]["bounds"]
+    lower = lower[nonlinear] if np.ndim(lower) else lower
+    upper = upper[nonlinear] if np.ndim(upper) else upper
+    return np.geomspace(max(lower, DEFAULT_RANGE[0]), min(upper, DEFAULT_RANGE[1]), GRID_POINTS)
+
+
+"""
+Solve the linear parameters of every window for every grid value at once
+"""
+def variable_projection(x, y, yerr, basis, grid, windows):
+    """
+    x, y, yerr - data
+    basis - design matrix of the two linear parameters, basis(x, p) for a value p of the nonlinear one
+    grid - values of the nonlinear parameter
+    windows - (start, end) of every window
+
+    return:
+    best - index into `grid` of the smallest chi-squared of every window
+    linear - linear parameters at that grid value, shape (windows, 2)
+    """
+    w = 1 / yerr ** 2
+    b = np.stack([basis(x, p) for p in grid])  # (grid, points, 2)
+
+    # prefix sums along the points of the weighted products entering the normal equations
+    products = np.stack([w * b[..., 0] ** 2, w * b[..., 0] * b[..., 1], w * b[..., 1] ** 2,
+                         w * b[..., 0] * y, w * b[..., 1] * y, np.broadcast_to(w * y ** 2, b.shape[:2])])
+    prefix = np.concatenate([np.zeros(products.shape[:2] + (1,)), np.cumsum(products, axis=-1)], axis=-1)
+    s00, s01, s11, t0, t1, u = prefix[..., windows[:, 1]] - prefix[..., windows[:, 0]]  # each (grid, windows)
+
+    det = s00 * s11 - s01 ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a0 = (s11 * t0 - s01 * t1) / det
+        a1 = (s00 * t1 - s01 * t0) / det
+        chi2 = np.where(np.isfinite(a0) & np.isfinite(a1), u - a0 * t0 - a1 * t1, np.inf)
+    instrumentation.count("model_evaluations", chi2.size)
+
+    best = np.argmin(chi2, axis=0)
+    columns = np.arange(len(windows))
+    return best, np.column_stack([a0[best, columns], a1[best, columns]])
+
+
+"""
+Least-squares fits of a batch of windows, warm started from their variable projection solutions
+"""
+def fit_windows(filetype, x, y, yerr, windows, warm_starts):
+    """
+    return:
+    results - rows of params, errors and chi-squared per degree of freedom (NaN for failed fits)
+    counters - instrumentation counters of this worker
+    """
+    instrumentation.reset()
+    fitting_func = ALLOWED_FILETYPES[filetype]["fit"]
+    bounds = ALLOWED_FILETYPES[filetype]["bounds"]
+    lower, upper = np.broadcast_to(bounds[0], warm_starts.shape[1:]), np.broadcast_to(bounds[1], warm_starts.shape[1:])
+    num_params = warm_starts.shape[1]
+
+    results = np.full((len(windows), 2 * num_params + 1), np.nan)
+    for n, ((start, end), guess) in enumerate(zip(windows, warm_starts)):
+        instrumentation.count("fits_attempted")
+        # keep the warm start strictly inside the bounds
+        span = np.where(np.isfinite(upper - lower), upper - lower, 1)
+        guess = np.clip(guess, lower + 1e-9 * span, upper - 1e-9 * span)
+        try:
+            params, covariance, info, _, _ = curve_fit(fitting_func, x[start:end], y[start:end], p0=guess,
+                                                       sigma=yerr[start:end], absolute_sigma=True, bounds=bounds,
+                                                       full_output=True)
+        except (RuntimeError, ValueError):
+            instrumentation.count("fits_failed")
+            continue
+        instrumentation.count("model_evaluations", info["nfev"])
+        residuals = (y[start:end] - fitting_func(x[start:end], *params)) / yerr[start:end]
+        results[n] = np.r_[params, np.sqrt(np.diag(covariance)), np.sum(residuals ** 2) / (end - start - num_params)]
+
+    return results, instrumentation.snapshot()
+
+
+"""
+Fit every window of the grid
+"""
+def scan_windows(x, y, yerr, filetype, scan_points, cores):
+    """
+    x, y, yerr - data
+    filetype - model to fit, linear in all but one of its parameters
+    scan_points - number of grid values of the start and of the end of a window
+    cores - number of cores to use for multiprocessing
+
+    return:
+    windows - (start, end) of every window
+    results - rows of params, errors and chi-squared per degree of freedom of every window
+    """
+    model = ALLOWED_FILETYPES[filetype]
+    num_params = len(model["param names"])
+    linear = model["linear params"]
+    nonlinear = [i for i in range(num_params) if i not in linear]
+    if len(nonlinear) != 1:
+        raise ValueError(f"Please choose one of: {[f for f, m in ALLOWED_FILETYPES.items() if len(m['param names']) - len(m['linear params']) == 1]}")
+    nonlinear = nonlinear[0]
+
+    _, _, windows = window_grid(len(x), scan_points, num_params)
+    grid = parameter_grid(filetype, nonlinear)
+
+    with instrumentation.span("variable projection"):
+        best, linear_params = variable_projection(x, y, yerr, model["basis"], grid, windows)
+    warm_starts = np.empty((len(windows), num_params))
+    warm_starts[:, linear] = linear_params
+    warm_starts[:, nonlinear] = grid[best]
+
+    with instrumentation.span("fits"):
+        batches = np.array_split(np.arange(len(windows)), max(1, min(cores, len(windows))))
+        with mp.Pool(processes=len(batches)) as pool:
+            outputs = pool.starmap(fit_windows, [(filetype, x, y, yerr, windows[batch], warm_starts[batch])
+                                                 for batch in batches])
+        for _, counters in outputs:
+            instrumentation.merge(counters)
+        results = np.concatenate([output for output, _ in outputs])
+
+    return windows, results
+
+
+"""
+Stability of a parameter over the window grid: the largest change to a neighbouring window on
+the grid, in units of the error of the parameter
+"""
+def stability(windows, values, errors):
+    starts, start_index = np.unique(windows[:, 0], return_inverse=True)
+    ends, end_index = np.unique(windows[:, 1], return_inverse=True)
+    grid = np.full((len(starts) + 2, len(ends) + 2), np.nan)
+    grid[start_index + 1, end_index + 1] = values
+
+    changes = np.stack([np.abs(values - grid[start_index + 1 + di, end_index + 1 + dj])
+                        for di, dj in [(-1, 0), (1, 0), (0, -1), (0, 1)]])
+    # windows missing from the grid (too few points) are not neighbours
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.max(np.where(np.isnan(changes), 0, changes), axis=0) / errors
+
+
+"""
+Recommended window: the most precise among the stable windows with an acceptable fit, otherwise
+the most stable window
+"""
+def recommend(errors, chi2, ratio, dof):
+    """
+    errors - error of the parameter in every window
+    chi2 - chi-squared per degree of freedom of every window
+    ratio - stability of the parameter in every window
+    dof - degrees of freedom of every window
+
+    return:
+    best - index of the recommended window
+    """
+    # a chi-squared per degree of freedom within three standard deviations of one is acceptable
+    acceptable = np.isfinite(errors) & (ratio <= 1) & (chi2 <= 1 + 3 * np.sqrt(2 / dof))
+    if acceptable.any():
+        return np.flatnonzero(acceptable)[np.argmin(errors[acceptable])]
+    return np.nanargmin(np.where(np.isfinite(ratio), ratio, np.nan))
+
+
+"""
+Plot maps of a parameter and of its stability over the window grid
+"""
+def plot_map(x, windows, values, ratio, name, savename):
+    fig, axes = plt.subplots(1, 2, figsize=(11, 4.5))
+    for ax, colour, label in [(axes[0], values, name), (axes[1], np.minimum(ratio, 5), f"stability of {name}")]:
+        points = ax.scatter(x[windows[:, 0]], x[windows[:, 1] - 1], c=colour, marker="s", s=30)
+        fig.colorbar(points, ax=ax, label=label)
+        ax.set_xlabel("window start")
+        ax.set_ylabel("window end")
+    fig.tight_layout()
+    fig.savefig(savename)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filename", help="Name of file containing the data (x, y, error)")
+    parser.add_argument("--filetype", help=f"type of file that is being fit to: {ALLOWED_FILETYPES.keys()}", default="sf_time")
+    parser.add_argument("--scan_points", type=int, help="number of grid values of the start and of the end of the windows", default=20)
+    parser.add_argument("--parameter", help="parameter to map (default: the last one, e.g. C)", default="")
+    parser.add_argument("--cores", type=int, help="Number of cores to use in multiprocessing",
+                        default=int(os.environ.get('SLURM_CPUS_PER_TASK', default=1)))
+    parser.add_argument("--save", action="store_true", help="save the scan table and the stability maps next to the file", default=False)
+    parser.add_argument("--verbose", action="store_true", help="Toggle verbosity level", default=False)
+    parser.add_argument("--profile", help="write a JSON report of timings, counters and peak memory to this file")
+    args = parser.parse_args()
+
+    if args.filetype not in ALLOWED_FILETYPES:
+        raise ValueError(f"Please choose one of: {ALLOWED_FILETYPES.keys()}")
+
+    param_names = ALLOWED_FILETYPES[args.filetype]["param names"]
+    name = args.parameter or param_names[-1]
+    if name not in param_names:
+        raise ValueError(f"Please choose one of: {param_names}")
+    column = param_names.index(name)
+
+    with instrumentation.span("load"):
+        data = load_columns(args.filename, usecols=(0, 1, 2))
+    x, y, yerr = data.T
+
+    windows, results = scan_windows(x, y, yerr, args.filetype, args.scan_points, args.cores)
+    num_params = len(param_names)
+    values, errors = results[:, column], results[:, num_params + column]
+    ratio = stability(windows, values, errors)
+    best = recommend(errors, results[:, -1], ratio, windows[:, 1] - windows[:, 0] - num_params)
+
+    if args.verbose:
+        for (start, end), row, r in zip(windows, results, ratio):
+            print(f"{x[start]:.6g} {x[end - 1]:.6g} {name} = {row[column]:.6g} +- {row[num_params + column]:.3g}, "
+                  f"chi2/dof {row[-1]:.3g}, stability {r:.3g}")
+
+    start, end = windows[best]
+    print(f"{args.filename} {len(windows)} windows, recommended window {x[start]},{x[end - 1]}: "
+          f"{name} = {values[best]} +- {errors[best]} (use --domain {x[start]},{x[end - 1]})")
+
+    if args.save:
+        prefix = os.path.splitext(args.filename)[0] + "_window_scan"
+        with instrumentation.span("save"):
+            header = "start  end  " + "  ".join(param_names) + "  " + "  ".join(f"{p}_err" for p in param_names) \
+                     + "  chi2/dof  stability"
+            np.savetxt(prefix + ".txt", np.column_stack([x[windows[:, 0]], x[windows[:, 1] - 1], results, ratio]),
+                       fmt="%.6e", header=header)
+        with instrumentation.span("plot"):
+            plot_map(x, windows, values, ratio, name, prefix + ".png")
+
+    if args.verbose:
+        print(f"Window scan took {time.perf_counter() - start_time:.2f} seconds")
+
+    if args.profile:
+        instrumentation.write_report(args.profile)